@@ -0,0 +1,68 @@
+"""
+Throughput benchmark for content-defined chunking.
+
+Splits the same in-memory random data into chunks with the
+pure-Python boundary search and, if numpy is installed, with
+the vectorised one, checks that both find the same boundaries
+and reports their throughput.
+
+Usage: python benchmarks/chunker.py [--size MIB] [--avg KIB]
+"""
+
+from __future__ import annotations
+from pathlib import Path
+import argparse, random, sys, time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jbackup.store import chunker
+
+def measure(data: bytes, search, min_size: int, avg_size: int,
+            max_size: int) -> tuple[float, list[int]]:
+    """Return the time in seconds to split DATA with SEARCH, and the chunk sizes."""
+    mask = chunker._boundary_mask(avg_size)
+    view = memoryview(data)
+    sizes: list[int] = []
+    start = time.perf_counter()
+    offset = 0
+    while offset < len(data):
+        rest = view[offset:]
+        if len(rest) <= min_size:
+            cut = len(rest)
+        else:
+            cut = search(rest, min_size, min(len(rest), max_size), mask)
+        sizes.append(cut)
+        offset += cut
+    return time.perf_counter() - start, sizes
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=int, default=16, help='MiB of data to split')
+    parser.add_argument('--avg', type=int, default=chunker.AVG_CHUNK_SIZE // 1024,
+                        help='average chunk size in KiB')
+    args = parser.parse_args()
+
+    data = random.Random(0).randbytes(args.size * 1024 * 1024)
+    avg_size = args.avg * 1024
+    min_size, max_size = avg_size // 4, avg_size * 4
+
+    searches = [('python', chunker._search_python)]
+    if chunker._numpy_gear() is not None:
+        searches.append(('numpy', chunker._search_numpy))
+    else:
+        print("numpy is not installed; only the pure-Python search is measured")
+
+    expected = None
+    print(f"{'search':>7} {'MiB/s':>9} {'chunks':>7}")
+    for name, search in searches:
+        elapsed, sizes = measure(data, search, min_size, avg_size, max_size)
+        if expected is not None and sizes != expected:
+            print(f"{name} found different boundaries", file=sys.stderr)
+            return 1
+        expected = sizes
+        print(f"{name:>7} {args.size / elapsed:9.1f} {len(sizes):7d}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
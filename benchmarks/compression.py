@@ -0,0 +1,68 @@
+"""
+Throughput benchmark for block-parallel compression.
+
+Compresses the same in-memory data with 1, 2, 4, ... threads
+up to the number of CPUs, and reports the throughput and the
+speedup over a single thread.
+
+Usage: python benchmarks/compression.py [--codec gz] [--size MIB]
+"""
+
+from __future__ import annotations
+from pathlib import Path
+import argparse, io, os, random, sys, time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jbackup.archive import open_compressor
+from jbackup.archive.parallel import cpu_count
+
+def make_data(size: int) -> bytes:
+    """Return SIZE bytes of moderately compressible data."""
+    rng = random.Random(0)
+    words = [bytes(rng.choices(range(97, 123), k=rng.randint(3, 10))) for _ in range(4096)]
+    out = bytearray()
+    while len(out) < size:
+        out += b" ".join(rng.choices(words, k=64)) + b"\n"
+        if rng.random() < 0.1:
+            out += os.urandom(256)
+    return bytes(out[:size])
+
+def measure(data: bytes, codec: str, level: int, threads: int) -> float:
+    """Return the time in seconds to compress DATA."""
+    sink = io.BytesIO()
+    start = time.perf_counter()
+    comp = open_compressor(sink, codec, level, threads=threads)
+    view = memoryview(data)
+    for i in range(0, len(data), 65536):
+        comp.write(view[i:i + 65536])
+    comp.close()
+    return time.perf_counter() - start
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--codec', default='gz', choices=('gz', 'bz2', 'xz'))
+    parser.add_argument('--level', type=int, default=6)
+    parser.add_argument('--size', type=int, default=64, help='MiB of data to compress')
+    args = parser.parse_args()
+
+    data = make_data(args.size * 1024 * 1024)
+    counts = [1]
+    while counts[-1] * 2 <= cpu_count():
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpu_count():
+        counts.append(cpu_count())
+
+    base = 0.0
+    print(f"{'threads':>7} {'MiB/s':>9} {'speedup':>8}")
+    for threads in counts:
+        # threads=1 is the single-stream compressor, the baseline
+        elapsed = measure(data, args.codec, args.level, threads)
+        if threads == 1:
+            base = elapsed
+        print(f"{threads:7d} {args.size / elapsed:9.1f} {base / elapsed:8.2f}")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
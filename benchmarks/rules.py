@@ -0,0 +1,93 @@
+"""
+Microbenchmark for looking up values in rules.
+
+Builds a rule with deeply nested tables and compares looking up
+every value with a walk through the nested dictionaries to
+looking it up in the flat index of XDictContainer. Then compares
+loading a rule with many '@type path' entries when type tags are
+converted lazily and eagerly, and in each rule format.
+
+Usage: python benchmarks/rules.py [--depth N] [--width N] [--repeat N]
+"""
+
+from __future__ import annotations
+from pathlib import Path
+import argparse, sys, tempfile, time, timeit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jbackup.utils import XDictContainer
+from jbackup.rules import Rule
+
+def make_tree(depth: int, width: int) -> dict:
+    """Return nested tables DEPTH deep with WIDTH options in each."""
+    def table(level: int) -> dict:
+        node: dict = {f"opt{i}": f"value {level} {i}" for i in range(width)}
+        if level < depth:
+            node['sub'] = table(level + 1)
+        return node
+    return {'action': table(1)}
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--depth', type=int, default=8)
+    parser.add_argument('--width', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--paths', type=int, default=5000,
+                        help="path entries in the rule loaded by the second benchmark")
+    args = parser.parse_args()
+
+    data = make_tree(args.depth, args.width)
+    walk = XDictContainer(data)
+    indexed = XDictContainer(data)
+
+    start = time.perf_counter()
+    indexed.build_index()
+    build = time.perf_counter() - start
+
+    keys = [r.path for r in walk if r.path is not None and '/' in r.path]
+    print(f"{len(keys)} keys, index built in {build * 1e3:.3f}ms")
+
+    for name, ctn in (('walk', walk), ('index', indexed)):
+        get = ctn.get
+        elapsed = timeit.timeit(lambda: [get(k) for k in keys], number=args.repeat)
+        per = elapsed / (args.repeat * len(keys)) * 1e9
+        print(f"{name:>6}: {per:7.1f}ns per lookup")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rulefile = Path(tmp) / 'paths.toml'
+        entries = ",\n".join(f'  "@type path /data/dir{i}/file{i}"' for i in range(args.paths))
+        rulefile.write_text(f"[archive]\ndestination = \"@type path /mnt\"\n"
+                            f"sources = [\n{entries}\n]\n")
+
+        print(f"loading a rule with {args.paths} paths and reading 'archive/destination'")
+        for name, validate in (('lazy', False), ('eager', True)):
+            # Without the rule cache, which always converts everything
+            elapsed = timeit.timeit(
+                lambda: Rule(str(rulefile), validate=validate, cache=False).get('archive/destination'),
+                number=10)
+            print(f"{name:>6}: {elapsed / 10 * 1e3:7.2f}ms")
+
+        # The same rule in each format, without the rule cache
+        import json
+        data = {'archive': {'destination': "@type path /mnt",
+                            'sources': [f"@type path /data/dir{i}/file{i}"
+                                        for i in range(args.paths)]}}
+        json_file = Path(tmp) / 'paths.json'
+        json_file.write_text(json.dumps(data))
+        yaml_file = Path(tmp) / 'paths.yaml'
+        from jbackup.rules.config.yaml_config_adapter import YAMLFile
+        with open(yaml_file, 'wb') as fd:
+            YAMLFile.write_file(fd, data)
+
+        print("loading the same rule in each format, without the rule cache")
+        for f in (rulefile, yaml_file, json_file):
+            elapsed = timeit.timeit(
+                lambda: Rule(str(f), cache=False).get('archive/destination'),
+                number=10)
+            print(f"{f.suffix[1:]:>6}: {elapsed / 10 * 1e3:7.2f}ms")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Benchmark for the filesystem scanner.
+
+Walks a tree with os.walk and fnmatch, as actions used to, and
+with jbackup.scan at 1 and more threads, and reports the time
+each takes. A synthetic tree is created if no path is given.
+
+Usage: python benchmarks/scan.py [PATH] [--exclude PATTERN ...] [--threads N]
+"""
+
+from __future__ import annotations
+from pathlib import Path
+import argparse, fnmatch, os, sys, tempfile, time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from jbackup.scan import scan
+
+def make_tree(root: Path, dirs: int=200, files: int=50) -> None:
+    """Create DIRS directories of FILES small files under ROOT."""
+    for d in range(dirs):
+        sub = root / f"d{d % 10}" / f"dir{d}"
+        sub.mkdir(parents=True, exist_ok=True)
+        for f in range(files):
+            (sub / f"file{f}.{'log' if f % 5 == 0 else 'txt'}").write_bytes(b"x")
+
+def walk_fnmatch(root: Path, patterns: list[str]) -> int:
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if any(fnmatch.fnmatch(path, pat) for pat in patterns):
+                continue
+            os.lstat(path)
+            count += 1
+    return count
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('path', nargs='?', type=Path)
+    parser.add_argument('--exclude', action='append', default=None)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    patterns: list[str] = args.exclude or ['*.log', '*/node_modules', '*.pyc']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = args.path
+        if root is None:
+            root = Path(tmp) / 'tree'
+            make_tree(root)
+
+        timings = [('os.walk + fnmatch', lambda: walk_fnmatch(root, patterns))]
+        for threads in (1, args.threads):
+            timings.append((f"scan, {threads} threads",
+                            lambda t=threads: sum(1 for _ in scan([root], patterns, threads=t))))
+
+        for name, func in timings:
+            start = time.perf_counter()
+            count = func()
+            print(f"{name:>20}: {time.perf_counter() - start:7.3f}s, {count} entries")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
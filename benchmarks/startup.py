@@ -0,0 +1,104 @@
+"""
+Startup-time benchmark for the jbackup command line.
+
+Runs each subcommand in a fresh interpreter with -X importtime,
+and reports the wall time and the cumulative import time of the
+jbackup package. With --check, exits with status 1 if a command
+goes over its budget or imports a module it should not need.
+
+Usage: python benchmarks/startup.py [--repeat N] [--check]
+"""
+
+from __future__ import annotations
+from pathlib import Path
+import argparse, os, re, subprocess, sys, tempfile, time
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# (arguments, budget in milliseconds)
+COMMANDS: list[tuple[list[str], float]] = [
+    (['--path'], 150.0),
+    (['--levels'], 150.0),
+    (['--list-actions'], 150.0),
+    (['--list-rules'], 150.0),
+    (['locate', 'doesnotexist'], 150.0),
+    (['locate', '-r', 'doesnotexist'], 150.0),
+    (['complete', '--firstarg'], 150.0),
+    (['complete', '2', 'jbackup', 'do'], 150.0),
+    (['do', '--help'], 150.0),
+    (['show', '--help'], 150.0),
+    (['create-rule', '--help'], 150.0),
+    (['create-action', '--help'], 150.0),
+]
+
+# None of the commands above need these at startup
+FORBIDDEN_MODULES = ('yaml', 'logging.config', 'tomllib', 'tomli', 'tomli_w')
+
+_re_importtime = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+def run_command(args: list[str], env: dict[str, str]) -> tuple[float, float, set[str]]:
+    """
+    Run jbackup with ARGS once.
+
+    Returns the wall time and the cumulative import time of the
+    jbackup package, both in milliseconds, and the set of modules
+    that were imported.
+    """
+    cmd = [sys.executable, '-X', 'importtime', '-m', 'jbackup', *args]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, cwd=ROOT, capture_output=True, text=True)
+    wall = (time.perf_counter() - start) * 1000
+
+    modules: set[str] = set()
+    import_ms = 0.0
+    for line in proc.stderr.splitlines():
+        m = _re_importtime.match(line)
+        if m is None:
+            continue
+        cumulative, indent, module = int(m.group(2)), m.group(3), m.group(4)
+        modules.add(module)
+        if module.startswith('jbackup') and len(indent) == 1:
+            import_ms += cumulative / 1000
+
+    return wall, import_ms, modules
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs per command; the best is reported')
+    parser.add_argument('--check', action='store_true',
+                        help='fail if a command is over budget')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply every budget by this factor')
+    args = parser.parse_args()
+
+    failures: list[str] = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ, JBACKUP_CACHE_DIR=tmpdir)
+
+        print(f"{'command':<32} {'wall ms':>9} {'import ms':>10} {'budget':>8}")
+        for cmdargs, budget in COMMANDS:
+            budget *= args.scale
+            results = [run_command(cmdargs, env) for _ in range(max(args.repeat, 1))]
+            wall, import_ms, modules = min(results, key=lambda r: r[0])
+
+            name = ' '.join(cmdargs)
+            print(f"{name:<32} {wall:9.1f} {import_ms:10.1f} {budget:8.0f}")
+
+            if wall > budget:
+                failures.append(f"{name}: {wall:.1f} ms is over the budget of {budget:.0f} ms")
+            bad = sorted(modules.intersection(FORBIDDEN_MODULES))
+            if bad:
+                failures.append(f"{name}: imports {', '.join(bad)}")
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+
+    if args.check and failures:
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
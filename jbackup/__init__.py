@@ -7,28 +7,25 @@ Environment Variables:
 
 from __future__ import annotations
 from pathlib import Path
+from typing import TYPE_CHECKING
 import argparse, sys as _sys, functools
-from .logging import _init_root_logger, Level
+from .logging import Level
 from ._path import DATAPATHS
+from ._index import get_index
+
+if TYPE_CHECKING:
+    from typing import Callable
 
 __version__ = '1.0b1'
 __author__ = 'John Russell'
 
-@functools.cache
 def _find_file_by_stem(subdir: str, name: str) -> Path | None:
-    def _check(root: Path) -> Path | None:
-        _dir = root / subdir
-        for _file in _dir.glob("*.*"):
-            if _file.stem == name:
-                return _file
-
-    res = _check(DATAPATHS['system'])
-    if res: return res
+    # Builtin actions and rules can be overridden by the other paths
+    for where in ('system', 'user', 'builtin'):
+        res = get_index(where, subdir).lookup(name)
+        if res: return res
 
-    res = _check(DATAPATHS['user'])
-    if res: return res
-
-    return res
+    return None
 
 def find_rule(name: str) -> Path | None:
     """
@@ -39,6 +36,27 @@ def find_rule(name: str) -> Path | None:
     """
     return _find_file_by_stem('rules', name)
 
+def find_rules(pattern: str) -> list[tuple[str, Path]]:
+    """
+    Find the rules whose names match the glob PATTERN.
+
+    Returns a list of (name, path) pairs sorted by name. As with
+    find_rule(), a rule in an earlier data path hides a rule
+    with the same name in a later one.
+    """
+    import fnmatch
+
+    found: dict[str, Path] = {}
+    for where in ('system', 'user', 'builtin'):
+        index = get_index(where, 'rules')
+        for name in index.names():
+            if name not in found and fnmatch.fnmatchcase(name, pattern):
+                path = index.lookup(name)
+                if path is not None:
+                    found[name] = path
+
+    return sorted(found.items())
+
 def find_action(name: str) -> Path | None:
     """
     Find an action with the given name.
@@ -48,18 +66,36 @@ def find_action(name: str) -> Path | None:
     """
     return _find_file_by_stem('actions', name)
 
-def list_files(subdir: str, glob: str) -> list[str]:
+def list_files(subdir: str, glob: str, describe: bool=False) -> list[str]:
+    """
+    List the files under SUBDIR of each data path that match GLOB.
+
+    If DESCRIBE is true, the files are actions and each one is
+    followed by the first line of its documentation, which is
+    read without loading the action.
+    """
     res: list[str] = []
 
-    for k in ('system', 'user'):
-        _dir = DATAPATHS[k] / subdir
+    for k in DATAPATHS:
         res.append(k)
-        res.extend(
-            [f"  {x.stem}" for x in _dir.glob(glob)])
+        index = get_index(k, subdir)
+        for name in index.names(glob):
+            summary = _describe_action(index.directory / f"{name}.py") if describe else ""
+            res.append(f"  {name} -- {summary}" if summary else f"  {name}")
 
     return res
 
-list_actions = functools.partial(list_files, 'actions', '*.py')
+def _describe_action(path: Path) -> str:
+    from .actions.introspect import read_action_info
+
+    try:
+        info = read_action_info(path)
+    except (OSError, SyntaxError):
+        return ""
+
+    return info.summary if info else ""
+
+list_actions = functools.partial(list_files, 'actions', '*.py', describe=True)
 list_rules = functools.partial(list_files, 'rules', '*.*')
 
 def list_loglevels() -> list[str]: # pragma: no cover
@@ -94,15 +130,16 @@ class ListAvailableAction(argparse.Action): # pragma: no cover
                  option_strings,
                  dest,
                  _type: str,
-                 values: list,
+                 values: Callable[[], list[str]],
                  **kw):
         super().__init__(option_strings, dest, **kw)
         self.__type = _type # pyright: ignore
-        self.__dirs = values
+        self.__values = values
 
     def __call__(self, parser, namespace, values, option_string, *, msg: str): # pyright: ignore
+        # The values are only listed when the option is used
         formatter = parser._get_formatter()
-        msg += "\n%s\n" % "\n".join([self.INDENT + x for x in self.__dirs])
+        msg += "\n%s\n" % "\n".join([self.INDENT + x for x in self.__values()])
         formatter.add_text(msg)
         parser._print_message(msg, _sys.stdout)
         parser.exit()
@@ -112,19 +149,19 @@ class ListLoglevelsAction(ListAvailableAction):
                  required=False, **kw):
         super().__init__(option_strings, dest, _type='log levels',
                          nargs=nargs, default=default, required=required,
-                         values=list_loglevels(),
-                         help='list available actions and exit', **kw)
+                         values=list_loglevels,
+                         help='list available log levels and exit', **kw)
 
     def __call__(self, parser, namespace, values, option_string=None):
         super().__call__(parser, namespace, values, option_string,
-                         msg="Available actions:")
+                         msg="Available log levels:")
 
 class ListAvailableActionsAction(ListAvailableAction):
     def __init__(self, option_strings, dest, default=None, nargs=0,
                  required=False, **kw):
         super().__init__(option_strings, dest, _type='actions',
                          nargs=nargs, default=default, required=required,
-                         values=list_actions(),
+                         values=list_actions,
                          help='list available actions and exit', **kw)
 
     def __call__(self, parser, namespace, values, option_string=None):
@@ -136,11 +173,10 @@ class ListAvailableRulesAction(ListAvailableAction): # pragma: no cover
                  required=False, **kw):
         super().__init__(option_strings, dest, _type='rules',
                          nargs=nargs, default=default, required=required,
-                         values=list_rules(),
+                         values=list_rules,
                          help='list available rules and exit', **kw)
 
     def __call__(self, parser, namespace, values, option_string=None):
         super().__call__(parser, namespace, values, option_string,
                          msg="Available rules:")
 
-_init_root_logger()
@@ -7,10 +7,12 @@ from . import (ListAvailableActionsAction, ListAvailableRulesAction,
                find_rule, find_action)
 from typing import Callable
 from .logging import get_logger
-from .rules import Rule
 from ._complete import _complete, FirstArgAction
 from ._path import get_data_path
-import sys
+from ._index import index_file
+from .rules.config import format_names
+from pathlib import Path
+import os, sys, time
 
 _SubcommandFunction = Callable[[Namespace], int]
 
@@ -27,7 +29,7 @@ def exit_with_code(f: Callable[[Namespace], int | None]) -> _SubcommandFunction:
 @exit_with_code
 def show(args: Namespace) -> int:
     "Function for subcommand 'show'."
-    from .actions import load_action, get_action_info
+    from .actions import load_action, get_action_info, read_action_info
 
     logger = get_logger('')
 
@@ -41,8 +43,19 @@ def show(args: Namespace) -> int:
 
     logger.info("found action class in %s", actionfile)
 
-    cls = load_action(actionfile, action)
-    docstring = get_action_info(cls)
+    # Read the action's documentation without running it if possible
+    info = None
+    try:
+        info = read_action_info(actionfile)
+    except SyntaxError as exc:
+        logger.debug("cannot parse %s: %s", actionfile, exc)
+
+    if info is None:
+        logger.debug("loading %s to document it", actionfile)
+        docstring = get_action_info(load_action(actionfile, action))
+    else:
+        docstring = get_action_info(info)
+
     print(f"Information for {action}:\nLocated at {actionfile}\n{docstring}")
 
     return 0
@@ -78,6 +91,7 @@ def create_action(args: Namespace) -> int:
 
     if not outfile: return 1
 
+    index_file(Path(outfile))
     logger.info("written action to %s", outfile)
 
     return 0
@@ -119,6 +133,7 @@ def create_rule(args: Namespace):
         logger.error("Unable to write '%s'", rulefile)
         return 1
 
+    index_file(Path(outfile))
     logger.info("written rule to %s", outfile)
 
     return 0
@@ -126,35 +141,356 @@ def create_rule(args: Namespace):
 @exit_with_code
 def do(args: Namespace) -> int:
     """Function for subcommand 'do'."""
-    from .actions import load_action
-    from . import find_rule
+    from .actions.runner import run_action
 
     logger = get_logger('')
 
-    actionname: str = args.ACTION
-    logger.debug("show action '%s'", actionname)
+    if not args.RULE and not args.all:
+        logger.error("no rules given, name some or use --all")
+        return 1
 
-    # Get action file
-    actionfile = find_action(actionname)
-    if actionfile is None:
-        logger.error("no action called '%s' exists", actionname)
+    if args.no_cache:
+        # Through the environment, so that worker processes see it too
+        os.environ['JBACKUP_NO_RULE_CACHE'] = '1'
+
+    # A running daemon has the action and rules loaded already
+    if not args.no_daemon and not args.no_cache:
+        from .daemon import submit_job
+        code = submit_job(args.ACTION, args.RULE, all_rules=args.all, jobs=args.jobs)
+        if code is not None:
+            return code
+
+    return run_action(args.ACTION, args.RULE, all_rules=args.all, jobs=args.jobs)
+
+@exit_with_code
+def daemon(args: Namespace) -> int:
+    """Function for subcommand 'daemon'."""
+    from .daemon import Daemon, DaemonError, request, socket_path
+
+    logger = get_logger('')
+    path: Path = args.socket or socket_path()
+
+    if args.command is None:
+        try:
+            Daemon(path, poll_interval=args.poll).serve_forever()
+        except DaemonError as exc:
+            logger.error("%s", exc)
+            return 1
+        return 0
+
+    try:
+        reply = request({'cmd': args.command}, path, timeout=30)
+    except (OSError, DaemonError) as exc:
+        logger.error("could not reach the daemon at %s: %s", path, exc)
         return 1
 
-    logger.info("found action class in %s", actionfile)
+    if not reply.get('ok'):
+        logger.error("%s", reply.get('error'))
+        return 1
+
+    if args.command == 'status':
+        print(f"pid {reply['pid']}, up {reply['uptime']:.0f}s, {reply['jobs_run']} jobs run")
+        for job in reply['schedules']:
+            print(f"{job['rule']}: {job['action']} at '{job['schedule']}', next {job['next']}")
+    elif args.command == 'reload':
+        for name in reply['reloaded']:
+            print(f"reloaded {name}")
+
+    return 0
+
+@exit_with_code
+def diff(args: Namespace) -> int:
+    """Function for subcommand 'diff'."""
+    from .rules import Rule
+    from .store import StoreError, list_snapshots, read_snapshot
 
-    # Load action and rules
-    cls = load_action(actionfile, actionname)
+    logger = get_logger('')
 
-    rules: list[str] = args.RULE
-    for name in rules:
-        rulefile = find_rule(name)
+    rulename: str = args.RULE
+    repository: Path | None = args.repository
+    if repository is None:
+        rulefile = find_rule(rulename)
         if rulefile is None:
-            logger.error("this rule does not exist: %s", name)
-            continue
-        rule = Rule(str(rulefile))
-        action = cls(rule)
-        logger.debug("loaded action %s with rule %s", actionname, name)
-        action.run()
+            logger.error("no rule called '%s' exists", rulename)
+            return 1
+        repository = Rule(str(rulefile)).get('/snapshot/repository', None, True)
+        if not repository:
+            logger.error("rule %s has no snapshot repository; use --repository", rulename)
+            return 1
+        repository = Path(repository).expanduser()
+
+    # By default, the last two snapshots
+    names: list[str] = args.SNAPSHOT
+    if len(names) > 2:
+        logger.error("at most two snapshots can be compared")
+        return 1
+    if len(names) < 2:
+        snapshots = list_snapshots(repository, rulename)
+        if not names:
+            names = snapshots[-2:]
+        elif snapshots:
+            names = [names[0], snapshots[-1]]
+        if len(names) < 2:
+            logger.error("rule %s does not have two snapshots to compare", rulename)
+            return 1
+
+    try:
+        old, new = (read_snapshot(repository, rulename, name) for name in names)
+    except StoreError as exc:
+        logger.error("%s", exc)
+        return 1
+    for name, snapshot in zip(names, (old, new)):
+        if snapshot is None:
+            logger.error("rule %s has no snapshot %s", rulename, name)
+            return 1
+    assert old is not None and new is not None
+
+    changes = old.manifest.diff(new.manifest)
+    lines = [(path, 'A') for path in changes.added] + [(path, 'M') for path in changes.changed] \
+        + [(path, 'D') for path in changes.deleted]
+    for path, status in sorted(lines):
+        print(status, path)
+    logger.info("%s..%s: %d added, %d changed, %d deleted", names[0], names[1],
+                len(changes.added), len(changes.changed), len(changes.deleted))
+
+    return 0
+
+@exit_with_code
+def catalog(args: Namespace) -> int:
+    """Function for subcommand 'catalog'."""
+    import sqlite3
+    from .catalog import Catalog
+
+    logger = get_logger('')
+
+    def when(created: float) -> str:
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))
+
+    try:
+        with Catalog() as db:
+            if args.query == 'stats':
+                since = time.time() - args.days * 86400 if args.days is not None else None
+                backups = db.backups(args.RULE, limit=args.limit, since=since)
+                for backup in reversed(backups):
+                    print(f"{when(backup.created)}  {backup.rule}  {backup.action}  "
+                          f"{backup.name}  {backup.files} files  {backup.bytes} bytes")
+                logger.info("%d backups, %d files, %d bytes", len(backups),
+                            sum(backup.files for backup in backups),
+                            sum(backup.bytes for backup in backups))
+                return 0
+
+            if args.query == 'find':
+                if args.hash:
+                    found = db.find_hash(args.PATTERN, rule=args.rule)
+                else:
+                    found = db.find(args.PATTERN.strip('/'), rule=args.rule)
+            else:
+                found = db.history(args.PATH, rule=args.rule)
+    except sqlite3.Error as exc:
+        logger.error("%s", exc)
+        return 1
+
+    for version in found:
+        backup = version.backup
+        print(f"{when(backup.created)}  {backup.rule}  {backup.name}  {version.size:>12}  "
+              f"{version.hash[:12]}  {version.path}")
+    if not found:
+        logger.error("no backup in the catalog has %s",
+                     getattr(args, 'PATTERN', None) or args.PATH)
+        return 1
+
+    return 0
+
+def _open_archives(target: str, stamp: str | None=None):
+    # The seekable archives of a rule, or a single archive file
+    from .archive.seekable import ArchiveSet, ArchiveError, find_archives
+    from .rules import Rule
+
+    logger = get_logger('')
+
+    if os.path.isfile(target):
+        archives = [Path(target)]
+    else:
+        rulefile = find_rule(target)
+        if rulefile is None:
+            logger.error("%s is neither an archive nor a rule", target)
+            return None
+        destination = Rule(str(rulefile)).get('/archive/destination', None, True)
+        archives = find_archives(destination, target, stamp) if destination else []
+        if not archives:
+            if stamp is None:
+                logger.error("rule %s has no seekable archives", target)
+            else:
+                logger.error("rule %s has no seekable archives made at %s", target, stamp)
+            return None
+        logger.debug("reading %s", ", ".join(map(str, archives)))
+
+    try:
+        return ArchiveSet(archives)
+    except (OSError, ArchiveError) as exc:
+        logger.error("%s", exc)
+        return None
+
+@exit_with_code
+def ls(args: Namespace) -> int:
+    """Function for subcommand 'ls'."""
+    import stat
+
+    archives = _open_archives(args.TARGET)
+    if archives is None:
+        return 1
+
+    kinds = {0: stat.S_IFREG, 1: stat.S_IFDIR, 2: stat.S_IFLNK}
+    with archives:
+        members = archives.list(args.PATH.strip('/'))
+        for _, entry in members:
+            if args.long:
+                mtime = time.strftime('%Y-%m-%d %H:%M', time.localtime(entry.mtime_ns / 1e9))
+                print(f"{stat.filemode(kinds[entry.kind] | entry.mode)} {entry.size:>12} "
+                      f"{mtime} {entry.path}")
+            else:
+                print(entry.path)
+
+    if args.PATH and not members:
+        get_logger('').error("no member matches %s", args.PATH)
+        return 1
+
+    return 0
+
+@exit_with_code
+def restore(args: Namespace) -> int:
+    """Function for subcommand 'restore'."""
+    from .archive.seekable import ArchiveError
+    from .restore import restore_archives, restore_snapshot, DEFAULT_RESTORE_THREADS
+    from .rules import Rule
+    from .store import ChunkStore, StoreError
+
+    logger = get_logger('')
+
+    target: str = args.TARGET
+    threads: int = args.jobs or DEFAULT_RESTORE_THREADS
+    options = {'paths': args.path or (), 'patterns': args.glob or (), 'threads': threads}
+
+    # A rule with a chunk store is restored from its snapshots
+    repository: Path | None = args.repository
+    if repository is None and not args.archives and not os.path.isfile(target):
+        rulefile = find_rule(target)
+        if rulefile is not None:
+            repository = Rule(str(rulefile)).get('/snapshot/repository', None, True)
+            if repository:
+                repository = Path(repository).expanduser()
+
+    try:
+        if repository:
+            with ChunkStore(repository) as store:
+                snapshot = store.load_snapshot(target, args.SNAPSHOT)
+                if snapshot is None:
+                    logger.error("rule %s has no snapshot %s", target,
+                                 args.SNAPSHOT or "in " + str(repository))
+                    return 1
+                logger.debug("restoring snapshot %s", snapshot.name)
+                stats = restore_snapshot(store, snapshot, args.to, **options)
+        else:
+            archives = _open_archives(target, args.SNAPSHOT)
+            if archives is None:
+                return 1
+            with archives:
+                stats = restore_archives(archives, args.to, **options)
+    except LookupError as exc:
+        logger.error("%s", exc.args[0])
+        return 1
+    except (OSError, ValueError, ArchiveError, StoreError) as exc:
+        logger.error("%s", exc)
+        return 1
+
+    logger.info("restored %d files (%.1f MiB) into %s in %.2fs, %.1f MiB/s with %d threads",
+                stats.files, stats.bytes / 2**20, args.to, stats.seconds,
+                stats.throughput / 2**20, threads)
+    return 0
+
+@exit_with_code
+def verify(args: Namespace) -> int:
+    """Function for subcommand 'verify'."""
+    from .manifest import Manifest
+    from .verify import verify as verify_target, checksum_file, DEFAULT_HASH_THREADS
+
+    logger = get_logger('')
+
+    target: Path = args.TARGET
+    if not target.exists():
+        logger.error("%s does not exist", target)
+        return 1
+    if not 0 < args.sample <= 100:
+        logger.error("--sample must be a percentage above 0")
+        return 1
+
+    manifestfile: Path = args.manifest or checksum_file(target)
+    try:
+        manifest = Manifest.load(manifestfile)
+    except OSError as exc:
+        logger.error("cannot read the checksums of %s: %s", target, exc)
+        return 1
+    except ValueError as exc:
+        logger.error("%s", exc)
+        return 1
+
+    result = verify_target(target, manifest=manifest, paths=args.path or (),
+                           sample=args.sample,
+                           threads=args.jobs or DEFAULT_HASH_THREADS)
+    for name in result.missing:
+        logger.error("missing: %s", name)
+    for name in result.corrupt:
+        logger.error("corrupt: %s", name)
+    logger.info("checked %d of %d files, %d bytes in %.2fs (%.1f MiB/s)",
+                result.checked, len(manifest), result.bytes, result.seconds,
+                result.throughput / 2**20)
+
+    if not result.ok:
+        logger.error("%s failed verification: %d missing, %d corrupt", target,
+                     len(result.missing), len(result.corrupt))
+        return 1
+
+    return 0
+
+@exit_with_code
+def watch(args: Namespace) -> int:
+    """Function for subcommand 'watch'."""
+    from . import find_rules
+    from .actions.runner import select_rules
+    from .rules import Rule
+    from .watch import Watcher, inotify_available, watch_roots
+    import signal, threading
+
+    logger = get_logger('')
+
+    if not inotify_available():
+        logger.error("inotify is not available on this system")
+        return 1
+
+    if args.RULE:
+        rules, missing = select_rules(args.RULE, 'watch')
+        for spec in missing:
+            logger.error("no rule matches: %s", spec)
+        if missing:
+            return 1
+    else:
+        rules = find_rules('*')
+
+    watched = {}
+    for name, path in rules:
+        roots = watch_roots(Rule(str(path)))
+        if roots:
+            watched[name] = roots
+        elif args.RULE:
+            logger.warning("rule %s has no 'watch' option", name)
+    if not watched:
+        logger.error("no rules to watch")
+        return 1
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    Watcher(watched).run(stop)
 
     return 0
 
@@ -212,16 +548,153 @@ def run():
     del gbls
 
     # Additional 'create-rule' options
-    subparser_createrule.add_argument('-f', '--format', choices=('toml','null'),
+    subparser_createrule.add_argument('-f', '--format', choices=format_names(),
                                       default='toml', dest='FORMAT',
                                       help='format of the rule file')
 
     # 'do' subcommand
     subparser = subparsers.add_parser('do', description='Run a action on one or more rules')
-    subparser.add_argument('ACTION', help='action to be done')
-    subparser.add_argument('RULE', nargs='+', help='rules to apply to ACTION')
+    subparser.add_argument('ACTION',
+                           help="action to be done, or a chain like 'archive+copy' "
+                           "where each action streams its output into the next")
+    subparser.add_argument('RULE', nargs='*',
+                           help="rules to apply to ACTION: names, globs like 'repos-*', "
+                           "or @TAG for the rules tagged TAG")
+    subparser.add_argument('-a', '--all', action='store_true',
+                           help='apply ACTION to every rule that has a section for it')
+    subparser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                           help='run up to N rules at once in separate processes')
+    subparser.add_argument('--no-cache', action='store_true',
+                           help='read the rules from their files, bypassing the rule cache')
+    subparser.add_argument('--no-daemon', action='store_true',
+                           help='run the action in this process even if the daemon is running')
     subparser.set_defaults(func=do)
 
+    # 'daemon' subcommand
+    subparser = subparsers.add_parser('daemon',
+                                      description="Run the jbackup daemon, which runs the schedules "
+                                      "in rule files and the jobs submitted by 'do'.")
+    subparser.set_defaults(func=daemon)
+    subparser.add_argument('--socket', type=Path, metavar='PATH',
+                           help='listen on PATH instead of the default socket')
+    subparser.add_argument('--poll', type=float, default=30.0, metavar='SECONDS',
+                           help='check for changed rules and actions every SECONDS (default: 30)')
+    group = subparser.add_mutually_exclusive_group()
+    group.add_argument('--status', action='store_const', const='status', dest='command',
+                       help='print the status of the running daemon and exit')
+    group.add_argument('--reload', action='store_const', const='reload', dest='command',
+                       help='make the running daemon reload changed rules and actions')
+    group.add_argument('--stop', action='store_const', const='stop', dest='command',
+                       help='stop the running daemon')
+
+    # 'watch' subcommand
+    subparser = subparsers.add_parser('watch',
+                                      description="Record the changes under the paths in the "
+                                      "'watch' option of rules, for incremental backups.")
+    subparser.set_defaults(func=watch)
+    subparser.add_argument('RULE', nargs='*',
+                           help="rules to watch, as for 'do'; by default every rule "
+                           "with a 'watch' option")
+
+    # 'diff' subcommand
+    subparser = subparsers.add_parser('diff',
+                                      description="List the files that were added (A), changed (M) "
+                                      "or deleted (D) between two snapshots of a rule.")
+    subparser.set_defaults(func=diff)
+    subparser.add_argument('RULE', help="the rule whose snapshots are compared")
+    subparser.add_argument('SNAPSHOT', nargs='*',
+                           help="the old and new snapshots (default: the last two; "
+                           "with one, it is compared to the latest)")
+    subparser.add_argument('--repository', type=Path, metavar='PATH',
+                           help="the chunk store of the snapshots (default: the "
+                           "'repository' of the rule's snapshot action)")
+
+    # 'catalog' subcommand
+    subparser = subparsers.add_parser('catalog',
+                                      description="Query the catalog of backups, which every "
+                                      "backup run records its files in.")
+    subparser.set_defaults(func=catalog)
+    queries = subparser.add_subparsers(dest='query', title='queries', required=True)
+
+    query = queries.add_parser('find', description="List the backups that hold files "
+                               "matching PATTERN, oldest first.")
+    query.add_argument('PATTERN', help="a path in the backups, or a glob pattern of paths "
+                       "in which '*' also matches '/'")
+    query.add_argument('--hash', action='store_true',
+                       help="PATTERN is the content hash of the files instead")
+    query.add_argument('-r', '--rule', help="only search the backups of RULE")
+
+    query = queries.add_parser('history', description="List the versions of the file PATH, "
+                               "oldest first: each backup in which it changed.")
+    query.add_argument('PATH', help="a path in the backups")
+    query.add_argument('-r', '--rule', help="only search the backups of RULE")
+
+    query = queries.add_parser('stats', description="List the latest backups, with their "
+                               "number of files and size.")
+    query.add_argument('RULE', nargs='?', help="only list the backups of RULE")
+    query.add_argument('-n', '--limit', type=int, default=10, metavar='N',
+                       help="list the N latest backups (default: %(default)s)")
+    query.add_argument('--days', type=float, metavar='DAYS',
+                       help="only list the backups of the last DAYS days")
+
+    # 'ls' subcommand
+    subparser = subparsers.add_parser('ls',
+                                      description="List the members of a seekable archive, "
+                                      "or the latest backup of a rule made of them.")
+    subparser.set_defaults(func=ls)
+    subparser.add_argument('TARGET', help="a seekable archive, or a rule whose 'archive' "
+                           "action writes them")
+    subparser.add_argument('PATH', nargs='?', default='',
+                           help="only list PATH and what is under it")
+    subparser.add_argument('-l', '--long', action='store_true',
+                           help="show the mode, size and modification time of each member")
+
+    # 'restore' subcommand
+    subparser = subparsers.add_parser('restore',
+                                      description="Restore files from a seekable archive, or "
+                                      "from a backup of a rule: a snapshot in its chunk store, "
+                                      "or else its seekable archives.")
+    subparser.set_defaults(func=restore)
+    subparser.add_argument('TARGET', help="a seekable archive, or a rule")
+    subparser.add_argument('SNAPSHOT', nargs='?',
+                           help="the snapshot to restore, or the time an archive was made "
+                           "(YYYYmmdd-HHMMSS) (default: the latest)")
+    subparser.add_argument('--path', action='append', metavar='PATH',
+                           help="restore PATH and what is under it, as it is named in the "
+                           "backup; can be given more than once (default: everything)")
+    subparser.add_argument('--glob', action='append', metavar='PATTERN',
+                           help="only restore the files that match PATTERN, matched against "
+                           "the whole path if it has a '/', otherwise against the file name; "
+                           "can be given more than once")
+    subparser.add_argument('--to', type=Path, default=Path('.'), metavar='DIR',
+                           help="restore into DIR (default: the current directory)")
+    subparser.add_argument('-j', '--jobs', type=int, metavar='N',
+                           help="write up to N files at once, and decompress the data of "
+                           "large files on N threads (default: the number of CPUs, up to 8)")
+    subparser.add_argument('--repository', type=Path, metavar='PATH',
+                           help="restore from the chunk store PATH instead of the "
+                           "'repository' of the rule's 'snapshot' section")
+    subparser.add_argument('--archives', action='store_true',
+                           help="restore from the rule's seekable archives even if it has "
+                           "a chunk store")
+
+    # 'verify' subcommand
+    subparser = subparsers.add_parser('verify',
+                                      description="Check a backup against its checksum manifest, "
+                                      "as written by actions with 'checksums' set.")
+    subparser.set_defaults(func=verify)
+    subparser.add_argument('TARGET', type=Path,
+                           help="an archive, a file written by a chain, or a directory")
+    subparser.add_argument('--manifest', type=Path, metavar='FILE',
+                           help="read the checksums from FILE instead of the one next to TARGET")
+    subparser.add_argument('--path', action='append', metavar='PATH',
+                           help="only check the files under PATH, as it is named in the "
+                           "manifest; can be given more than once")
+    subparser.add_argument('--sample', type=float, default=100.0, metavar='PERCENT',
+                           help="check a random PERCENT of the files (default: all of them)")
+    subparser.add_argument('-j', '--jobs', type=int, metavar='N',
+                           help="hash up to N files at once (default: one per CPU, up to 8)")
+
     # 'show' subcommand
     subparser = subparsers.add_parser('show')
     subparser.set_defaults(func=show)
@@ -0,0 +1,77 @@
+"""
+File-keyed caches under the cache directory.
+
+An entry caches a value derived from a source file. It is
+stored in its own file under a subdirectory KIND of the cache
+directory, and is only valid as long as the source file keeps
+the modification time and size it had when the entry was made.
+"""
+
+from __future__ import annotations
+from importlib.util import MAGIC_NUMBER
+from pathlib import Path
+from typing import TYPE_CHECKING
+from ._path import get_cache_path
+import os, marshal
+
+if TYPE_CHECKING:
+    from typing import Any, Callable
+
+def cache_name(path: str | Path) -> str:
+    """
+    Return the name of a cache file for PATH.
+
+    The name is a hash of the absolute path, so that different
+    paths get different names of the same length, however long
+    the path is.
+    """
+    from hashlib import blake2b
+
+    filename = os.fsencode(os.path.abspath(path))
+    return blake2b(filename, digest_size=16).hexdigest()
+
+def cache_file(kind: str, path: Path) -> Path:
+    """Return the file that caches KIND for PATH."""
+    return get_cache_path(kind, cache_name(path))
+
+def read_entry(kind: str, path: Path, st: os.stat_result, *,
+               loads: Callable[[bytes], Any]=marshal.loads) -> Any | None:
+    """
+    Return the cached value of KIND for PATH.
+
+    ST is the current stat result of PATH. LOADS converts
+    the stored bytes back into the value. None is returned
+    if there is no valid entry.
+    """
+    try:
+        with open(cache_file(kind, path), 'rb') as fd:
+            magic, mtime_ns, size, payload = marshal.load(fd)
+        if magic != MAGIC_NUMBER or mtime_ns != st.st_mtime_ns or size != st.st_size:
+            return None
+        return loads(payload)
+    except Exception:
+        # A corrupt or foreign entry is just a cache miss
+        return None
+
+def write_entry(kind: str, path: Path, st: os.stat_result, value: Any, *,
+                dumps: Callable[[Any], bytes]=marshal.dumps) -> Path | None:
+    """
+    Cache VALUE as KIND for PATH.
+
+    ST is the stat result of PATH that VALUE was derived
+    from. DUMPS converts VALUE into bytes. Returns the
+    path of the entry, or None if it could not be written.
+    """
+    cachefile = cache_file(kind, path)
+    tmpfile = cachefile.with_name(f"{cachefile.name}.{os.getpid()}.tmp")
+    try:
+        data = marshal.dumps((MAGIC_NUMBER, st.st_mtime_ns, st.st_size, dumps(value)))
+        cachefile.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmpfile, 'wb') as fd:
+            fd.write(data)
+        os.replace(tmpfile, cachefile)
+    except (OSError, ValueError): # pragma: no cover
+        tmpfile.unlink(missing_ok=True)
+        return None
+
+    return cachefile
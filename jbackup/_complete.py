@@ -17,7 +17,7 @@ class FirstArgAction(Action):
 
     def __call__(self, parser: ArgumentParser, _namespace: Namespace, # pyright: ignore
                  _values, _option_string): # pyright: ignore
-        print("create-rule create-action do show locate --list-actions --list-rules --path --levels")
+        print("create-rule create-action do daemon watch diff verify ls restore catalog show locate --list-actions --list-rules --path --levels")
         parser.exit()
 
 def _complete(args: Namespace): # pyright: ignore
@@ -43,8 +43,8 @@ def _complete(args: Namespace): # pyright: ignore
 
     if comp_cword < 2: return 1
 
-    def _get(func: Callable[[Literal['system', 'user']], list[str]]) -> set[str]:
-        return set(itertools.chain(func('system'), func('user')))
+    def _get(func: Callable[[Literal['system', 'user', 'builtin']], list[str]]) -> set[str]:
+        return set(itertools.chain(func('system'), func('user'), func('builtin')))
 
     comp_reply: set[str] = set()
 
@@ -79,6 +79,26 @@ def _complete(args: Namespace): # pyright: ignore
         else:
             # List actions
             comp_reply = _get(list_available_actions) | {"--rule", "-r"}
+    elif subcommand == 'watch':
+        # Subcommand: 'watch'
+        comp_reply = _get(list_available_rules)
+    elif subcommand == 'daemon':
+        # Subcommand: 'daemon'
+        comp_reply = {"--socket", "--poll", "--status", "--reload", "--stop"}
+    elif subcommand == 'diff':
+        # Subcommand: 'diff'
+        if comp_cword == 2:
+            comp_reply = _get(list_available_rules)
+    elif subcommand == 'catalog':
+        # Subcommand: 'catalog'
+        if comp_cword == 2:
+            comp_reply = {"find", "history", "stats"}
+        elif comp_cword == 3 and commandline[1:2] == ['stats']:
+            comp_reply = _get(list_available_rules)
+    elif subcommand in ('ls', 'restore'):
+        # Subcommands: 'ls' and 'restore'
+        if comp_cword == 2:
+            comp_reply = _get(list_available_rules)
 
     if comp_reply:
         _print_list(comp_reply)
@@ -0,0 +1,163 @@
+"""
+Persistent index of the files under the data paths.
+
+Each subdirectory of a data path (e.g. 'actions' or 'rules')
+gets its own index, which maps the stems of its files to their
+names. Indexes are stored under the cache directory so that
+they survive across processes, and are invalidated whenever the
+modification time of the indexed directory changes.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING
+from ._cache import cache_name
+from ._path import DATAPATHS, get_cache_path
+import os, json, fnmatch
+
+if TYPE_CHECKING:
+    from typing import Any, Literal
+
+_INDEX_VERSION = 1
+
+class DataIndex:
+    """A name-to-file index of a single directory."""
+
+    def __init__(self, directory: Path):
+        """Construct an index of DIRECTORY."""
+        self.directory = directory
+        self.index_file = get_cache_path('index', f"{cache_name(directory)}.json")
+        self._mtime_ns: int | None = None
+        self._files: list[str] = []
+        self._stems: dict[str, str] = {}
+        self._loaded = False
+
+    def _dir_mtime(self) -> int | None:
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return None
+
+    def _set_files(self, files: list[str]) -> None:
+        self._files = sorted(files)
+        stems: dict[str, str] = {}
+        for filename in self._files:
+            stems.setdefault(Path(filename).stem, filename)
+        self._stems = stems
+
+    def _load(self) -> bool:
+        # Read the index from the cache, return True if it is usable
+        try:
+            with open(self.index_file, 'rt') as fd:
+                data: dict[str, Any] = json.load(fd)
+        except (OSError, ValueError):
+            return False
+
+        if data.get('version') != _INDEX_VERSION \
+           or data.get('directory') != str(self.directory):
+            return False
+
+        self._mtime_ns = data.get('mtime_ns')
+        self._set_files(data.get('files', []))
+        return True
+
+    def _save(self) -> None:
+        data = {
+            'version': _INDEX_VERSION,
+            'directory': str(self.directory),
+            'mtime_ns': self._mtime_ns,
+            'files': self._files
+        }
+
+        import tempfile
+
+        # Write the file atomically; an unwritable cache is not an error
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(dir=self.index_file.parent, suffix='.tmp')
+            with os.fdopen(fd, 'wt') as fp:
+                json.dump(data, fp)
+            os.replace(tmpname, self.index_file)
+        except OSError: # pragma: no cover
+            pass
+
+    def refresh(self) -> None:
+        """Rescan the directory and rewrite the index."""
+        self._mtime_ns = self._dir_mtime()
+        files: list[str] = []
+
+        if self._mtime_ns is not None:
+            with os.scandir(self.directory) as it:
+                files = [entry.name for entry in it
+                         if '.' in entry.name and not entry.is_dir()]
+
+        self._set_files(files)
+        self._loaded = True
+        self._save()
+
+    def _validate(self) -> None:
+        # Make sure the index reflects the directory
+        if not self._loaded:
+            self._loaded = self._load()
+
+        if not self._loaded or self._mtime_ns != self._dir_mtime():
+            self.refresh()
+
+    def lookup(self, name: str) -> Path | None:
+        """
+        Return the path of the file whose stem is NAME.
+
+        Returns None if there is no such file.
+        """
+        self._validate()
+        filename = self._stems.get(name)
+        if filename is None:
+            return None
+
+        return self.directory / filename
+
+    def names(self, glob: str='*.*') -> list[str]:
+        """Return the stems of the files whose names match GLOB."""
+        self._validate()
+        return [Path(filename).stem for filename in self._files
+                if fnmatch.fnmatchcase(filename, glob)]
+
+    def add(self, path: Path) -> None:
+        """
+        Add PATH to the index.
+
+        PATH must be a file that was just created inside the
+        indexed directory.
+        """
+        if not self._loaded:
+            self._loaded = self._load()
+
+        new_mtime = self._dir_mtime()
+        if not self._loaded or path.parent != self.directory or new_mtime is None:
+            self.refresh()
+            return
+
+        files = set(self._files)
+        files.add(path.name)
+        self._set_files(list(files))
+        self._mtime_ns = new_mtime
+        self._save()
+
+_indexes: dict[Path, DataIndex] = {}
+
+def get_index(where: Literal['system', 'user', 'builtin'], subdir: str) -> DataIndex:
+    """Return the index of SUBDIR under the data path WHERE."""
+    directory = DATAPATHS[where] / subdir
+    index = _indexes.get(directory)
+    if index is None:
+        index = _indexes[directory] = DataIndex(directory)
+
+    return index
+
+def index_file(path: Path) -> None:
+    """Record the newly created file PATH in the index of its directory."""
+    for where in DATAPATHS:
+        for subdir in ('actions', 'rules'):
+            if path.parent == DATAPATHS[where] / subdir:
+                get_index(where, subdir).add(path)
+                return
@@ -2,10 +2,12 @@
 
 from __future__ import annotations
 from pathlib import Path
+import os
 
 DATAPATHS = {
     'system': Path('/usr/local/etc/jbackup'),
-    'user': Path('~/.local/etc/jbackup').expanduser()
+    'user': Path('~/.local/etc/jbackup').expanduser(),
+    'builtin': Path(__file__).parent / 'data'
 }
 
 def get_data_path() -> Path:
@@ -22,3 +24,60 @@ def get_data_path() -> Path:
         datapath = DATAPATHS['user']
 
     return datapath
+
+def get_cache_path(*parts: str) -> Path:
+    """
+    Return a path under the user's cache directory.
+
+    The cache directory is $XDG_CACHE_HOME/jbackup, or
+    ~/.cache/jbackup if XDG_CACHE_HOME is not set. It can
+    be overridden with JBACKUP_CACHE_DIR. PARTS are joined
+    onto the cache directory. The directory is not created.
+    """
+    cachedir = os.getenv('JBACKUP_CACHE_DIR')
+    if cachedir:
+        root = Path(cachedir).expanduser()
+    else:
+        root = Path(os.getenv('XDG_CACHE_HOME') or '~/.cache').expanduser() / 'jbackup'
+
+    return root.joinpath(*parts)
+
+def get_state_path(*parts: str) -> Path:
+    """
+    Return a path under the user's state directory.
+
+    The state directory holds data that has to persist between
+    runs, such as the manifests of previous backups. It is
+    $XDG_STATE_HOME/jbackup, or ~/.local/state/jbackup if
+    XDG_STATE_HOME is not set, and can be overridden with
+    JBACKUP_STATE_DIR. PARTS are joined onto the state
+    directory. The directory is not created.
+    """
+    statedir = os.getenv('JBACKUP_STATE_DIR')
+    if statedir:
+        root = Path(statedir).expanduser()
+    else:
+        root = Path(os.getenv('XDG_STATE_HOME') or '~/.local/state').expanduser() / 'jbackup'
+
+    return root.joinpath(*parts)
+
+def get_runtime_path(*parts: str) -> Path:
+    """
+    Return a path under the user's runtime directory.
+
+    The runtime directory holds files that only matter while
+    a process runs, such as the socket of the daemon. It is
+    $XDG_RUNTIME_DIR/jbackup, or the state directory if
+    XDG_RUNTIME_DIR is not set, and can be overridden with
+    JBACKUP_RUNTIME_DIR. PARTS are joined onto the runtime
+    directory. The directory is not created.
+    """
+    rundir = os.getenv('JBACKUP_RUNTIME_DIR')
+    if rundir:
+        root = Path(rundir).expanduser()
+    elif os.getenv('XDG_RUNTIME_DIR'):
+        root = Path(os.environ['XDG_RUNTIME_DIR']) / 'jbackup'
+    else:
+        root = get_state_path()
+
+    return root.joinpath(*parts)
@@ -6,9 +6,10 @@ ActionType refers to the Action type itself.
 
 from __future__ import annotations
 from ..utils import LoadError, Pathlike
-from .action_protocol import Action
+from .action_protocol import Action, AsyncAction, BatchAction, StreamAction
 from .params import *
-from ..loader import load_module_from_file, ModuleProxy
+from .introspect import read_action_info, StaticActionInfo
+from ..loader import load_module_from_file, set_cached_metadata, ModuleProxy
 from pathlib import Path
 from typing import TYPE_CHECKING, Type, cast
 import re
@@ -19,10 +20,13 @@ if TYPE_CHECKING:
 class _DocstringFormatter: # pragma: no cover
     __slots__ = ('lines', 'proplines', 'indent')
 
-    def __init__(self, cls: ActionType, indent: int=4):
+    def __init__(self, cls: ActionType | StaticActionInfo, indent: int=4):
         self.indent: int = indent
 
-        string = cls.__doc__ or ""
+        if isinstance(cls, StaticActionInfo):
+            string = cls.doc
+        else:
+            string = cls.__doc__ or ""
         if string:
             string = re.sub(r'\n[ \t]*(.+)', r'\n\1', string)
             lines: list[str] = [cast(str, line).replace('\n', ' ').strip()
@@ -53,32 +57,58 @@ class _DocstringFormatter: # pragma: no cover
 class ActionNotLoaded(LoadError):
     """An error for when an action cannot be loaded."""
 
-ActionType = Type[Action]
+ActionType = Type[Action] | Type[AsyncAction]
+
+def get_action_info(action: ActionType | StaticActionInfo) -> str: # pragma: no cover
+    """
+    Return the string documentation of an action.
 
-def get_action_info(action: ActionType) -> str: # pragma: no cover
-    """Return the string documentation of an action."""
-    if action.__doc__ is None:
+    ACTION is either an action class or the information
+    returned by read_action_info().
+    """
+    if isinstance(action, StaticActionInfo):
+        if not action.doc:
+            return ""
+    elif action.__doc__ is None:
         return ""
 
     fmtr = _DocstringFormatter(action)
 
     return str(fmtr)
 
-def _find_action_class(module: ModuleProxy) -> Optional[ActionType]:
-    res = None
+def _find_action_class_name(module: ModuleProxy) -> Optional[str]:
+    # The name of the class is cached along with the module's code
+    name = module.metadata.get('action_class')
+    if name is not None:
+        return name
+
     for name in dir(module):
         if name.startswith('Action_'):
-            res = module[name]
-            break
-    return res
+            return name
+
+    return None
 
-def load_action(filename: str | Pathlike, name: str) -> ActionType:
+def _find_action_class(module: ModuleProxy) -> Optional[ActionType]:
+    name = _find_action_class_name(module)
+    if name is None:
+        return None
+
+    return module[name]
+
+# Action classes loaded by this process, keyed by path, mtime and size
+_action_classes: dict[tuple[str, int, int], ActionType] = {}
+
+def load_action(filename: str | Pathlike, name: str, *, cache: bool=True) -> ActionType:
     """
     Load an action from file.
 
     FILENAME is a path to a Python script. NAME
     is the name of the action.
 
+    If CACHE is true, the compiled module and the name
+    of its action class are cached across processes, and
+    the class itself for the lifetime of this process.
+
     Raise ActionNotLoaded on failure.
     """
     assert isinstance(filename, (str, Path)), "invalid type"
@@ -89,12 +119,25 @@ def load_action(filename: str | Pathlike, name: str) -> ActionType:
     else:
         filepath = cast(Path, filename)
 
+    key = None
+    if cache:
+        st = filepath.stat()
+        key = (str(filepath.resolve()), st.st_mtime_ns, st.st_size)
+        if key in _action_classes:
+            return _action_classes[key]
+
     # Load module
-    module = load_module_from_file(filepath, name)
+    module = load_module_from_file(filepath, name, cache=cache)
 
     # Find the action class
-    action = _find_action_class(module)
+    clsname = _find_action_class_name(module)
+    action = None if clsname is None else module[clsname]
     if action is None:
         raise ActionNotLoaded(name, "no action class found")
 
+    if key is not None:
+        _action_classes[key] = action
+        if 'action_class' not in module.metadata:
+            set_cached_metadata(filepath, 'action_class', clsname)
+
     return action
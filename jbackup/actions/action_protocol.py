@@ -11,6 +11,7 @@ from typing import Protocol, TYPE_CHECKING
 if TYPE_CHECKING:
     from ..rules import Rule
     from ..actions import ActionProperty
+    from typing import BinaryIO, ContextManager, Optional
 
 class Action(Protocol):
     """An interface to an action."""
@@ -22,3 +23,71 @@ class Action(Protocol):
 
     def run(self) -> None:
         ...
+
+class AsyncAction(Protocol):
+    """
+    An action that runs as a coroutine.
+
+    If an action defines run_async(), it is run with
+    asyncio.run() instead of calling run(), which it then
+    need not define. This lets an action overlap reading,
+    transforming and writing data (see jbackup.pipeline).
+    """
+
+    properties: list[ActionProperty]
+
+    def __init__(self, rule: Rule):
+        ...
+
+    async def run_async(self) -> None:
+        ...
+
+class BatchAction(Action, Protocol):
+    """
+    An action with setup shared by the rules of a run.
+
+    batch() is optional. When an action is run with several
+    rules, the context manager it returns is entered before
+    the first rule and exited after the last one, so that
+    expensive setup is done once per run rather than once per
+    rule. Whatever it sets up is kept on the class, where the
+    instances can use it.
+    """
+
+    @classmethod
+    def batch(cls, rules: list[Rule]) -> ContextManager:
+        ...
+
+class StreamAction(Action, Protocol):
+    """
+    An action that can be part of a chain.
+
+    In a chain such as 'archive+copy', each action streams
+    its output into the next one instead of writing it to a
+    file (see jbackup.actions.chain). An action declares
+    whether it reads a byte stream (STREAM_INPUT) and whether
+    it writes one (STREAM_OUTPUT); the first action of a chain
+    must write one, the last must read one, and those in between
+    must do both.
+
+    stream_name() and commit() are optional. stream_name() is
+    given the name of the input stream, or None, and returns a
+    file name for the output stream; by default the input's name
+    is kept. run_stream() of the last action returns where the
+    stream ended up, such as the file it wrote, or None. commit()
+    is called once every action of the chain has succeeded, with
+    that location.
+    """
+
+    stream_input: bool
+    stream_output: bool
+
+    def stream_name(self, input_name: Optional[str]) -> Optional[str]:
+        ...
+
+    def run_stream(self, input: Optional[BinaryIO], output: Optional[BinaryIO],
+                   input_name: Optional[str]) -> Optional[str]:
+        ...
+
+    def commit(self, location: Optional[str]) -> None:
+        ...
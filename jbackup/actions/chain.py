@@ -0,0 +1,175 @@
+"""
+Chains of actions.
+
+A chain such as 'archive+compress+copy' runs several actions
+with the same rule, each streaming its output into the next
+one (see jbackup.actions.action_protocol.StreamAction). The
+actions run in threads connected by pipes, so nothing passes
+through an intermediate file and a slow action holds back the
+ones before it.
+
+If an action fails, the chain fails: the action after it sees
+an error instead of the end of its input, and the one before
+it cannot write any more.
+"""
+
+from __future__ import annotations
+from contextlib import ExitStack
+from typing import TYPE_CHECKING
+import io, os, threading
+
+if TYPE_CHECKING:
+    from typing import Any, BinaryIO, ContextManager, Optional
+    from ..rules import Rule
+    from . import ActionType
+
+__all__ = [
+    # Classes
+    'ActionChain',
+    'ChainError',
+
+    # Variables
+    'PIPE_BUFFER_SIZE'
+]
+
+PIPE_BUFFER_SIZE = 1024 * 1024
+
+class ChainError(Exception):
+    """Raised for an invalid chain, or when an action before this one failed."""
+
+class _Link:
+    # The state that two neighbouring actions share
+    def __init__(self):
+        self.failed: Optional[str] = None
+
+class _ChainReader(io.RawIOBase):
+    # The read end of a pipe; an upstream failure is raised
+    # in place of the end of the stream
+    def __init__(self, fd: int, link: _Link):
+        self._file = open(fd, 'rb', buffering=0)
+        self._link = link
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int: # pyright: ignore
+        n = self._file.readinto(buffer)
+        if not n and self._link.failed:
+            raise ChainError(f"{self._link.failed} failed")
+        return n or 0
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+class _ChainRun:
+    # One run of a chain with a rule
+    def __init__(self, chain: ActionChain, rule: Rule):
+        self.chain = chain
+        self.actions = [cls(rule) for _, cls in chain.classes]
+
+    def run(self) -> None:
+        names = [name for name, _ in self.chain.classes]
+        count = len(self.actions)
+
+        # The name of each action's input stream
+        input_names: list[Optional[str]] = []
+        name = None
+        for action in self.actions:
+            input_names.append(name)
+            stream_name = getattr(action, 'stream_name', None)
+            if stream_name is not None:
+                name = stream_name(name)
+
+        links = [_Link() for _ in range(count - 1)]
+        inputs: list[Optional[BinaryIO]] = [None] * count
+        outputs: list[Optional[BinaryIO]] = [None] * count
+        for i, link in enumerate(links):
+            rfd, wfd = os.pipe()
+            inputs[i + 1] = io.BufferedReader(_ChainReader(rfd, link), PIPE_BUFFER_SIZE)
+            outputs[i] = open(wfd, 'wb', buffering=PIPE_BUFFER_SIZE)
+
+        errors: list[Optional[BaseException]] = [None] * count
+        # Where the last action put the output of the chain
+        location: Optional[str] = None
+
+        def target(i: int) -> None:
+            nonlocal location
+            fin, fout = inputs[i], outputs[i]
+            try:
+                result = self.actions[i].run_stream(fin, fout, input_names[i])
+                if i == count - 1 and result is not None:
+                    location = str(result)
+                if fout is not None and not fout.closed:
+                    fout.flush()
+            except BaseException as exc:
+                errors[i] = exc
+                if i < len(links):
+                    links[i].failed = f"action {names[i]}"
+            finally:
+                for f in (fout, fin):
+                    try:
+                        if f is not None:
+                            f.close()
+                    except OSError:
+                        # Unflushed output to a closed pipe
+                        pass
+
+        threads = [threading.Thread(target=target, args=(i,), name=f"jbackup-{names[i]}")
+                   for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The first real error; the others are its consequences
+        failures = [exc for exc in errors if exc is not None]
+        for exc in failures:
+            if not isinstance(exc, (ChainError, BrokenPipeError)):
+                raise exc
+        if failures:
+            raise failures[0]
+
+        for action in self.actions:
+            commit = getattr(action, 'commit', None)
+            if commit is not None:
+                commit(location)
+
+class ActionChain:
+    """Actions that run together, each streaming into the next."""
+
+    def __init__(self, classes: list[tuple[str, ActionType]]):
+        """
+        Make a chain of CLASSES, a list of action names and classes.
+
+        ChainError is raised if an action cannot take its place
+        in the chain.
+        """
+        if len(classes) < 2:
+            raise ChainError("a chain needs at least two actions")
+
+        last = len(classes) - 1
+        for i, (name, cls) in enumerate(classes):
+            if not hasattr(cls, 'run_stream'):
+                raise ChainError(f"action {name} cannot be chained")
+            if i > 0 and not getattr(cls, 'stream_input', False):
+                raise ChainError(f"action {name} does not read a stream, "
+                                 "so it can only come first")
+            if i < last and not getattr(cls, 'stream_output', False):
+                raise ChainError(f"action {name} does not write a stream, "
+                                 "so it can only come last")
+
+        self.classes = classes
+
+    def __call__(self, rule: Rule) -> _ChainRun:
+        return _ChainRun(self, rule)
+
+    def batch(self, rules: list[Rule]) -> ContextManager[Any]:
+        """Enter the batch() context of every action in the chain that has one."""
+        stack = ExitStack()
+        with stack:
+            for _, cls in self.classes:
+                batch = getattr(cls, 'batch', None)
+                if batch is not None:
+                    stack.enter_context(batch(rules))
+            return stack.pop_all()
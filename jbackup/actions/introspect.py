@@ -0,0 +1,200 @@
+"""
+Static introspection of actions.
+
+Reads the documentation and properties of an action from the
+syntax tree of its module, so that nothing in the module is
+executed or imported. This only works if the properties of the
+action are declared as a literal list of ActionProperty() calls
+with literal arguments; for anything else, the action must be
+loaded instead.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from .._cache import read_entry, write_entry
+from .params import ActionProperty, PropertyType, STANDARD_PROPERTIES
+import ast
+
+if TYPE_CHECKING:
+    from typing import Any, Optional
+    from ..utils import Pathlike
+
+_CACHE_KIND = 'actioninfo'
+
+_PROPERTY_KEYWORDS = {'types', 'optional', 'doc'}
+
+class StaticActionInfo(NamedTuple):
+    """Information about an action that was read from its source."""
+
+    name: str
+    doc: str
+    properties: list[ActionProperty]
+
+    @property
+    def summary(self) -> str:
+        """The first line of the documentation."""
+        lines = self.doc.strip().splitlines()
+        return lines[0].strip() if lines else ""
+
+class _NotStatic(Exception):
+    """A declaration that cannot be evaluated without running the code."""
+
+def _eval_node(node: ast.expr) -> Any:
+    # PropertyType.X is allowed in addition to literals
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+       and node.value.id == 'PropertyType':
+        try:
+            return PropertyType[node.attr]
+        except KeyError:
+            raise _NotStatic
+
+    if isinstance(node, ast.List):
+        return [_eval_node(elt) for elt in node.elts]
+
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise _NotStatic
+
+def _names_action_property(node: ast.expr) -> bool:
+    if isinstance(node, ast.Name):
+        return node.id == 'ActionProperty'
+    if isinstance(node, ast.Attribute):
+        return node.attr == 'ActionProperty'
+    return False
+
+def _is_action_property(node: ast.expr) -> bool:
+    # ActionProperty(...)
+    return isinstance(node, ast.Call) and _names_action_property(node.func)
+
+def _is_standard_property(node: ast.expr) -> bool:
+    # ActionProperty.standard(...)
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Attribute):
+        return False
+    return node.func.attr == 'standard' and _names_action_property(node.func.value)
+
+def _eval_property(node: ast.expr) -> dict[str, Any]:
+    call: ast.Call = node # type: ignore
+
+    if _is_standard_property(node):
+        args = [_eval_node(arg) for arg in call.args]
+        if len(args) != 1 or call.keywords or args[0] not in STANDARD_PROPERTIES:
+            raise _NotStatic
+        return {'name': args[0], **STANDARD_PROPERTIES[args[0]]}
+
+    if not _is_action_property(node):
+        raise _NotStatic
+
+    if any(isinstance(arg, ast.Starred) for arg in call.args) \
+       or any(kw.arg is None for kw in call.keywords):
+        raise _NotStatic
+
+    args = [_eval_node(arg) for arg in call.args]
+    kw = {k.arg: _eval_node(k.value) for k in call.keywords}
+    if len(args) != 2 or not _PROPERTY_KEYWORDS.issuperset(kw):
+        raise _NotStatic
+
+    return {'name': args[0], 'value': args[1], **kw}
+
+def _find_class(tree: ast.Module) -> Optional[ast.ClassDef]:
+    # Same choice as actions._find_action_class: the first in sorted order
+    classes = [node for node in tree.body
+               if isinstance(node, ast.ClassDef) and node.name.startswith('Action_')]
+    if not classes:
+        return None
+
+    return min(classes, key=lambda node: node.name)
+
+def _extract(tree: ast.Module) -> Optional[tuple[str, str, list[dict[str, Any]]]]:
+    cls = _find_class(tree)
+    if cls is None:
+        return None
+
+    doc = ast.get_docstring(cls, clean=False) or ""
+    properties: list[dict[str, Any]] | None = None
+
+    for node in cls.body:
+        if isinstance(node, ast.Assign):
+            targets = node.targets
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            targets = [node.target]
+        else:
+            continue
+
+        if not any(isinstance(t, ast.Name) and t.id == 'properties' for t in targets):
+            continue
+
+        value = node.value
+        if not isinstance(value, ast.List):
+            return None
+        try:
+            properties = [_eval_property(elt) for elt in value.elts]
+        except _NotStatic:
+            return None
+
+    # Properties might be inherited from a base class
+    if properties is None:
+        if cls.bases:
+            return None
+        properties = []
+
+    return cls.name, doc, properties
+
+def _to_info(entry: tuple[str, str, list[dict[str, Any]]]) -> StaticActionInfo:
+    name, doc, propdicts = entry
+    properties = []
+    for propdict in propdicts:
+        kw = dict(propdict)
+        if 'types' in kw and kw['types'] is not None:
+            kw['types'] = [PropertyType(t) for t in kw['types']]
+        properties.append(ActionProperty(kw.pop('name'), kw.pop('value'), **kw))
+
+    return StaticActionInfo(name, doc, properties)
+
+def _to_entry(entry: tuple[str, str, list[dict[str, Any]]]) -> tuple[str, str, list[dict[str, Any]]]:
+    # PropertyType is stored as its integer value
+    name, doc, propdicts = entry
+    stored = []
+    for propdict in propdicts:
+        propdict = dict(propdict)
+        if propdict.get('types') is not None:
+            propdict['types'] = [int(t) for t in propdict['types']]
+        stored.append(propdict)
+
+    return name, doc, stored
+
+# Results from this process, keyed by path, mtime and size
+_infos: dict[tuple[str, int, int], Optional[StaticActionInfo]] = {}
+
+def read_action_info(filename: str | Pathlike) -> Optional[StaticActionInfo]:
+    """
+    Read the information about an action without loading it.
+
+    FILENAME is a path to the Python script of the action.
+    None is returned if the script has no action class or its
+    properties cannot be determined statically. Results are
+    cached per file, both in memory and in the cache directory.
+
+    OSError is raised if the file cannot be read, and
+    SyntaxError if it cannot be parsed.
+    """
+    path = Path(filename).resolve()
+    st = path.stat()
+
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    if key in _infos:
+        return _infos[key]
+
+    entry = read_entry(_CACHE_KIND, path, st)
+    if entry is None:
+        tree = ast.parse(path.read_bytes(), str(path))
+        extracted = _extract(tree)
+        # A failed extraction is cached too, as an empty tuple
+        entry = () if extracted is None else _to_entry(extracted)
+        write_entry(_CACHE_KIND, path, st, entry)
+
+    info = _to_info(entry) if entry else None
+    _infos[key] = info
+
+    return info
@@ -3,11 +3,11 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 from enum import IntEnum, auto
-from ..rules import Rule
 from pathlib import Path
-import re
+import copy, re
 
 if TYPE_CHECKING:
+    from ..rules import Rule
     from re import Pattern
     from typing import Any, Iterable
 
@@ -114,7 +114,8 @@ class ActionProperty:
 
     def __init__(self, name: str, value: Any, /,
                  types: list[PropertyType] | None=None,
-                 optional: bool=False, doc: str | None=None) -> None:
+                 optional: bool=False, doc: str | None=None,
+                 paths: bool | None=None) -> None:
         """
         Construct an ActionProperty object with a NAME and VALUE.
 
@@ -125,6 +126,11 @@ class ActionProperty:
         If TYPES is set, the type of this property is compared
         with the elements in TYPES. If no match is found, then
         PropertyTypeError is raised.
+
+        If PATHS is true, the property holds a path or a list of
+        paths, which are relative to the rule's base directory
+        (see Rule.resolve_paths()). If PATHS is None, it is true
+        when TYPES includes PropertyType.PATH.
         """
         if not name:
             raise ValueError("empty name")
@@ -137,6 +143,22 @@ class ActionProperty:
         self._doc = doc
         self._optional = optional
         self._types = types or []
+        if paths is None:
+            paths = PropertyType.PATH in self._types
+        self._paths = paths
+
+    @classmethod
+    def standard(cls, name: str) -> ActionProperty:
+        """
+        Return a new instance of the standard property NAME.
+
+        Standard properties have the same meaning in every action
+        that declares them (see STANDARD_PROPERTIES). KeyError is
+        raised if there is no standard property called NAME.
+        """
+        kw = dict(STANDARD_PROPERTIES[name])
+        value = kw.pop('value')
+        return cls(name, value, **kw)
 
     @staticmethod
     def get_properties(action: str, rule: Rule, properties: list[ActionProperty]) -> ActionPropertyMapping:
@@ -152,11 +174,15 @@ class ActionProperty:
 
         The return value is a mapping of property names and their values.
         """
-        lproperties = properties.copy()
+        # Copy each property so that the values of one rule
+        # do not become the defaults of the next
+        lproperties = [copy.copy(prop) for prop in properties]
         for prop in lproperties:
             propname = prop.name.replace('.', '/')
             default = prop.value
             value = rule.get(f"{action}/{propname}", default, prop._optional)
+            if prop._paths:
+                value = rule.resolve_paths(value)
             prop.value = value
 
         return ActionPropertyMapping({prop.name: prop for prop in lproperties})
@@ -215,3 +241,22 @@ class ActionProperty:
             string += f" -- {doc}"
 
         return string
+
+# Properties that actions can opt into by declaring them with
+# ActionProperty.standard()
+STANDARD_PROPERTIES: dict[str, dict[str, Any]] = {
+    'incremental': {
+        'value': False,
+        'types': [PropertyType.BOOL],
+        'optional': True,
+        'doc': "only back up files that were added or changed since the last "
+               "run of the rule, using its manifest (see jbackup.manifest)"
+    },
+    'checksums': {
+        'value': False,
+        'types': [PropertyType.BOOL],
+        'optional': True,
+        'doc': "write a checksum manifest next to the backup, which "
+               "'jbackup verify' checks it against (see jbackup.verify)"
+    }
+}
@@ -0,0 +1,301 @@
+"""
+Run an action with a list of rules.
+
+Rules are either run one after another in this process, or
+spread across a pool of worker processes. Each worker loads
+the action class once, and sends back the log records of
+every rule it runs so that they are emitted by the parent.
+
+An action can share setup between the rules of a run, such as
+a connection to the destination, with the optional class method
+batch() (see jbackup.actions.action_protocol.BatchAction). It is
+entered once before the first rule, or once in each worker.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from ..logging import get_logger, _capture_records
+import logging, traceback
+
+if TYPE_CHECKING:
+    from typing import ContextManager, Iterable, Optional
+    from . import ActionType
+
+class RuleResult(NamedTuple):
+    """The outcome of running an action with one rule."""
+
+    rule: str
+    code: int
+    error: str = ""
+    records: tuple[logging.LogRecord, ...] = ()
+
+    @property
+    def ok(self) -> bool:
+        """Whether the action succeeded."""
+        return self.code == 0
+
+def run_rule(cls: ActionType, actionname: str, rulename: str, rulefile: Path,
+             cwd: Optional[str]=None) -> RuleResult:
+    """
+    Run the action CLS with the rule in RULEFILE.
+
+    Relative paths in the rule are taken relative to CWD, if it
+    is given, instead of the current directory (see Rule).
+    An action with a run_async() method is run in a new event
+    loop. Exceptions raised by the action are caught and
+    reported in the result with a non-zero code.
+    """
+    from ..rules import Rule
+
+    logger = get_logger('')
+
+    try:
+        rule = Rule(str(rulefile), base=cwd)
+        action = cls(rule)
+        logger.debug("loaded action %s with rule %s", actionname, rulename)
+        if hasattr(action, 'run_async'):
+            import asyncio
+            asyncio.run(action.run_async()) # pyright: ignore
+        else:
+            action.run() # pyright: ignore
+    except Exception as exc:
+        logger.debug("%s", traceback.format_exc())
+        return RuleResult(rulename, 1, f"{type(exc).__name__}: {exc}")
+
+    return RuleResult(rulename, 0)
+
+def select_rules(specs: Iterable[str], actionname: str, *,
+                 all_rules: bool=False) -> tuple[list[tuple[str, Path]], list[str]]:
+    """
+    Resolve rule names, globs and tags into rules.
+
+    Each of SPECS is the name of a rule, a glob pattern of rule
+    names such as 'repos/*', or '@TAG' for the rules that list TAG
+    in their global 'tags' option. If ALL_RULES is true, every rule
+    with a section for the action ACTIONNAME is selected as well.
+
+    Returns a list of (name, path) pairs without duplicates, in the
+    order they were selected, and the specs that matched no rule.
+    """
+    from .. import find_rule, find_rules
+    from ..rules import Rule
+
+    selected: dict[str, Path] = {}
+    missing: list[str] = []
+
+    def rule_get(path: Path, key: str) -> object:
+        try:
+            return Rule(str(path)).get(key, None, True)
+        except Exception:
+            # An invalid rule is reported when it runs
+            return None
+
+    for spec in specs:
+        if spec.startswith('@'):
+            tag = spec[1:]
+            matches = [(name, path) for name, path in find_rules('*')
+                       if tag in (rule_get(path, '/tags') or ())]
+        elif any(c in spec for c in '*?['):
+            matches = find_rules(spec)
+        else:
+            path = find_rule(spec)
+            matches = [(spec, path)] if path is not None else []
+
+        if not matches:
+            missing.append(spec)
+        for name, path in matches:
+            selected.setdefault(name, path)
+
+    if all_rules:
+        for name, path in find_rules('*'):
+            if rule_get(path, f"/{actionname}") is not None:
+                selected.setdefault(name, path)
+
+    return list(selected.items()), missing
+
+def _enter_batch(cls: ActionType, rules: list[tuple[str, Path]],
+                 cwd: Optional[str]=None) -> Optional[ContextManager]:
+    # Enter the batch() context of CLS, if it has one
+    from ..rules import Rule
+
+    batch = getattr(cls, 'batch', None)
+    if batch is None:
+        return None
+
+    context = batch([Rule(str(path), base=cwd) for _, path in rules])
+    context.__enter__()
+    return context
+
+# Worker process state
+_worker_action: Optional[ActionType] = None
+_worker_actionname = ""
+_worker_records: list[logging.LogRecord] = []
+
+def _load(actionfile: Path | list[Path], actionname: str) -> ActionType:
+    # Load an action, or a chain of them if ACTIONNAME is 'a+b+...'
+    from . import load_action
+
+    if isinstance(actionfile, list):
+        from .chain import ActionChain
+        names = actionname.split('+')
+        return ActionChain([(name, load_action(f, name)) # pyright: ignore
+                            for name, f in zip(names, actionfile)])
+
+    return load_action(actionfile, actionname)
+
+def _init_worker(actionfile: Path | list[Path], actionname: str,
+                 rules: list[tuple[str, Path]], cwd: Optional[str]) -> None:
+    from multiprocessing.util import Finalize
+
+    global _worker_action, _worker_actionname, _worker_records
+
+    _worker_records = _capture_records().records
+    _worker_action = _load(actionfile, actionname)
+    _worker_actionname = actionname
+
+    # The batch lasts as long as the worker
+    context = _enter_batch(_worker_action, rules, cwd)
+    if context is not None:
+        Finalize(None, context.__exit__, args=(None, None, None), exitpriority=10)
+
+def _portable_record(record: logging.LogRecord) -> logging.LogRecord:
+    # Arguments and tracebacks might not be picklable
+    record.msg = record.getMessage()
+    record.args = None
+    if record.exc_info:
+        record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+
+    return record
+
+def _run_in_worker(rulename: str, rulefile: Path, cwd: Optional[str]) -> RuleResult:
+    assert _worker_action is not None
+
+    _worker_records.clear()
+    result = run_rule(_worker_action, _worker_actionname, rulename, rulefile, cwd)
+
+    return result._replace(records=tuple(_portable_record(r) for r in _worker_records))
+
+def run_rules(actionfile: Path | list[Path], actionname: str,
+              rules: list[tuple[str, Path]], jobs: int=1,
+              cwd: Optional[str]=None) -> list[RuleResult]:
+    """
+    Run an action with each of RULES.
+
+    ACTIONFILE and ACTIONNAME identify the action. For a chain
+    of actions (see jbackup.actions.chain), ACTIONNAME is their
+    names joined by '+' and ACTIONFILE is a list of their files.
+    RULES is a list of (name, path) pairs. If JOBS is greater
+    than one, the rules are run in that many worker processes.
+    Relative paths in the rules are taken relative to CWD, if
+    it is given (see run_rule()).
+
+    If the action has a batch() method, it is entered before
+    the first rule and exited after the last. If it fails, every
+    rule fails.
+
+    Results are returned in the same order as RULES.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Loading the action here surfaces errors before any worker starts,
+    # and forked workers inherit the loaded class
+    cls = _load(actionfile, actionname)
+
+    if not rules:
+        return []
+
+    if jobs <= 1 or len(rules) <= 1:
+        try:
+            context = _enter_batch(cls, rules, cwd)
+        except Exception as exc:
+            get_logger('').debug("%s", traceback.format_exc())
+            error = f"batch setup failed: {type(exc).__name__}: {exc}"
+            return [RuleResult(name, 1, error) for name, _ in rules]
+
+        try:
+            return [run_rule(cls, actionname, name, path, cwd) for name, path in rules]
+        finally:
+            if context is not None:
+                context.__exit__(None, None, None)
+
+    results: list[RuleResult] = []
+    with ProcessPoolExecutor(max_workers=min(jobs, len(rules)),
+                             initializer=_init_worker,
+                             initargs=(actionfile, actionname, rules, cwd)) as executor:
+        futures = [executor.submit(_run_in_worker, name, path, cwd) for name, path in rules]
+        for (name, _), future in zip(rules, futures):
+            try:
+                result = future.result()
+            except Exception as exc:
+                # The worker itself failed, e.g. loading the action
+                result = RuleResult(name, 1, f"{type(exc).__name__}: {exc}")
+
+            # Emit the worker's records here
+            for record in result.records:
+                logging.getLogger(record.name).handle(record)
+
+            results.append(result._replace(records=()))
+
+    return results
+
+def run_action(actionname: str, specs: Iterable[str], *,
+               all_rules: bool=False, jobs: int=1, cwd: Optional[str]=None) -> int:
+    """
+    Find the action ACTIONNAME and run it with the rules selected by SPECS.
+
+    ACTIONNAME can be a chain of actions joined by '+', such as
+    'archive+copy' (see jbackup.actions.chain).
+
+    See select_rules() for SPECS and ALL_RULES, and run_rules()
+    for JOBS and CWD. Errors are logged. Returns 0 if every rule
+    was found and succeeded, and 1 otherwise.
+    """
+    from .. import find_action
+    from . import ActionNotLoaded
+    from .chain import ChainError
+
+    logger = get_logger('')
+
+    # Get the action files; 'a+b' is a chain
+    names = actionname.split('+')
+    actionfiles: list[Path] = []
+    for name in names:
+        actionfile = find_action(name)
+        if actionfile is None:
+            logger.error("no action called '%s' exists", name)
+            return 1
+        logger.info("found action class in %s", actionfile)
+        actionfiles.append(actionfile)
+
+    # Find rules; with --all, those with a section for the first action
+    code = 0
+    rules, missing = select_rules(specs, names[0], all_rules=all_rules)
+    for spec in missing:
+        logger.error("no rule matches: %s", spec)
+        code = 1
+    logger.debug("selected rules: %s", ", ".join(name for name, _ in rules))
+
+    # Run the action with each rule
+    try:
+        results = run_rules(actionfiles if len(actionfiles) > 1 else actionfiles[0],
+                            actionname, rules, jobs, cwd)
+    except ActionNotLoaded as exc:
+        logger.error("failed to load action %s", exc)
+        return 1
+    except ChainError as exc:
+        logger.error("invalid chain %s: %s", actionname, exc)
+        return 1
+
+    for result in results:
+        if not result.ok:
+            logger.error("action %s failed with rule %s: %s",
+                         actionname, result.rule, result.error)
+            code = 1
+
+    if len(results) > 1:
+        failed = sum(1 for result in results if not result.ok)
+        logger.info("ran %s with %d rules, %d failed", actionname, len(results), failed)
+
+    return code
@@ -0,0 +1,300 @@
+"""
+Streaming archives.
+
+Archives are written as a single stream: files are read in
+small blocks, passed through tarfile and a compressor, and
+written to the destination in chunks of a fixed size. Nothing
+is staged in a temporary file, and memory use does not depend
+on the size of the tree being archived.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from .parallel import ParallelCompressor, DEFAULT_BLOCK_SIZE
+from ..manifest import Manifest, HashingReader
+from ..scan import Scanner
+import io, os, tarfile, time
+
+if TYPE_CHECKING:
+    from typing import BinaryIO, Collection, Iterable, Iterator, Optional
+
+__all__ = [
+    # Classes
+    'ArchiveStats',
+    'ChunkedWriter',
+    'ParallelCompressor',
+
+    # Functions
+    'archive_suffix',
+    'open_compressor',
+    'write_archive',
+
+    # Variables
+    'CODECS',
+    'DEFAULT_BLOCK_SIZE',
+    'DELETED_MEMBER',
+    'DEFAULT_CHUNK_SIZE'
+]
+
+# Codec names mapped to the suffix of the archive
+CODECS: dict[str, str] = {
+    'none': '.tar',
+    'gz': '.tar.gz',
+    'bz2': '.tar.bz2',
+    'xz': '.tar.xz'
+}
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Lists the files deleted since the previous backup
+DELETED_MEMBER = '.jbackup-deleted'
+
+_DEFAULT_LEVELS = {'gz': 6, 'bz2': 9, 'xz': 6}
+
+class ArchiveStats(NamedTuple):
+    """Statistics about a written archive."""
+
+    files: int
+    bytes_in: int
+    bytes_out: int
+    unchanged: int = 0
+    deleted: int = 0
+
+class ChunkedWriter(io.RawIOBase):
+    """A writable stream that passes data on in fixed-size chunks."""
+
+    def __init__(self, fileobj: BinaryIO, chunk_size: int=DEFAULT_CHUNK_SIZE):
+        """
+        Wrap FILEOBJ so that it is written in chunks of CHUNK_SIZE bytes.
+
+        Closing the writer flushes the last, smaller chunk, but
+        does not close FILEOBJ.
+        """
+        if chunk_size <= 0:
+            raise ValueError(f"invalid chunk size {chunk_size}")
+
+        super().__init__()
+        self._fileobj = fileobj
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self.bytes_written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int: # pyright: ignore
+        if self.closed:
+            raise ValueError("write to closed file")
+
+        size = len(data)
+        buf = self._buffer
+        buf += data
+
+        chunk_size = self._chunk_size
+        if len(buf) >= chunk_size:
+            view = memoryview(buf)
+            end = len(buf) - len(buf) % chunk_size
+            for i in range(0, end, chunk_size):
+                self._fileobj.write(view[i:i + chunk_size])
+            view.release()
+            del buf[:end]
+            self.bytes_written += end
+
+        return size
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._fileobj.write(bytes(self._buffer))
+            self.bytes_written += len(self._buffer)
+            self._buffer.clear()
+        self._fileobj.flush()
+
+    def close(self) -> None:
+        if not self.closed:
+            self.flush()
+        super().close()
+
+def archive_suffix(codec: str) -> str:
+    """Return the file suffix of an archive compressed with CODEC."""
+    try:
+        return CODECS[codec]
+    except KeyError:
+        raise ValueError(f"invalid codec '{codec}', must be one of {', '.join(CODECS)}")
+
+def open_compressor(fileobj: BinaryIO, codec: str='gz', level: Optional[int]=None, *,
+                    threads: int=1, block_size: int=DEFAULT_BLOCK_SIZE) -> BinaryIO:
+    """
+    Return a writable stream that compresses into FILEOBJ.
+
+    CODEC is one of the keys of CODECS. LEVEL is the compression
+    level, or the codec's default if None. Closing the returned
+    stream finishes the compressed data, but does not close
+    FILEOBJ. With the 'none' codec, FILEOBJ is returned.
+
+    If THREADS is not 1, the data is compressed in blocks of
+    BLOCK_SIZE bytes by that many threads, or one per CPU if
+    THREADS is 0 (see ParallelCompressor).
+
+    ValueError is raised for an invalid CODEC.
+    """
+    archive_suffix(codec)
+    if level is None:
+        level = _DEFAULT_LEVELS.get(codec, 0)
+
+    if codec != 'none' and threads != 1:
+        return ParallelCompressor(fileobj, codec, level, # pyright: ignore
+                                  threads=threads if threads > 0 else None,
+                                  block_size=block_size)
+
+    if codec == 'gz':
+        import gzip
+        return gzip.GzipFile(filename='', mode='wb', fileobj=fileobj,
+                             compresslevel=level, mtime=0) # pyright: ignore
+    elif codec == 'bz2':
+        import bz2
+        return bz2.BZ2File(fileobj, 'wb', compresslevel=level) # pyright: ignore
+    elif codec == 'xz':
+        import lzma
+        return lzma.LZMAFile(fileobj, 'wb', preset=level) # pyright: ignore
+
+    return fileobj
+
+def _carry_over(previous: Manifest, manifest: Manifest, sources: Iterable[Path],
+                changes: Collection[str]) -> int:
+    # Copy the entries of PREVIOUS that CHANGES does not touch into
+    # MANIFEST, and return their number
+    changed: set[str] = set()
+    for source in sources:
+        source_path = os.path.abspath(source)
+        arcname = Path(source).name
+        for path in changes:
+            if path == source_path or source_path.startswith(path.rstrip('/') + '/'):
+                # The whole source was rescanned
+                changed.add(arcname)
+            elif path.startswith(source_path + '/'):
+                changed.add(arcname + path[len(source_path):])
+
+    count = 0
+    for name, entry in previous.entries.items():
+        if name in manifest:
+            continue
+        parts = name.split('/')
+        if not any('/'.join(parts[:i]) in changed for i in range(1, len(parts) + 1)):
+            manifest.entries[name] = entry
+            count += 1
+
+    return count
+
+def write_archive(fileobj: BinaryIO, sources: Iterable[Path], *,
+                  codec: str='gz', level: Optional[int]=None,
+                  chunk_size: int=DEFAULT_CHUNK_SIZE,
+                  threads: int=1,
+                  exclude: Iterable[str]=(),
+                  include: Iterable[str]=(),
+                  gitignore: bool=False,
+                  manifest: Optional[Manifest]=None,
+                  previous: Optional[Manifest]=None,
+                  changes: Optional[Collection[str]]=None,
+                  checksums: Optional[Manifest]=None) -> ArchiveStats:
+    """
+    Write a tar archive of SOURCES to FILEOBJ.
+
+    Each of SOURCES is added recursively under its own name.
+    EXCLUDE, INCLUDE and GITIGNORE select the members, as
+    gitignore patterns matched against their path inside
+    the archive (see jbackup.scan.Scanner). CODEC, LEVEL and THREADS select the compression
+    (see open_compressor()), and the output is written to FILEOBJ
+    in chunks of CHUNK_SIZE bytes.
+
+    If MANIFEST is given, every regular file is added to it,
+    hashed as it is read into the archive.
+
+    If PREVIOUS is given, the archive is incremental: regular
+    files that are unchanged since PREVIOUS, judging by their
+    stat results alone, are not read or archived; their entries
+    are copied to MANIFEST instead. The paths in PREVIOUS that no
+    longer exist are listed, one per line, in a member named
+    DELETED_MEMBER at the end of the archive.
+
+    If CHANGES is also given, it holds the absolute paths that
+    changed since PREVIOUS, such as those in a change journal
+    (see jbackup.journal). Only they are scanned, and the rest of
+    PREVIOUS is carried over as it is. GITIGNORE must be false.
+
+    If CHECKSUMS is given, the regular files that are put in the
+    archive are added to it, unlike MANIFEST, which also keeps the
+    unchanged files of an incremental archive (see jbackup.verify).
+
+    FILEOBJ is not closed.
+    """
+    scanner = Scanner(exclude, include, gitignore=gitignore)
+    if changes is not None and previous is None:
+        raise ValueError("CHANGES requires PREVIOUS")
+    sources = list(sources)
+    files = 0
+    bytes_in = 0
+    unchanged = 0
+    deleted: list[str] = []
+
+    if previous is not None and manifest is None:
+        manifest = Manifest()
+
+    writer = ChunkedWriter(fileobj, chunk_size)
+    compressor = open_compressor(writer, codec, level, threads=threads) # pyright: ignore
+
+    try:
+        with tarfile.open(fileobj=compressor, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+            for source in sources:
+                if changes is None:
+                    entries = scanner.scan(source)
+                else:
+                    entries = scanner.scan_paths(source, changes, Path(source).name)
+                for path, name, st in entries:
+                    tarinfo = tar.gettarinfo(path, name)
+                    if tarinfo is None:
+                        # Sockets and the like
+                        continue
+
+                    if not tarinfo.isreg():
+                        tar.addfile(tarinfo)
+                        continue
+
+                    if previous is not None and previous.is_unchanged(name, st):
+                        assert manifest is not None
+                        manifest.entries[name] = previous.entries[name]
+                        unchanged += 1
+                        continue
+
+                    with open(path, 'rb') as fd:
+                        reader = HashingReader(fd)
+                        tar.addfile(tarinfo, reader) # pyright: ignore
+                    if manifest is not None:
+                        manifest.add(name, st, reader.hexdigest())
+                    if checksums is not None:
+                        checksums.add(name, st, reader.hexdigest())
+
+                    files += 1
+                    bytes_in += tarinfo.size
+
+            if changes is not None:
+                assert previous is not None and manifest is not None
+                unchanged += _carry_over(previous, manifest, sources, changes)
+
+            if previous is not None:
+                assert manifest is not None
+                deleted = [path for path in previous.entries if path not in manifest]
+                data = "".join(f"{path}\n" for path in deleted).encode()
+                tarinfo = tarfile.TarInfo(DELETED_MEMBER)
+                tarinfo.size = len(data)
+                tarinfo.mtime = int(time.time())
+                tar.addfile(tarinfo, io.BytesIO(data))
+    finally:
+        # Also on failure, so that a parallel compressor stops its threads
+        try:
+            if compressor is not writer:
+                compressor.close()
+        finally:
+            writer.close()
+
+    return ArchiveStats(files, bytes_in, writer.bytes_written, unchanged, len(deleted))
@@ -0,0 +1,119 @@
+"""
+Block-parallel compression.
+
+The input stream is split into blocks of a fixed size, and
+each block is compressed on its own in a thread pool. zlib,
+bz2 and lzma release the GIL while they compress, so the
+blocks are compressed in parallel.
+
+Each block becomes a complete gzip member, bzip2 stream or
+xz stream, written in the order of the input. Concatenations
+of these are valid files for gzip, bzip2 and xz, so the
+output can be decompressed by the usual tools.
+"""
+
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from collections import deque
+import io, os, gzip, bz2, lzma
+
+if TYPE_CHECKING:
+    from typing import BinaryIO, Callable, Optional
+    from concurrent.futures import Future
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+def _compress_function(codec: str, level: int) -> Callable[[bytes], bytes]:
+    if codec == 'gz':
+        return lambda data: gzip.compress(data, compresslevel=level, mtime=0)
+    elif codec == 'bz2':
+        return lambda data: bz2.compress(data, compresslevel=level)
+    elif codec == 'xz':
+        return lambda data: lzma.compress(data, preset=level)
+
+    raise ValueError(f"codec '{codec}' cannot be compressed in parallel")
+
+def cpu_count() -> int:
+    """Return the number of CPUs this process can run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: # pragma: no cover
+        return os.cpu_count() or 1
+
+class ParallelCompressor(io.RawIOBase):
+    """A writable stream that compresses blocks on a thread pool."""
+
+    def __init__(self, fileobj: BinaryIO, codec: str, level: int, *,
+                 threads: Optional[int]=None,
+                 block_size: int=DEFAULT_BLOCK_SIZE):
+        """
+        Compress the data written to this stream into FILEOBJ.
+
+        CODEC is 'gz', 'bz2' or 'xz', and LEVEL is the compression
+        level. The data is split into blocks of BLOCK_SIZE bytes,
+        which are compressed by THREADS threads (all CPUs if None).
+        At most twice as many blocks as threads are held in memory.
+
+        Closing the stream writes the remaining blocks, but does not
+        close FILEOBJ.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if block_size <= 0:
+            raise ValueError(f"invalid block size {block_size}")
+
+        super().__init__()
+        self._compress = _compress_function(codec, level)
+        self._fileobj = fileobj
+        self._block_size = block_size
+        self._threads = threads or cpu_count()
+        self._executor = ThreadPoolExecutor(max_workers=self._threads,
+                                            thread_name_prefix='jbackup-compress')
+        self._pending: deque[Future[bytes]] = deque()
+        self._buffer = bytearray()
+        self._blocks = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def _submit(self, block: bytes) -> None:
+        self._pending.append(self._executor.submit(self._compress, block))
+        self._blocks += 1
+
+        # Keep the pool busy but bound the memory in use
+        while len(self._pending) > 2 * self._threads:
+            self._fileobj.write(self._pending.popleft().result())
+
+    def write(self, data) -> int: # pyright: ignore
+        if self.closed:
+            raise ValueError("write to closed file")
+
+        size = len(data)
+        buf = self._buffer
+        buf += data
+
+        block_size = self._block_size
+        if len(buf) >= block_size:
+            end = len(buf) - len(buf) % block_size
+            for i in range(0, end, block_size):
+                self._submit(bytes(buf[i:i + block_size]))
+            del buf[:end]
+
+        return size
+
+    def close(self) -> None:
+        if self.closed:
+            return
+
+        try:
+            # An empty input still needs one (empty) block to be valid
+            if self._buffer or not self._blocks:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+
+            while self._pending:
+                self._fileobj.write(self._pending.popleft().result())
+            self._fileobj.flush()
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+            super().close()
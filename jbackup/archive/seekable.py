@@ -0,0 +1,682 @@
+"""
+Seekable archives.
+
+A seekable archive stores each file as a run of frames that are
+compressed independently of each other and of the other files,
+and ends with an index of its members. A reader looks up a path
+in the index and decompresses only the frames of that file, so
+restoring one file costs the same no matter how large the
+archive is or where in it the file is.
+
+Layout, with little-endian integers:
+
+    header      b'JBKARC01', the codec (1 byte), 7 reserved bytes
+    frames      for each file, frames of a compressed length and a
+                raw length (4 bytes each) followed by the data
+    index       one fixed-size record per member, sorted by path
+    strings     the paths of the members, referred to by the records
+    footer      the offsets of the index and strings, the number of
+                members, and b'JBKEND01'
+
+The index is sorted, so a reader that maps the file into memory
+finds a member by binary search without parsing the whole index.
+The archive is written in one pass and can be streamed.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from ..manifest import Manifest, new_hash
+import os, stat, struct, time
+
+if TYPE_CHECKING:
+    from typing import BinaryIO, Callable, Collection, Iterable, Iterator, Optional
+    from concurrent.futures import Executor, Future
+    from . import ArchiveStats
+
+__all__ = [
+    # Classes
+    'ArchiveError',
+    'ArchiveSet',
+    'SeekableArchive',
+    'SeekableEntry',
+
+    # Functions
+    'extract_members',
+    'find_archives',
+    'is_seekable',
+    'write_seekable',
+
+    # Variables
+    'DEFAULT_FRAME_SIZE',
+    'SEEKABLE_SUFFIX'
+]
+
+SEEKABLE_SUFFIX = '.jbk'
+
+DEFAULT_FRAME_SIZE = 4 * 1024 * 1024
+
+_MAGIC = b'JBKARC01'
+_END_MAGIC = b'JBKEND01'
+_HEADER = struct.Struct('<8sB7x')
+_FRAME = struct.Struct('<II')
+_RECORD = struct.Struct('<QIBIqQQQ32s')
+_FOOTER = struct.Struct('<QQQ8s')
+
+_CODECS = {'none': 0, 'gz': 1, 'bz2': 2, 'xz': 3}
+
+# Frames decompressed ahead of the one being read
+_READ_AHEAD = 16
+
+# Members at least this large are extracted frame by frame in parallel
+_LARGE_MEMBER = 4 * DEFAULT_FRAME_SIZE
+
+# Kinds of members
+_FILE, _DIR, _SYMLINK = 0, 1, 2
+
+class ArchiveError(Exception):
+    """Raised for an invalid or damaged seekable archive."""
+
+class SeekableEntry(NamedTuple):
+    """A member of a seekable archive."""
+
+    path: str
+    kind: int
+    mode: int
+    mtime_ns: int
+    size: int
+    offset: int
+    length: int
+    hash: str
+
+    @property
+    def is_dir(self) -> bool:
+        return self.kind == _DIR
+
+    @property
+    def is_file(self) -> bool:
+        return self.kind == _FILE
+
+    @property
+    def is_symlink(self) -> bool:
+        return self.kind == _SYMLINK
+
+def _compressor(codec: str, level: Optional[int]) -> Callable[[bytes], bytes]:
+    if codec == 'gz':
+        import zlib
+        return lambda data: zlib.compress(data, 6 if level is None else level)
+    elif codec == 'bz2':
+        import bz2
+        return lambda data: bz2.compress(data, 9 if level is None else level)
+    elif codec == 'xz':
+        import lzma
+        return lambda data: lzma.compress(data, preset=6 if level is None else level)
+    elif codec == 'none':
+        return bytes
+
+    raise ValueError(f"invalid codec '{codec}', must be one of {', '.join(_CODECS)}")
+
+def _decompressor(codec_id: int) -> Callable[[bytes], bytes]:
+    if codec_id == _CODECS['gz']:
+        import zlib
+        return zlib.decompress
+    elif codec_id == _CODECS['bz2']:
+        import bz2
+        return bz2.decompress
+    elif codec_id == _CODECS['xz']:
+        import lzma
+        return lzma.decompress
+    elif codec_id == _CODECS['none']:
+        return bytes
+
+    raise ArchiveError(f"unknown codec {codec_id}")
+
+def _encode(path: str) -> bytes:
+    return path.encode('utf-8', 'surrogateescape')
+
+class _Writer:
+    # Writes frames and keeps the index of the members
+    def __init__(self, fileobj: BinaryIO, codec: str, level: Optional[int],
+                 frame_size: int, threads: int):
+        self.fileobj = fileobj
+        self.compress = _compressor(codec, level)
+        self.frame_size = frame_size
+        self.offset = 0
+        self.records: list[tuple[bytes, int, int, int, int, int, int, bytes]] = []
+        self.pool = None
+        if threads != 1:
+            from concurrent.futures import ThreadPoolExecutor
+            from .parallel import cpu_count
+
+            self.threads = threads if threads > 0 else cpu_count()
+            self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix='jbackup-frame')
+
+        self._write(_HEADER.pack(_MAGIC, _CODECS[codec]))
+
+    def _write(self, data: bytes) -> None:
+        self.fileobj.write(data)
+        self.offset += len(data)
+
+    def _frames(self, blocks: Iterator[bytes]) -> Iterator[tuple[bytes, int]]:
+        # Compressed frames with their raw size, in order
+        if self.pool is None:
+            for block in blocks:
+                yield self.compress(block), len(block)
+            return
+
+        from collections import deque
+
+        pending: deque = deque()
+        for block in blocks:
+            pending.append((self.pool.submit(self.compress, block), len(block)))
+            if len(pending) >= self.threads * 2:
+                future, size = pending.popleft()
+                yield future.result(), size
+        while pending:
+            future, size = pending.popleft()
+            yield future.result(), size
+
+    def add(self, name: str, kind: int, mode: int, mtime_ns: int,
+            data: Optional[BinaryIO]=None) -> tuple[int, str]:
+        """Add a member with the contents of DATA; return their size and hash."""
+        digest = new_hash()
+
+        def blocks() -> Iterator[bytes]:
+            if data is None:
+                return
+            while block := data.read(self.frame_size):
+                digest.update(block)
+                yield block
+
+        start = self.offset
+        size = 0
+        for frame, raw_size in self._frames(blocks()):
+            self._write(_FRAME.pack(len(frame), raw_size))
+            self._write(frame)
+            size += raw_size
+
+        self.records.append((_encode(name), kind, mode, mtime_ns,
+                             size, start, self.offset - start, digest.digest()))
+        return size, digest.hexdigest()
+
+    def finish(self) -> None:
+        self.records.sort(key=lambda record: record[0])
+        strings = bytearray()
+        index = bytearray()
+        for name, kind, mode, mtime_ns, size, offset, length, digest in self.records:
+            index += _RECORD.pack(len(strings), len(name), kind, mode, mtime_ns,
+                                  size, offset, length, digest)
+            strings += name
+
+        index_offset = self.offset
+        self._write(bytes(index))
+        strings_offset = self.offset
+        self._write(bytes(strings))
+        self._write(_FOOTER.pack(index_offset, len(self.records), strings_offset, _END_MAGIC))
+
+        if self.pool is not None:
+            self.pool.shutdown()
+
+def write_seekable(fileobj: BinaryIO, sources: Iterable[Path], *,
+                   codec: str='gz', level: Optional[int]=None,
+                   frame_size: int=DEFAULT_FRAME_SIZE,
+                   threads: int=1,
+                   exclude: Iterable[str]=(),
+                   include: Iterable[str]=(),
+                   gitignore: bool=False,
+                   manifest: Optional[Manifest]=None,
+                   previous: Optional[Manifest]=None,
+                   changes: Optional[Collection[str]]=None,
+                   checksums: Optional[Manifest]=None) -> ArchiveStats:
+    """
+    Write a seekable archive of SOURCES to FILEOBJ.
+
+    Files are split into frames of FRAME_SIZE bytes, which are
+    compressed with CODEC at LEVEL, by THREADS threads if it is
+    not 1 (0 for one per CPU). The other arguments and the
+    result are those of write_archive(); the list of deleted
+    files of an incremental archive is a member named
+    DELETED_MEMBER. With CHANGES, it also lists the changed
+    directories and symbolic links that no longer exist.
+
+    FILEOBJ is not closed.
+    """
+    from . import ArchiveStats, DELETED_MEMBER, _carry_over
+    from ..scan import Scanner
+    import io
+
+    scanner = Scanner(exclude, include, gitignore=gitignore)
+    if changes is not None and previous is None:
+        raise ValueError("CHANGES requires PREVIOUS")
+    sources = list(sources)
+    files = 0
+    bytes_in = 0
+    unchanged = 0
+    deleted: list[str] = []
+
+    if previous is not None and manifest is None:
+        manifest = Manifest()
+
+    writer = _Writer(fileobj, codec, level, frame_size, threads)
+    try:
+        for source in sources:
+            if changes is None:
+                entries = scanner.scan(source)
+            else:
+                entries = scanner.scan_paths(source, changes, Path(source).name)
+            for path, name, st in entries:
+                mode = stat.S_IMODE(st.st_mode)
+                if stat.S_ISDIR(st.st_mode):
+                    writer.add(name, _DIR, mode, st.st_mtime_ns)
+                    continue
+                if stat.S_ISLNK(st.st_mode):
+                    writer.add(name, _SYMLINK, mode, st.st_mtime_ns,
+                               io.BytesIO(os.fsencode(os.readlink(path))))
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    # Sockets and the like
+                    continue
+
+                if previous is not None and previous.is_unchanged(name, st):
+                    assert manifest is not None
+                    manifest.entries[name] = previous.entries[name]
+                    unchanged += 1
+                    continue
+
+                with open(path, 'rb') as fd:
+                    size, digest = writer.add(name, _FILE, mode, st.st_mtime_ns, fd) # pyright: ignore
+                if manifest is not None:
+                    manifest.add(name, st, digest)
+                if checksums is not None:
+                    checksums.add(name, st, digest)
+
+                files += 1
+                bytes_in += size
+
+        if changes is not None:
+            assert previous is not None and manifest is not None
+            unchanged += _carry_over(previous, manifest, sources, changes)
+
+        if previous is not None:
+            assert manifest is not None
+            deleted = [path for path in previous.entries if path not in manifest]
+            if changes is not None:
+                # Directories and symbolic links are not in the manifest
+                deleted += sorted(_vanished(sources, changes) - set(deleted))
+            data = "".join(f"{path}\n" for path in deleted).encode()
+            writer.add(DELETED_MEMBER, _FILE, 0o644, time.time_ns(), io.BytesIO(data))
+
+        writer.finish()
+    finally:
+        if writer.pool is not None:
+            writer.pool.shutdown(cancel_futures=True)
+
+    return ArchiveStats(files, bytes_in, writer.offset, unchanged, len(deleted))
+
+def _vanished(sources: list[Path], changes: Collection[str]) -> set[str]:
+    # The names of the paths in CHANGES under SOURCES that no longer exist
+    names: set[str] = set()
+    for source in sources:
+        source_path = os.path.abspath(source)
+        arcname = Path(source).name
+        for path in changes:
+            if path.startswith(source_path + '/') and not os.path.lexists(path):
+                names.add(arcname + path[len(source_path):])
+
+    return names
+
+def is_seekable(filename: str | Path) -> bool:
+    """Whether FILENAME starts like a seekable archive."""
+    try:
+        with open(filename, 'rb') as fd:
+            return fd.read(len(_MAGIC)) == _MAGIC
+    except OSError:
+        return False
+
+class SeekableArchive:
+    """A seekable archive opened for reading."""
+
+    def __init__(self, filename: str | Path):
+        """
+        Open the archive FILENAME and map it into memory.
+
+        ArchiveError is raised if it is not a complete
+        seekable archive.
+        """
+        import mmap
+
+        self.filename = Path(filename)
+        with open(filename, 'rb') as fd:
+            size = os.fstat(fd.fileno()).st_size
+            if size < _HEADER.size + _FOOTER.size:
+                raise ArchiveError(f"{filename} is not a seekable archive")
+            self._map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, codec_id = _HEADER.unpack_from(self._map, 0)
+            index_offset, count, strings_offset, end = \
+                _FOOTER.unpack_from(self._map, size - _FOOTER.size)
+            if magic != _MAGIC:
+                raise ArchiveError(f"{filename} is not a seekable archive")
+            if end != _END_MAGIC or index_offset + count * _RECORD.size != strings_offset \
+               or strings_offset > size - _FOOTER.size:
+                raise ArchiveError(f"{filename} is incomplete or damaged")
+            self._decompress = _decompressor(codec_id)
+        except BaseException:
+            self._map.close()
+            raise
+
+        self._index = index_offset
+        self._strings = strings_offset
+        self._count = count
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self) -> SeekableArchive:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _name(self, i: int) -> bytes:
+        name_offset, name_length = struct.unpack_from('<QI', self._map, self._index + i * _RECORD.size)
+        start = self._strings + name_offset
+        return self._map[start:start + name_length]
+
+    def _entry(self, i: int) -> SeekableEntry:
+        _, _, kind, mode, mtime_ns, size, offset, length, digest = \
+            _RECORD.unpack_from(self._map, self._index + i * _RECORD.size)
+        path = self._name(i).decode('utf-8', 'surrogateescape')
+        return SeekableEntry(path, kind, mode, mtime_ns, size, offset, length, digest.hex())
+
+    def _bisect(self, name: bytes) -> int:
+        # The index of the first member not sorted before NAME
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(mid) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def __iter__(self) -> Iterator[SeekableEntry]:
+        for i in range(self._count):
+            yield self._entry(i)
+
+    def get(self, path: str) -> Optional[SeekableEntry]:
+        """Return the member PATH, or None."""
+        name = _encode(path)
+        i = self._bisect(name)
+        if i < self._count and self._name(i) == name:
+            return self._entry(i)
+        return None
+
+    def list(self, path: str='') -> Iterator[SeekableEntry]:
+        """Yield the member PATH and the members under it, or every member if PATH is ''."""
+        path = path.strip('/')
+        if not path:
+            yield from self
+            return
+
+        entry = self.get(path)
+        if entry is not None:
+            yield entry
+
+        prefix = _encode(path) + b'/'
+        for i in range(self._bisect(prefix), self._count):
+            if not self._name(i).startswith(prefix):
+                break
+            yield self._entry(i)
+
+    def _frames(self, entry: SeekableEntry) -> Iterator[tuple[int, int, int]]:
+        # The offset, compressed length and raw size of each frame of ENTRY
+        offset, end = entry.offset, entry.offset + entry.length
+        while offset < end:
+            length, raw_size = _FRAME.unpack_from(self._map, offset)
+            offset += _FRAME.size
+            yield offset, length, raw_size
+            offset += length
+
+    def read(self, entry: SeekableEntry, *, pool: Optional[Executor]=None) -> Iterator[bytes]:
+        """
+        Yield the contents of ENTRY, frame by frame.
+
+        If POOL is given, the frames ahead of the one being read
+        are decompressed on it. ArchiveError is raised if the
+        contents do not match the hash of the member.
+        """
+        from collections import deque
+
+        def decompress(offset: int, length: int) -> bytes:
+            return self._decompress(self._map[offset:offset + length])
+
+        pending: deque[tuple[Future[bytes], int]] = deque()
+        frames = self._frames(entry)
+        digest = new_hash()
+        while True:
+            if pool is None:
+                frame = next(frames, None)
+                if frame is None:
+                    break
+                offset, length, raw_size = frame
+                data = decompress(offset, length)
+            else:
+                for offset, length, raw_size in frames:
+                    pending.append((pool.submit(decompress, offset, length), raw_size))
+                    if len(pending) >= _READ_AHEAD:
+                        break
+                if not pending:
+                    break
+                future, raw_size = pending.popleft()
+                data = future.result()
+
+            if len(data) != raw_size:
+                raise ArchiveError(f"{self.filename}: {entry.path} is damaged")
+            digest.update(data)
+            yield data
+
+        if digest.hexdigest() != entry.hash:
+            raise ArchiveError(f"{self.filename}: {entry.path} does not match its hash")
+
+    def read_bytes(self, entry: SeekableEntry) -> bytes:
+        """Return the contents of ENTRY (see read())."""
+        return b''.join(self.read(entry))
+
+    def deleted(self) -> list[str]:
+        """Return the paths that the archive lists as deleted since the previous one."""
+        from . import DELETED_MEMBER
+
+        entry = self.get(DELETED_MEMBER)
+        if entry is None:
+            return []
+        return self.read_bytes(entry).decode('utf-8', 'surrogateescape').splitlines()
+
+    def extract(self, entry: SeekableEntry, target: str | Path, *,
+                pool: Optional[Executor]=None) -> None:
+        """
+        Write ENTRY to TARGET, with its permission bits and modification time.
+
+        Parent directories are created as needed. A file is
+        written under a name ending in '.part' until it is
+        complete; ArchiveError is raised if it is damaged. Its
+        frames are decompressed on POOL if it is given.
+        """
+        target = Path(target)
+        target.parent.mkdir(parents=True, exist_ok=True)
+
+        if entry.is_dir:
+            target.mkdir(exist_ok=True)
+            os.chmod(target, entry.mode)
+        elif entry.is_symlink:
+            if os.path.lexists(target):
+                target.unlink()
+            os.symlink(os.fsdecode(self.read_bytes(entry)), target)
+            return
+        else:
+            partfile = target.with_name(target.name + '.part')
+            try:
+                with open(partfile, 'wb') as fd:
+                    for data in self.read(entry, pool=pool):
+                        fd.write(data)
+                os.chmod(partfile, entry.mode)
+                os.replace(partfile, target)
+            except BaseException:
+                partfile.unlink(missing_ok=True)
+                raise
+
+        os.utime(target, ns=(entry.mtime_ns, entry.mtime_ns))
+
+def find_archives(destination: str | Path, rulename: str,
+                  stamp: Optional[str]=None) -> list[Path]:
+    """
+    Return the seekable archives of RULENAME that hold its latest backup, newest first.
+
+    DESTINATION is the 'destination' of the archive action: an
+    archive, or the directory the archives of the rule are in.
+    The list ends with the latest archive that is not
+    incremental, since older ones are not needed. If STAMP is
+    given, the backup made at that time (as in the names of
+    the archives, 'YYYYmmdd-HHMMSS') is returned instead; the
+    list is empty if there is none.
+    """
+    import re
+
+    destination = Path(destination).expanduser()
+    if not destination.is_dir():
+        return [destination] if is_seekable(destination) else []
+
+    # Named by the archive action; see Action_Archive
+    pattern = re.compile(rf"{re.escape(rulename)}-(\d{{8}}-\d{{6}})(-incr)?{re.escape(SEEKABLE_SUFFIX)}")
+    found: list[tuple[str, bool, Path]] = []
+    for path in destination.glob(f"{rulename}-*{SEEKABLE_SUFFIX}"):
+        match = pattern.fullmatch(path.name)
+        if match is not None:
+            # An incremental archive made in the same second comes after the full one
+            found.append((match[1], match[2] is not None, path))
+
+    archives: list[Path] = []
+    for made, incremental, path in sorted(found, reverse=True):
+        if not archives and stamp is not None and made != stamp:
+            if made < stamp:
+                break
+            continue
+        archives.append(path)
+        if not incremental:
+            break
+
+    return archives
+
+class ArchiveSet:
+    """A full archive and the incremental archives made after it, read as one."""
+
+    def __init__(self, filenames: Iterable[str | Path]):
+        """Open FILENAMES, newest first (see find_archives())."""
+        self.archives: list[SeekableArchive] = []
+        try:
+            for filename in filenames:
+                self.archives.append(SeekableArchive(filename))
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        for archive in self.archives:
+            archive.close()
+
+    def __enter__(self) -> ArchiveSet:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def list(self, path: str='') -> list[tuple[SeekableArchive, SeekableEntry]]:
+        """
+        Return the latest version of the member PATH and the members under it.
+
+        Each member is paired with the archive it is in. Members
+        that a newer archive lists as deleted, or that are under a
+        deleted directory, are left out. So are the directories and
+        symbolic links missing from a newer archive that has their
+        parent directory, since an archive has everything under
+        the directories it scanned but the unchanged files. The
+        result is sorted by path.
+        """
+        from . import DELETED_MEMBER
+
+        found: dict[str, tuple[SeekableArchive, SeekableEntry]] = {}
+        deleted: set[str] = set()
+        for i, archive in enumerate(self.archives):
+            for entry in archive.list(path):
+                name = entry.path
+                if name == DELETED_MEMBER or name in found:
+                    continue
+                parts = name.split('/')
+                if any('/'.join(parts[:j]) in deleted for j in range(1, len(parts) + 1)):
+                    continue
+                parent = name.rpartition('/')[0]
+                if not entry.is_file and parent and any(
+                        (newer := other.get(parent)) is not None and newer.is_dir
+                        for other in self.archives[:i]):
+                    continue
+                found[name] = (archive, entry)
+            # What was deleted after the older archives were made
+            deleted.update(archive.deleted())
+
+        return [found[name] for name in sorted(found)]
+
+def extract_members(members: Iterable[tuple[SeekableArchive, SeekableEntry]],
+                    destination: str | Path, *, threads: int=1) -> int:
+    """
+    Extract MEMBERS, pairs of archives and entries, under DESTINATION.
+
+    Each member is written to its path in the archive under
+    DESTINATION. With more than one thread, up to THREADS files
+    are written at once, and the frames of large files are
+    decompressed in parallel. The modification times of
+    directories are set once their contents are written.
+    Returns the number of members extracted.
+
+    ArchiveError is raised for a member whose path would leave
+    DESTINATION.
+    """
+    destination = Path(destination)
+    dirs: list[tuple[SeekableArchive, SeekableEntry]] = []
+    files: list[tuple[SeekableArchive, SeekableEntry]] = []
+    for archive, entry in members:
+        if entry.path.startswith('/') or '..' in entry.path.split('/'):
+            raise ArchiveError(f"{archive.filename}: unsafe member path {entry.path}")
+        if entry.is_dir:
+            (destination / entry.path).mkdir(parents=True, exist_ok=True)
+            dirs.append((archive, entry))
+        else:
+            files.append((archive, entry))
+
+    if threads <= 1:
+        for archive, entry in files:
+            archive.extract(entry, destination / entry.path)
+    else:
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(threads, thread_name_prefix='jbackup-restore') as pool:
+            try:
+                futures = [pool.submit(archive.extract, entry, destination / entry.path)
+                           for archive, entry in files if entry.size < _LARGE_MEMBER]
+                # One large file at a time, its frames spread over the pool
+                for archive, entry in files:
+                    if entry.size >= _LARGE_MEMBER:
+                        archive.extract(entry, destination / entry.path, pool=pool)
+                for future in futures:
+                    future.result()
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+
+    for archive, entry in reversed(dirs):
+        archive.extract(entry, destination / entry.path)
+
+    return len(dirs) + len(files)
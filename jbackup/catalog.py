@@ -0,0 +1,308 @@
+"""
+The catalog of backups.
+
+The catalog is an SQLite database that every backup run writes
+to: the rule and action that made the backup, where it is, and
+the path, size and hash of each file in it. Questions such as
+which backups hold a version of a file, or how large a run was,
+are answered from it without opening any archive or store.
+
+Each run is written in a single transaction, and the database is
+in WAL mode, so queries are not blocked while a backup writes to
+it. Paths are stored once and referred to by number, hashes are
+stored as bytes, and paths, hashes and the backups of each rule
+are indexed, so lookups stay fast with millions of files. The
+size and number of files of each backup are kept with it, so
+statistics need not read the files.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, NamedTuple
+from ._path import get_state_path
+import time
+
+if TYPE_CHECKING:
+    from typing import Iterator, Optional
+    from sqlite3 import Connection
+    from .manifest import Manifest
+
+__all__ = [
+    # Classes
+    'Catalog',
+    'CatalogBackup',
+    'CatalogFile',
+
+    # Functions
+    'catalog_file',
+    'record_backup'
+]
+
+_SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE rules (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE backups (
+    id INTEGER PRIMARY KEY,
+    rule_id INTEGER NOT NULL REFERENCES rules(id),
+    action TEXT NOT NULL,
+    name TEXT NOT NULL,
+    location TEXT NOT NULL,
+    created REAL NOT NULL,
+    files INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE INDEX backups_rule ON backups(rule_id, created);
+CREATE INDEX backups_created ON backups(created);
+CREATE TABLE paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE files (
+    backup_id INTEGER NOT NULL REFERENCES backups(id) ON DELETE CASCADE,
+    path_id INTEGER NOT NULL REFERENCES paths(id),
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash BLOB NOT NULL,
+    PRIMARY KEY (backup_id, path_id)
+) WITHOUT ROWID;
+CREATE INDEX files_path ON files(path_id);
+CREATE INDEX files_hash ON files(hash);
+"""
+
+_BACKUP_COLUMNS = ("b.id, r.name, b.action, b.name, b.location, "
+                   "b.created, b.files, b.bytes")
+
+# Rows sent to SQLite at a time while a run is recorded
+_BATCH_SIZE = 10000
+
+class CatalogBackup(NamedTuple):
+    """A backup in the catalog."""
+
+    id: int
+    rule: str
+    action: str
+    name: str
+    location: str
+    created: float
+    files: int
+    bytes: int
+
+class CatalogFile(NamedTuple):
+    """A version of a file in a backup."""
+
+    backup: CatalogBackup
+    path: str
+    size: int
+    mtime_ns: int
+    hash: str
+
+def catalog_file() -> Path:
+    """Return the file of the catalog, in the state directory."""
+    return get_state_path('catalog.db')
+
+def _has_magic(pattern: str) -> bool:
+    return any(c in pattern for c in '*?[')
+
+@contextmanager
+def _transaction(db: Connection) -> Iterator[None]:
+    # Take the write lock up front, so that the transaction
+    # does not fail halfway because another process writes
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+class Catalog:
+    """The catalog database, opened for reading and writing."""
+
+    def __init__(self, filename: Optional[str | Path]=None):
+        """
+        Open the catalog FILENAME, or catalog_file() if it is None.
+
+        The database is created if it does not exist.
+        sqlite3.Error is raised if it cannot be opened.
+        """
+        import sqlite3
+
+        self.filename = Path(filename) if filename is not None else catalog_file()
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self._db: Connection = sqlite3.connect(self.filename, timeout=30.0,
+                                               isolation_level=None)
+        try:
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute("PRAGMA synchronous = NORMAL")
+            self._db.execute("PRAGMA foreign_keys = ON")
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                with _transaction(self._db):
+                    # Another process may have created it meanwhile
+                    if self._db.execute("PRAGMA user_version").fetchone()[0] == 0:
+                        for statement in _SCHEMA.split(';'):
+                            if statement.strip():
+                                self._db.execute(statement)
+                        self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            elif version != _SCHEMA_VERSION:
+                raise sqlite3.DatabaseError(f"{self.filename}: unsupported catalog "
+                                            f"version {version}")
+        except BaseException:
+            self._db.close()
+            raise
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> Catalog:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def record(self, rule: str, action: str, name: str, location: str | Path,
+               manifest: Manifest, *, created: Optional[float]=None) -> CatalogBackup:
+        """
+        Add the backup NAME of RULE, made by ACTION, with the files of MANIFEST.
+
+        LOCATION is where the backup is, such as the file of an
+        archive or the directory of a chunk store. CREATED is the
+        time of the backup, now by default. Everything is written
+        in one transaction, so a backup is in the catalog with all
+        its files or not at all.
+        """
+        from itertools import islice
+
+        created = time.time() if created is None else created
+        location = str(location)
+        files = len(manifest)
+        total = sum(entry.size for entry in manifest)
+
+        db = self._db
+        with _transaction(db):
+            db.execute("INSERT OR IGNORE INTO rules(name) VALUES (?)", (rule,))
+            rule_id = db.execute("SELECT id FROM rules WHERE name = ?", (rule,)).fetchone()[0]
+            backup_id = db.execute(
+                "INSERT INTO backups(rule_id, action, name, location, created, files, bytes) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (rule_id, action, name, location, created, files, total)).lastrowid
+
+            # The files go through a temporary table, so that paths are
+            # numbered in SQLite rather than looked up one by one
+            db.execute("CREATE TEMP TABLE IF NOT EXISTS incoming "
+                       "(path TEXT, size INTEGER, mtime_ns INTEGER, hash BLOB)")
+            rows = ((entry.path, entry.size, entry.mtime_ns, bytes.fromhex(entry.hash))
+                    for entry in manifest)
+            while batch := list(islice(rows, _BATCH_SIZE)):
+                db.executemany("INSERT INTO incoming VALUES (?, ?, ?, ?)", batch)
+            db.execute("INSERT OR IGNORE INTO paths(path) SELECT path FROM incoming")
+            db.execute("INSERT OR REPLACE INTO files(backup_id, path_id, size, mtime_ns, hash) "
+                       "SELECT ?, p.id, i.size, i.mtime_ns, i.hash "
+                       "FROM incoming AS i JOIN paths AS p ON p.path = i.path", (backup_id,))
+            db.execute("DELETE FROM incoming")
+
+        assert backup_id is not None
+        return CatalogBackup(backup_id, rule, action, name, location, created, files, total)
+
+    def _file_rows(self, where: str, params: tuple, rule: Optional[str]) -> list[CatalogFile]:
+        if rule is not None:
+            where += " AND r.name = ?"
+            params += (rule,)
+        rows = self._db.execute(
+            f"SELECT {_BACKUP_COLUMNS}, p.path, f.size, f.mtime_ns, f.hash "
+            "FROM files AS f "
+            "JOIN paths AS p ON p.id = f.path_id "
+            "JOIN backups AS b ON b.id = f.backup_id "
+            "JOIN rules AS r ON r.id = b.rule_id "
+            f"WHERE {where} ORDER BY b.created, b.id, p.path", params)
+        return [CatalogFile(CatalogBackup(*row[:8]), row[8], row[9], row[10], row[11].hex())
+                for row in rows]
+
+    def find(self, pattern: str, *, rule: Optional[str]=None) -> list[CatalogFile]:
+        """
+        Return the versions of the files whose paths match PATTERN.
+
+        PATTERN is a path, or a glob pattern over whole paths in
+        which '*' also matches '/'; a pattern that starts with a
+        literal prefix only looks at the paths with that prefix.
+        Only the backups of RULE are searched if it is given. The
+        result is sorted by the time of the backups.
+        """
+        if _has_magic(pattern):
+            return self._file_rows("f.path_id IN (SELECT id FROM paths WHERE path GLOB ?)",
+                                   (pattern,), rule)
+        return self._file_rows("f.path_id = (SELECT id FROM paths WHERE path = ?)",
+                               (pattern,), rule)
+
+    def find_hash(self, digest: str, *, rule: Optional[str]=None) -> list[CatalogFile]:
+        """Return the files with the content hash DIGEST, a hex string (see find())."""
+        try:
+            value = bytes.fromhex(digest)
+        except ValueError:
+            return []
+        return self._file_rows("f.hash = ?", (value,), rule)
+
+    def history(self, path: str, *, rule: Optional[str]=None) -> list[CatalogFile]:
+        """
+        Return the versions of the file PATH in which it changed, oldest first.
+
+        A version is left out if it has the same hash and size
+        as the one before it in the same rule.
+        """
+        versions: list[CatalogFile] = []
+        last: dict[str, tuple[str, int]] = {}
+        for version in self._file_rows("f.path_id = (SELECT id FROM paths WHERE path = ?)",
+                                       (path.strip('/'),), rule):
+            key = (version.hash, version.size)
+            if last.get(version.backup.rule) != key:
+                versions.append(version)
+            last[version.backup.rule] = key
+
+        return versions
+
+    def backups(self, rule: Optional[str]=None, *, limit: Optional[int]=None,
+                since: Optional[float]=None) -> list[CatalogBackup]:
+        """
+        Return the backups of RULE, or of every rule, newest first.
+
+        At most LIMIT backups are returned, and only those made
+        at SINCE or later if it is given.
+        """
+        where, params = "1", ()
+        if rule is not None:
+            where += " AND r.name = ?"
+            params += (rule,)
+        if since is not None:
+            where += " AND b.created >= ?"
+            params += (since,)
+        query = (f"SELECT {_BACKUP_COLUMNS} FROM backups AS b "
+                 f"JOIN rules AS r ON r.id = b.rule_id WHERE {where} "
+                 "ORDER BY b.created DESC, b.id DESC")
+        if limit is not None:
+            query += " LIMIT ?"
+            params += (limit,)
+
+        return [CatalogBackup(*row) for row in self._db.execute(query, params)]
+
+def record_backup(rule: str, action: str, name: str, location: str | Path,
+                  manifest: Manifest) -> Optional[CatalogBackup]:
+    """
+    Add a backup to the catalog (see Catalog.record()).
+
+    A catalog that cannot be written does not fail the backup:
+    a warning is logged and None is returned.
+    """
+    import sqlite3
+    from .logging import get_logger
+
+    try:
+        with Catalog() as catalog:
+            return catalog.record(rule, action, name, location, manifest)
+    except (OSError, sqlite3.Error) as exc:
+        get_logger('catalog').warning("could not record %s in the catalog: %s", name, exc)
+        return None
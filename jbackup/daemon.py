@@ -0,0 +1,546 @@
+"""
+The jbackup daemon.
+
+The daemon runs in the background and keeps actions and rules
+loaded, so that running an action does not pay for starting the
+interpreter, importing the action and parsing its rules every
+time. It does these things:
+
+  * It runs the schedules in rule files. A rule sets them in its
+    global 'schedule' table, which maps actions to cron
+    expressions (see jbackup.schedule):
+
+        [schedule]
+        archive = "0 3 * * *"
+
+  * It polls the data paths for new, changed and deleted rules
+    and actions, and reloads only those.
+
+  * It watches the paths in the 'watch' option of rules and
+    keeps their change journals (see jbackup.watch).
+
+  * It listens on a Unix socket, where 'jbackup do' submits jobs
+    when the daemon is running.
+
+Jobs run one at a time, in the daemon process. The socket speaks
+one line of JSON in each direction per connection; see
+Daemon.handle_request() for the commands.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from ._path import get_runtime_path
+import os, json, socket
+
+if TYPE_CHECKING:
+    from datetime import datetime
+    from typing import Any, Iterable, Optional
+    from .schedule import Schedule
+
+__all__ = [
+    # Classes
+    'Daemon',
+    'DaemonError',
+    'ScheduledJob',
+
+    # Functions
+    'request',
+    'socket_path',
+    'submit_job'
+]
+
+DEFAULT_POLL_INTERVAL = 30.0
+
+# Seconds that a running daemon has to answer a ping
+PING_TIMEOUT = 5.0
+
+class DaemonError(Exception):
+    """Raised when the daemon cannot be started or reached."""
+
+class ScheduledJob(NamedTuple):
+    """An action that a rule schedules."""
+
+    rule: str
+    action: str
+    schedule: Schedule
+
+def socket_path() -> Path:
+    """Return the path of the daemon's socket."""
+    return get_runtime_path('daemon.sock')
+
+def request(message: dict[str, Any], path: Optional[Path]=None, *,
+            timeout: Optional[float]=None) -> dict[str, Any]:
+    """
+    Send MESSAGE to the daemon listening at PATH and return its reply.
+
+    PATH defaults to socket_path(). OSError is raised if the
+    daemon cannot be reached, and DaemonError if its reply is
+    invalid.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(str(path or socket_path()))
+        sock.sendall(json.dumps(message).encode() + b'\n')
+        with sock.makefile('rb') as fd:
+            line = fd.readline()
+
+    try:
+        reply = json.loads(line)
+    except ValueError:
+        raise DaemonError("invalid reply from the daemon") from None
+    if not isinstance(reply, dict):
+        raise DaemonError("invalid reply from the daemon")
+
+    return reply
+
+def submit_job(action: str, specs: Iterable[str], *, all_rules: bool=False,
+               jobs: int=1) -> Optional[int]:
+    """
+    Run ACTION in the daemon, if it is running.
+
+    SPECS, ALL_RULES and JOBS are as in
+    jbackup.actions.runner.run_action(). The log of the job
+    is printed to stderr, at the level in JBACKUP_LEVEL.
+    Returns the exit code of the job, or None if there is no
+    daemon to run it or it does not answer a ping within
+    PING_TIMEOUT seconds.
+    """
+    import sys
+    from .logging import get_logger
+
+    logger = get_logger('')
+    path = socket_path()
+    if not path.exists():
+        return None
+
+    level = os.getenv('JBACKUP_LEVEL', '')
+    if level and not level.isdigit():
+        logger.error("JBACKUP_LEVEL must be a number, not '%s'", level)
+        return 1
+
+    message = {
+        'cmd': 'do',
+        'action': action,
+        'rules': list(specs),
+        'all': all_rules,
+        'jobs': jobs,
+        'cwd': os.getcwd(),
+        'level': int(level) if level else None
+    }
+    try:
+        # A job can run for hours, but a daemon that is alive answers at once
+        request({'cmd': 'ping'}, path, timeout=PING_TIMEOUT)
+    except (ConnectionError, FileNotFoundError):
+        # A stale socket
+        return None
+    except (OSError, DaemonError) as exc:
+        logger.warning("the daemon does not answer, running the job here: %s", exc)
+        return None
+
+    try:
+        reply = request(message, path)
+    except (OSError, DaemonError) as exc:
+        logger.error("could not submit the job to the daemon: %s", exc)
+        return 1
+
+    for line in reply.get('log', []):
+        print(line, file=sys.stderr)
+    if not reply.get('ok'):
+        logger.error("the daemon could not run the job: %s",
+                     reply.get('error', "no reason given"))
+        return 1
+
+    return int(reply.get('code', 1))
+
+class Daemon:
+    """A scheduler and job server with warm caches."""
+
+    def __init__(self, path: Optional[Path]=None, *,
+                 poll_interval: float=DEFAULT_POLL_INTERVAL):
+        """
+        Make a daemon that listens at PATH, or socket_path().
+
+        The data paths are checked for changes every
+        POLL_INTERVAL seconds.
+        """
+        import threading, time
+
+        self.path = path or socket_path()
+        self.poll_interval = poll_interval
+        self.started = time.time()
+        self.jobs_run = 0
+        self.schedules: list[ScheduledJob] = []
+
+        # Stat results of the rules and actions that were loaded
+        self._rules: dict[str, tuple[Path, int, int]] = {}
+        self._actions: dict[str, tuple[Path, int, int]] = {}
+
+        # The roots of the rules that are watched for changes
+        self._watched: dict[str, list[Path]] = {}
+        self._watcher: Optional[tuple[threading.Thread, threading.Event]] = None
+
+        self._job_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server = None
+
+    def _stat_key(self, path: Path) -> Optional[tuple[Path, int, int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return path, st.st_mtime_ns, st.st_size
+
+    def reload(self) -> list[str]:
+        """
+        Reload the rules and actions that changed since the last call.
+
+        New and modified rules are parsed and their schedules read
+        again; the actions they schedule are loaded. Returns the
+        names of what was reloaded.
+        """
+        from . import find_rules, find_action
+        from .actions import load_action, LoadError
+        from .logging import get_logger
+        from .rules import Rule
+        from .schedule import Schedule
+        from .watch import watch_roots
+
+        logger = get_logger('daemon')
+        reloaded: list[str] = []
+
+        rules = dict(find_rules('*'))
+        watched = dict(self._watched)
+        schedules = [job for job in self.schedules if job.rule in rules]
+        for name, path in rules.items():
+            key = self._stat_key(path)
+            if key is None or self._rules.get(name) == key:
+                continue
+
+            self._rules[name] = key
+            reloaded.append(f"rule {name}")
+            schedules = [job for job in schedules if job.rule != name]
+            watched.pop(name, None)
+            try:
+                rule = Rule(str(path))
+                table = rule.get('/schedule', {}, True)
+                roots = watch_roots(rule)
+            except Exception as exc:
+                logger.warning("could not load rule %s: %s", name, exc)
+                continue
+
+            if roots:
+                watched[name] = roots
+
+            if not isinstance(table, dict):
+                logger.warning("rule %s: 'schedule' must be a table", name)
+                continue
+            for action, expr in table.items():
+                try:
+                    schedules.append(ScheduledJob(name, action, Schedule(str(expr))))
+                except ValueError as exc:
+                    logger.warning("rule %s: %s", name, exc)
+
+        for name in set(self._rules) - set(rules):
+            del self._rules[name]
+            watched.pop(name, None)
+            reloaded.append(f"rule {name} (removed)")
+
+        self.schedules = schedules
+        if watched != self._watched:
+            self._watched = watched
+            self._start_watcher()
+
+        # Keep the scheduled actions loaded
+        for action in sorted({job.action for job in schedules}):
+            path = find_action(action)
+            key = self._stat_key(path) if path is not None else None
+            if key is None:
+                logger.warning("no action called '%s' exists", action)
+                continue
+            if self._actions.get(action) == key:
+                continue
+
+            self._actions[action] = key
+            try:
+                load_action(path, action)
+            except LoadError as exc:
+                logger.warning("could not load action %s: %s", action, exc)
+                continue
+            reloaded.append(f"action {action}")
+
+        if reloaded:
+            logger.info("reloaded %s", ", ".join(reloaded))
+
+        return reloaded
+
+    def _stop_watcher(self) -> None:
+        if self._watcher is not None:
+            thread, stop = self._watcher
+            stop.set()
+            thread.join()
+            self._watcher = None
+
+    def _start_watcher(self) -> None:
+        # (Re)start the watcher for the rules in self._watched
+        import threading
+        from .logging import get_logger
+        from .watch import Watcher, inotify_available
+
+        self._stop_watcher()
+        if not self._watched:
+            return
+        if not inotify_available():
+            get_logger('daemon').warning("inotify is not available, rules are not watched")
+            return
+
+        stop = threading.Event()
+        thread = threading.Thread(target=Watcher(self._watched).run, args=(stop,),
+                                  name='jbackup-watch', daemon=True)
+        thread.start()
+        self._watcher = (thread, stop)
+
+    def run_job(self, action: str, specs: Iterable[str], *, all_rules: bool=False,
+                jobs: int=1, cwd: Optional[str]=None,
+                level: Optional[int]=None) -> tuple[int, list[str]]:
+        """
+        Run ACTION with the rules selected by SPECS.
+
+        Jobs run one at a time. Relative paths in the rules are
+        taken relative to CWD if it is given, such as the working
+        directory of the client; the daemon's own working
+        directory does not change, since other threads use it.
+        Returns the exit code of the job and the lines it logged
+        at LEVEL or higher.
+        """
+        import logging
+        from .actions.runner import run_action
+        from .logging import _STREAM_FORMAT
+
+        lines: list[str] = []
+
+        class Handler(logging.Handler):
+            def emit(self, record: logging.LogRecord) -> None:
+                lines.append(self.format(record))
+
+        handler = Handler(level or logging.INFO)
+        handler.setFormatter(logging.Formatter(_STREAM_FORMAT))
+
+        with self._job_lock:
+            root = logging.getLogger()
+            root.addHandler(handler)
+            try:
+                code = run_action(action, specs, all_rules=all_rules, jobs=jobs,
+                                  cwd=cwd or None)
+            except Exception as exc:
+                root.exception("job %s failed: %s", action, exc)
+                code = 1
+            finally:
+                root.removeHandler(handler)
+                self.jobs_run += 1
+
+        return code, lines
+
+    def due_jobs(self, when: datetime, until: Optional[datetime]=None) -> dict[str, list[str]]:
+        """
+        Return the rules scheduled at the minute of WHEN, grouped by action.
+
+        If UNTIL is given, the rules scheduled at any minute from
+        WHEN to UNTIL are returned, each of them once.
+        """
+        from datetime import timedelta
+
+        due: dict[str, list[str]] = {}
+        pending = list(self.schedules)
+        minute = when
+        while pending:
+            for job in [job for job in pending if job.schedule.matches(minute)]:
+                due.setdefault(job.action, []).append(job.rule)
+                pending.remove(job)
+            minute += timedelta(minutes=1)
+            if until is None or minute > until:
+                break
+
+        return due
+
+    def run_scheduled(self, when: datetime, until: Optional[datetime]=None) -> int:
+        """
+        Run the jobs that are due from WHEN to UNTIL (see due_jobs()).
+
+        Each action runs once with all of its due rules, however
+        many minutes of the range they matched. Returns the number
+        of jobs run.
+        """
+        from .logging import get_logger
+
+        logger = get_logger('daemon')
+        due = self.due_jobs(when, until)
+        for action, rules in due.items():
+            logger.info("running scheduled job %s: %s", action, ", ".join(rules))
+            code, _ = self.run_job(action, rules)
+            if code:
+                logger.error("scheduled job %s exited with %d", action, code)
+
+        return len(due)
+
+    def status(self) -> dict[str, Any]:
+        """Return the state of the daemon as a JSON-compatible dictionary."""
+        import time
+        from datetime import datetime
+
+        now = datetime.now()
+        schedules = []
+        for job in self.schedules:
+            try:
+                upcoming = job.schedule.next_after(now).isoformat(timespec='minutes')
+            except ValueError:
+                upcoming = None
+            schedules.append({'rule': job.rule, 'action': job.action,
+                              'schedule': job.schedule.expr, 'next': upcoming})
+
+        return {'pid': os.getpid(), 'uptime': time.time() - self.started,
+                'jobs_run': self.jobs_run, 'schedules': schedules}
+
+    def handle_request(self, message: dict[str, Any]) -> dict[str, Any]:
+        """
+        Answer a request sent to the socket.
+
+        The command is MESSAGE['cmd']:
+
+          * 'ping': reply with the daemon's process ID
+          * 'status': reply with status()
+          * 'reload': check for changed rules and actions now
+          * 'do': run a job, with the keys 'action', 'rules', 'all',
+            'jobs', 'cwd' and 'level'; reply with its exit code
+            and log
+          * 'stop': stop the daemon
+        """
+        cmd = message.get('cmd')
+        if cmd == 'ping':
+            return {'ok': True, 'pid': os.getpid()}
+        elif cmd == 'status':
+            return {'ok': True, **self.status()}
+        elif cmd == 'reload':
+            return {'ok': True, 'reloaded': self.reload()}
+        elif cmd == 'do':
+            level = message.get('level') or None
+            if isinstance(level, str) and level.isdigit():
+                level = int(level)
+            if level is not None and not isinstance(level, int):
+                return {'ok': False, 'error': f"invalid level {level!r}"}
+            code, lines = self.run_job(str(message['action']), message.get('rules', []),
+                                       all_rules=bool(message.get('all')),
+                                       jobs=int(message.get('jobs', 1)),
+                                       cwd=message.get('cwd'),
+                                       level=level)
+            return {'ok': True, 'code': code, 'log': lines}
+        elif cmd == 'stop':
+            self._stop.set()
+            return {'ok': True}
+
+        return {'ok': False, 'error': f"unknown command {cmd!r}"}
+
+    def _scheduler(self) -> None:
+        # Run the due jobs at the start of each minute, and poll the data paths
+        import time
+        from datetime import datetime, timedelta
+        from .logging import get_logger
+
+        logger = get_logger('daemon')
+        last = datetime.now().replace(second=0, microsecond=0)
+        next_poll = time.monotonic() + self.poll_interval
+
+        while not self._stop.is_set():
+            now = datetime.now()
+            tick = last + timedelta(minutes=1)
+            wait = min((tick - now).total_seconds(), next_poll - time.monotonic())
+            if wait > 0 and self._stop.wait(wait):
+                break
+
+            if time.monotonic() >= next_poll:
+                try:
+                    self.reload()
+                except Exception as exc:
+                    logger.exception("reload failed: %s", exc)
+                next_poll = time.monotonic() + self.poll_interval
+
+            # The minutes that passed while a job ran or the machine
+            # was suspended are checked together, so that a job does
+            # not run once for each minute it missed
+            end = datetime.now().replace(second=0, microsecond=0)
+            if tick <= end:
+                self.run_scheduled(tick, end)
+                last = end
+
+    def serve_forever(self) -> None:
+        """
+        Listen on the socket and run schedules until stopped.
+
+        DaemonError is raised if another daemon is listening
+        on the socket already.
+        """
+        import socketserver, threading, signal
+        from .logging import get_logger
+
+        logger = get_logger('daemon')
+        daemon = self
+
+        if self.path.exists():
+            try:
+                request({'cmd': 'ping'}, self.path, timeout=PING_TIMEOUT)
+            except OSError:
+                self.path.unlink()
+            else:
+                raise DaemonError(f"a daemon is already listening on {self.path}")
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                try:
+                    message = json.loads(self.rfile.readline())
+                    reply = daemon.handle_request(message)
+                except Exception as exc:
+                    reply = {'ok': False, 'error': f"{type(exc).__name__}: {exc}"}
+                self.wfile.write(json.dumps(reply).encode() + b'\n')
+                if daemon._stop.is_set():
+                    threading.Thread(target=server.shutdown).start()
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        self.reload()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        oldmask = os.umask(0o077)
+        try:
+            server = self._server = Server(str(self.path), Handler)
+        finally:
+            os.umask(oldmask)
+
+        def on_signal(signum, frame) -> None:
+            self._stop.set()
+            threading.Thread(target=server.shutdown).start()
+
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, on_signal)
+            signal.signal(signal.SIGINT, on_signal)
+
+        scheduler = threading.Thread(target=self._scheduler, name='jbackup-scheduler',
+                                     daemon=True)
+        scheduler.start()
+        logger.info("listening on %s", self.path)
+
+        try:
+            server.serve_forever()
+        finally:
+            self._stop.set()
+            self._stop_watcher()
+            server.server_close()
+            self.path.unlink(missing_ok=True)
+            scheduler.join(timeout=5)
+            logger.info("stopped")
+
+    def shutdown(self) -> None:
+        """Stop the daemon from another thread."""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
@@ -0,0 +1,220 @@
+# Builtin action: archive
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, cast
+from jbackup.actions import ActionProperty, PropertyType
+from jbackup.archive import write_archive, archive_suffix, DEFAULT_CHUNK_SIZE
+from jbackup.archive.seekable import write_seekable, SEEKABLE_SUFFIX
+from jbackup.catalog import record_backup
+from jbackup.journal import ChangeJournal
+from jbackup.logging import get_logger, Level
+from jbackup.manifest import Manifest, load_manifest, save_manifest
+from jbackup.utils import get_env
+from jbackup.verify import checksum_file
+from pathlib import Path
+import time, os
+
+if TYPE_CHECKING:
+    from jbackup.rules import Rule
+    from typing import BinaryIO, Optional
+
+class Action_Archive:
+    """
+    Compress files and directories into a tar archive.
+
+    The archive is streamed straight to its destination, so no
+    temporary copy of it is made and memory use stays the same
+    no matter how large the sources are. Until it is complete,
+    the archive is written under a name ending in '.part'.
+
+    If the destination is a directory, the archive is named
+    after the rule and the current time.
+
+    With more than one thread, the archive is compressed in
+    independent blocks on several cores. The result is still
+    a normal compressed tar archive.
+
+    An incremental archive only holds the files that were added
+    or changed since the last run of the rule, plus a list of the
+    files deleted since then in a member named '.jbackup-deleted'.
+    The first incremental run of a rule archives everything.
+
+    In a chain such as 'archive+copy', the archive is streamed
+    into the next action instead of being written to 'destination'.
+
+    A seekable archive ('format = "seekable"') compresses each
+    file on its own and ends with an index, so that 'jbackup ls'
+    and 'jbackup restore' read only the files they need. It is
+    named with the suffix '.jbk'.
+
+    With 'checksums', the hashes of the files in the archive are
+    written next to it, in a file with the suffix '.manifest'.
+    In a chain, the last action writes the checksums instead.
+    Either way, the archive and its files are recorded in the
+    catalog (see 'jbackup catalog').
+
+    If the rule is watched (see 'jbackup watch'), an incremental
+    run only looks at the paths in the rule's change journal
+    instead of scanning the sources, unless the journal cannot
+    account for every change since the last run or 'gitignore'
+    is set.
+    """
+
+    stream_input = False
+    stream_output = True
+
+    properties: list[ActionProperty] = [
+        ActionProperty('sources', [], types=[PropertyType.LIST], paths=True,
+                       doc="files and directories to put in the archive"),
+        ActionProperty('destination', '', types=[PropertyType.STRING, PropertyType.PATH],
+                       optional=True,
+                       doc="path of the archive, or a directory to put it in; "
+                       "not used when the archive is streamed into another action"),
+        ActionProperty('codec', 'gz', types=[PropertyType.STRING], optional=True,
+                       doc="compression: 'none', 'gz', 'bz2' or 'xz'"),
+        ActionProperty('format', 'tar', types=[PropertyType.STRING], optional=True,
+                       doc="'tar', or 'seekable' for an archive that single files can be "
+                       "restored from without reading the rest"),
+        ActionProperty('level', -1, types=[PropertyType.INT], optional=True,
+                       doc="compression level, or -1 for the codec's default"),
+        ActionProperty('threads', 1, types=[PropertyType.INT], optional=True,
+                       doc="threads that compress blocks of the archive in parallel, "
+                       "or 0 for one per CPU"),
+        ActionProperty('chunk-size', 1048576, types=[PropertyType.INT], optional=True,
+                       doc="size in bytes of the writes to the destination"),
+        ActionProperty('exclude', [], types=[PropertyType.LIST], optional=True,
+                       doc="gitignore patterns of paths in the archive to leave out"),
+        ActionProperty('include', [], types=[PropertyType.LIST], optional=True,
+                       doc="gitignore patterns of the only files to put in the archive"),
+        ActionProperty('gitignore', False, types=[PropertyType.BOOL], optional=True,
+                       doc="leave out the files ignored by .gitignore files in the sources"),
+        ActionProperty.standard('incremental'),
+        ActionProperty.standard('checksums')
+    ]
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+        self.propmapping = ActionProperty.get_properties('archive', rule, self.properties)
+        level = get_env('JBACKUP_LEVEL', Level.INFO, type_=int)
+        self.logger = get_logger('archive', cast(Level, level))
+
+        self._prepared = False
+        self._manifest: Optional[Manifest] = None
+        self._previous: Optional[Manifest] = None
+        # The files put in the archive, with their hashes
+        self._members = Manifest()
+        self._name = ""
+
+        if self.propmapping['format'] not in ('tar', 'seekable'):
+            raise ValueError(f"invalid format '{self.propmapping['format']}', "
+                             "must be 'tar' or 'seekable'")
+
+    def _filename(self) -> str:
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        kind = "-incr" if self._previous is not None else ""
+        if self.propmapping['format'] == 'seekable':
+            suffix = SEEKABLE_SUFFIX
+        else:
+            suffix = archive_suffix(self.propmapping['codec'])
+        return f"{self.rule.name}-{stamp}{kind}{suffix}"
+
+    def _destination(self) -> Path:
+        if not self.propmapping['destination']:
+            raise ValueError("'destination' is required unless the archive is streamed "
+                             "into another action")
+        dest = Path(self.propmapping['destination']).expanduser()
+        if dest.is_dir():
+            dest = dest / self._name
+
+        return dest
+
+    def _prepare(self) -> None:
+        # Load the manifest of the last run, if this run is incremental
+        if self._prepared:
+            return
+        self._prepared = True
+
+        if self.propmapping['incremental']:
+            self._manifest = Manifest()
+            self._previous = load_manifest(self.rule.name)
+            if self._previous is None:
+                self.logger.info("no manifest for rule %s, archiving everything",
+                                 self.rule.name)
+        self._name = self._filename()
+
+    def _write(self, fileobj: BinaryIO) -> None:
+        sources = [Path(source).expanduser() for source in self.propmapping['sources']]
+        level: int = self.propmapping['level']
+        previous = self._previous
+
+        # The paths that changed since the last run, if a watcher knows them
+        changes = None
+        if previous is not None and not self.propmapping['gitignore']:
+            changes = ChangeJournal(self.rule.name).changes_since(previous.created, sources)
+            if changes is None:
+                self.logger.debug("no usable change journal for rule %s, scanning the sources",
+                                  self.rule.name)
+            else:
+                self.logger.info("%d paths changed according to the journal", len(changes))
+
+        options = dict(codec=self.propmapping['codec'],
+                       level=None if level < 0 else level,
+                       threads=self.propmapping['threads'],
+                       exclude=self.propmapping['exclude'],
+                       include=self.propmapping['include'],
+                       gitignore=self.propmapping['gitignore'],
+                       manifest=self._manifest, previous=previous,
+                       changes=changes, checksums=self._members)
+
+        start = time.perf_counter()
+        if self.propmapping['format'] == 'seekable':
+            stats = write_seekable(fileobj, sources, **options)
+        else:
+            stats = write_archive(fileobj, sources, **options,
+                                  chunk_size=self.propmapping['chunk-size'] or DEFAULT_CHUNK_SIZE)
+        elapsed = time.perf_counter() - start
+
+        self.logger.info("archived %d files, %d bytes into %d bytes in %.2fs",
+                         stats.files, stats.bytes_in, stats.bytes_out, elapsed)
+        if previous is not None:
+            self.logger.info("skipped %d unchanged files, %d files were deleted",
+                             stats.unchanged, stats.deleted)
+
+    def run(self) -> None:
+        self._prepare()
+        dest = self._destination()
+        partfile = dest.with_name(dest.name + '.part')
+        self.logger.info("writing %s", dest)
+
+        try:
+            with open(partfile, 'wb') as fd:
+                self._write(fd)
+            os.replace(partfile, dest)
+        except BaseException:
+            partfile.unlink(missing_ok=True)
+            raise
+
+        if self.propmapping['checksums']:
+            self._members.save(checksum_file(dest))
+
+        self.commit(str(dest))
+
+    def stream_name(self, input_name: Optional[str]) -> str:
+        self._prepare()
+        return self._name
+
+    def run_stream(self, input: Optional[BinaryIO], output: Optional[BinaryIO],
+                   input_name: Optional[str]) -> None:
+        assert output is not None
+        self._prepare()
+        self._write(output)
+
+    def commit(self, location: Optional[str]) -> None:
+        # Only once the archive exists is it the base of the next run
+        if self._manifest is not None:
+            save_manifest(self.rule.name, self._manifest)
+            ChangeJournal(self.rule.name).prune(self._manifest.created)
+
+        # In a chain, the archive is wherever the last action put it
+        name = Path(location).name if location else self._name
+        record_backup(self.rule.name, 'archive', name, location or '', self._members)
@@ -0,0 +1,68 @@
+# Builtin action: compress
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, cast
+from jbackup.actions import ActionProperty, PropertyType
+from jbackup.archive import open_compressor, archive_suffix
+from jbackup.logging import get_logger, Level
+from jbackup.utils import get_env
+import shutil
+
+if TYPE_CHECKING:
+    from jbackup.rules import Rule
+    from typing import BinaryIO, Optional
+
+# The suffix that each codec adds to a name
+_SUFFIXES = {'none': '', 'gz': '.gz', 'bz2': '.bz2', 'xz': '.xz'}
+
+class Action_Compress:
+    """
+    Compress the output of another action.
+
+    This action only works in a chain, between an action that
+    writes a stream and one that reads it, as in
+    'archive+compress+copy'.
+    """
+
+    stream_input = True
+    stream_output = True
+
+    properties: list[ActionProperty] = [
+        ActionProperty('codec', 'gz', types=[PropertyType.STRING], optional=True,
+                       doc="compression: 'none', 'gz', 'bz2' or 'xz'"),
+        ActionProperty('level', -1, types=[PropertyType.INT], optional=True,
+                       doc="compression level, or -1 for the codec's default"),
+        ActionProperty('threads', 1, types=[PropertyType.INT], optional=True,
+                       doc="threads that compress blocks in parallel, or 0 for one per CPU"),
+        ActionProperty('chunk-size', 1048576, types=[PropertyType.INT], optional=True,
+                       doc="size in bytes of the reads from the input")
+    ]
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+        self.propmapping = ActionProperty.get_properties('compress', rule, self.properties)
+        level = get_env('JBACKUP_LEVEL', Level.INFO, type_=int)
+        self.logger = get_logger('compress', cast(Level, level))
+
+        # Fail early on an invalid codec
+        archive_suffix(self.propmapping['codec'])
+
+    def run(self) -> None:
+        raise ValueError("the compress action only works in a chain, e.g. 'archive+compress+copy'")
+
+    def stream_name(self, input_name: Optional[str]) -> str:
+        return (input_name or self.rule.name) + _SUFFIXES[self.propmapping['codec']]
+
+    def run_stream(self, input: Optional[BinaryIO], output: Optional[BinaryIO],
+                   input_name: Optional[str]) -> None:
+        assert input is not None and output is not None
+        level: int = self.propmapping['level']
+        fout = open_compressor(output, self.propmapping['codec'],
+                               None if level < 0 else level,
+                               threads=self.propmapping['threads'])
+        try:
+            shutil.copyfileobj(input, fout, self.propmapping['chunk-size'] or 1048576)
+        finally:
+            # With no compression, FOUT is the output of the chain
+            if fout is not output:
+                fout.close()
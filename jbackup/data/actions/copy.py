@@ -0,0 +1,111 @@
+# Builtin action: copy
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, cast
+from jbackup.actions import ActionProperty, PropertyType
+from jbackup.catalog import record_backup
+from jbackup.fastcopy import copy_stream, copy_tree, DEFAULT_BUFFER_SIZE
+from jbackup.logging import get_logger, Level
+from jbackup.manifest import Manifest, new_hash
+from jbackup.utils import get_env
+from jbackup.verify import checksum_file, make_checksums, DEFAULT_HASH_THREADS
+from pathlib import Path
+import os, time
+
+if TYPE_CHECKING:
+    from jbackup.rules import Rule
+    from typing import BinaryIO, Optional
+
+class Action_Copy:
+    """
+    Copy files and directories to a destination.
+
+    On its own, the sources are copied into the destination
+    directory. At the end of a chain such as 'archive+copy', the
+    output of the action before it is written to the destination,
+    or to a file in it named by that action if the destination is
+    a directory; until it is complete, the file is written under
+    a name ending in '.part'.
+
+    Files are cloned where the filesystem supports it (btrfs,
+    xfs), or else copied inside the kernel, so their data does
+    not pass through jbackup. With more than one thread, several
+    files are copied at once.
+
+    With 'checksums', a checksum manifest of the destination is
+    written into it, or next to the file written in a chain, and
+    a copied tree is recorded in the catalog with its files.
+    """
+
+    stream_input = True
+    stream_output = False
+
+    properties: list[ActionProperty] = [
+        ActionProperty('sources', [], types=[PropertyType.LIST], paths=True, optional=True,
+                       doc="files and directories to copy; not used in a chain"),
+        ActionProperty('destination', '', types=[PropertyType.STRING, PropertyType.PATH],
+                       doc="directory to copy into, or the file to write in a chain"),
+        ActionProperty('threads', 1, types=[PropertyType.INT], optional=True,
+                       doc="files to copy at once"),
+        ActionProperty('chunk-size', 1048576, types=[PropertyType.INT], optional=True,
+                       doc="size in bytes of the buffer used when the data cannot be "
+                       "copied by the kernel"),
+        ActionProperty.standard('checksums')
+    ]
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+        self.propmapping = ActionProperty.get_properties('copy', rule, self.properties)
+        level = get_env('JBACKUP_LEVEL', Level.INFO, type_=int)
+        self.logger = get_logger('copy', cast(Level, level))
+
+    def run(self) -> None:
+        sources = [Path(source).expanduser() for source in self.propmapping['sources']]
+        dest = Path(self.propmapping['destination']).expanduser()
+        self.logger.info("copying %d sources into %s", len(sources), dest)
+
+        stats = copy_tree(sources, dest, threads=self.propmapping['threads'],
+                          buffer_size=self.propmapping['chunk-size'] or DEFAULT_BUFFER_SIZE)
+        self.logger.info("copied %d files, %d bytes in %.2fs (%.1f MiB/s)",
+                         stats.files, stats.bytes, stats.seconds, stats.throughput / 2**20)
+        if stats.cloned:
+            self.logger.info("%d files were cloned instead of copied", stats.cloned)
+
+        if self.propmapping['checksums']:
+            start = time.perf_counter()
+            checksums = make_checksums(dest, threads=max(self.propmapping['threads'],
+                                                         DEFAULT_HASH_THREADS))
+            checksums.save(checksum_file(dest))
+            self.logger.info("wrote the checksums of %s in %.2fs", dest,
+                             time.perf_counter() - start)
+            record_backup(self.rule.name, 'copy', dest.name, dest, checksums)
+
+    def run_stream(self, input: Optional[BinaryIO], output: Optional[BinaryIO],
+                   input_name: Optional[str]) -> str:
+        assert input is not None
+        dest = Path(self.propmapping['destination']).expanduser()
+        if dest.is_dir():
+            dest = dest / (input_name or self.rule.name)
+        partfile = dest.with_name(dest.name + '.part')
+        self.logger.info("writing %s", dest)
+
+        digest = new_hash() if self.propmapping['checksums'] else None
+        start = time.perf_counter()
+        try:
+            with open(partfile, 'wb', buffering=0) as fd:
+                size = copy_stream(input, fd, digest=digest,
+                                   buffer_size=self.propmapping['chunk-size'] or DEFAULT_BUFFER_SIZE)
+            os.replace(partfile, dest)
+        except BaseException:
+            partfile.unlink(missing_ok=True)
+            raise
+
+        if digest is not None:
+            checksums = Manifest()
+            checksums.add(dest.name, dest.stat(), digest.hexdigest())
+            checksums.save(checksum_file(dest))
+
+        elapsed = time.perf_counter() - start
+        self.logger.info("wrote %d bytes in %.2fs (%.1f MiB/s)", size, elapsed,
+                         size / elapsed / 2**20 if elapsed > 0 else 0.0)
+        return str(dest)
@@ -0,0 +1,71 @@
+# Builtin action: snapshot
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, cast
+from jbackup.actions import ActionProperty, PropertyType
+from jbackup.catalog import record_backup
+from jbackup.logging import get_logger, Level
+from jbackup.utils import get_env
+from pathlib import Path
+import time
+
+if TYPE_CHECKING:
+    from jbackup.rules import Rule
+
+class Action_Snapshot:
+    """
+    Store files and directories in a deduplicating chunk store.
+
+    Files are split into chunks by their content, and each chunk
+    is stored only once, so a snapshot only adds the data that is
+    not already in the store. Files that have not changed since
+    the last snapshot of the rule are not read at all.
+
+    The store is created if the repository does not exist. Each
+    snapshot and its files are recorded in the catalog (see
+    'jbackup catalog').
+    """
+
+    properties: list[ActionProperty] = [
+        ActionProperty('sources', [], types=[PropertyType.LIST], paths=True,
+                       doc="files and directories to put in the snapshot"),
+        ActionProperty('repository', '', types=[PropertyType.STRING, PropertyType.PATH],
+                       doc="directory of the chunk store"),
+        ActionProperty('exclude', [], types=[PropertyType.LIST], optional=True,
+                       doc="gitignore patterns of paths in the snapshot to leave out"),
+        ActionProperty('include', [], types=[PropertyType.LIST], optional=True,
+                       doc="gitignore patterns of the only files to put in the snapshot"),
+        ActionProperty('gitignore', False, types=[PropertyType.BOOL], optional=True,
+                       doc="leave out the files ignored by .gitignore files in the sources"),
+        ActionProperty('compress-level', 6, types=[PropertyType.INT], optional=True,
+                       doc="zlib compression level of new chunks, or 0 for none")
+    ]
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+        self.propmapping = ActionProperty.get_properties('snapshot', rule, self.properties)
+        level = get_env('JBACKUP_LEVEL', Level.INFO, type_=int)
+        self.logger = get_logger('snapshot', cast(Level, level))
+
+    def run(self) -> None:
+        from jbackup.store import ChunkStore
+
+        sources = [Path(source).expanduser() for source in self.propmapping['sources']]
+        repository = Path(self.propmapping['repository']).expanduser()
+
+        start = time.perf_counter()
+        with ChunkStore(repository, create=True,
+                        compress_level=self.propmapping['compress-level']) as store:
+            previous = store.load_snapshot(self.rule.name)
+            snapshot, stats = store.snapshot(self.rule.name, sources,
+                                             exclude=self.propmapping['exclude'],
+                                             include=self.propmapping['include'],
+                                             gitignore=self.propmapping['gitignore'],
+                                             previous=previous)
+        elapsed = time.perf_counter() - start
+
+        self.logger.info("snapshot %s: read %d files, %d bytes; %d unchanged files",
+                         snapshot.name, stats.files, stats.bytes_in, stats.unchanged)
+        self.logger.info("stored %d new chunks, %d bytes in %.2fs",
+                         stats.new_chunks, stats.new_bytes, elapsed)
+        record_backup(self.rule.name, 'snapshot', snapshot.name, repository, snapshot.manifest)
@@ -0,0 +1,223 @@
+"""
+Change journals.
+
+A journal records the paths that changed under the directories
+that a rule watches (its global 'watch' option), as a watcher
+sees them (see jbackup.watch). An incremental backup can then
+look at those paths alone instead of scanning every source.
+
+A journal is only as good as its watcher. While the watcher
+runs, it holds a lock on the '.live' file next to the journal;
+the journal records when the watch began and whenever events
+were lost. changes_since() returns None if the journal cannot
+account for every change since the given time, and the caller
+falls back to a full scan.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING
+from ._path import get_state_path
+import os, json, time, fcntl
+
+if TYPE_CHECKING:
+    from typing import Any, Iterable, Iterator, Optional
+
+__all__ = [
+    # Classes
+    'ChangeJournal',
+    'JournalError',
+
+    # Functions
+    'journal_file',
+
+    # Variables
+    'SETTLE_TIME'
+]
+
+_JOURNAL_VERSION = 1
+
+# Events reach the journal shortly after they happen, so a backup
+# also takes the changes from this many seconds before it began
+SETTLE_TIME = 5.0
+
+class JournalError(Exception):
+    """Raised when a journal cannot be started."""
+
+def journal_file(rulename: str) -> Path:
+    """Return the change journal of RULENAME."""
+    return get_state_path('journals', f"{rulename}.jsonl")
+
+def _is_under(path: str, root: str) -> bool:
+    return path == root or path.startswith(root.rstrip('/') + '/')
+
+class ChangeJournal:
+    """The change journal of a rule."""
+
+    def __init__(self, rulename: str):
+        self.rule = rulename
+        self.path = journal_file(rulename)
+        self._livefd: Optional[int] = None
+
+    def _sibling(self, suffix: str) -> Path:
+        return self.path.with_name(f"{self.rule}{suffix}")
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Serializes writes to the journal file
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self._sibling('.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def _append(self, record: dict[str, Any]) -> None:
+        with self._locked(), open(self.path, 'at') as fd:
+            fd.write(json.dumps(record) + '\n')
+
+    def _rewrite(self, lines: Iterable[dict[str, Any]]) -> None:
+        # The caller holds the lock
+        tmpfile = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmpfile, 'wt') as fd:
+                for line in lines:
+                    fd.write(json.dumps(line) + '\n')
+            os.replace(tmpfile, self.path)
+        except BaseException:
+            tmpfile.unlink(missing_ok=True)
+            raise
+
+    def start(self, roots: Iterable[str | Path]) -> None:
+        """
+        Begin a new journal for a watch of ROOTS.
+
+        The journal is live until stop() is called or the process
+        exits, but it is only used once ready() is called.
+        JournalError is raised if another watcher has the journal
+        already.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        livefd = os.open(self._sibling('.live'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(livefd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(livefd)
+            raise JournalError(f"rule {self.rule} is being watched already") from None
+
+        self._livefd = livefd
+        # Not trusted until the watcher is ready
+        header = {'version': _JOURNAL_VERSION, 'started': None,
+                  'roots': [os.path.abspath(root) for root in roots]}
+        with self._locked():
+            self._rewrite([header])
+
+    def ready(self) -> None:
+        """Mark the start of the watch, once every root is watched."""
+        with self._locked():
+            contents = self._read()
+            if contents is None: # pragma: no cover
+                raise JournalError(f"the journal of rule {self.rule} is missing")
+            header, records = contents
+            header['started'] = time.time()
+            self._rewrite([header] + records)
+
+    def stop(self) -> None:
+        """End the watch; the journal is no longer live."""
+        if self._livefd is not None:
+            os.close(self._livefd)
+            self._livefd = None
+
+    def record(self, paths: Iterable[str], when: Optional[float]=None) -> None:
+        """Record that PATHS changed at WHEN, or now."""
+        paths = sorted(set(paths))
+        if paths:
+            self._append({'t': time.time() if when is None else when, 'paths': paths})
+
+    def overflow(self, when: Optional[float]=None) -> None:
+        """Record that changes were lost at WHEN, or now."""
+        self._append({'t': time.time() if when is None else when, 'overflow': True})
+
+    def is_live(self) -> bool:
+        """Whether a watcher is writing to the journal."""
+        if self._livefd is not None:
+            return True
+
+        try:
+            fd = os.open(self._sibling('.live'), os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+        return False
+
+    def _read(self) -> Optional[tuple[dict[str, Any], list[dict[str, Any]]]]:
+        try:
+            with open(self.path, 'rt') as fd:
+                header = json.loads(fd.readline() or 'null')
+                if not isinstance(header, dict) or header.get('version') != _JOURNAL_VERSION:
+                    return None
+                return header, [json.loads(line) for line in fd]
+        except (OSError, ValueError):
+            return None
+
+    def changes_since(self, since: float,
+                      sources: Iterable[str | Path]) -> Optional[set[str]]:
+        """
+        Return the absolute paths under SOURCES that changed since SINCE.
+
+        SINCE is a time as returned by time.time(). None is
+        returned unless the journal is live, its watch covers all
+        of SOURCES and began before SINCE, and no change was lost
+        since then. Changes to a directory are recorded under its
+        own path, so a caller must rescan the directories that
+        are returned.
+        """
+        if not self.is_live():
+            return None
+
+        contents = self._read()
+        if contents is None:
+            return None
+        header, records = contents
+
+        since -= SETTLE_TIME
+        if header['started'] is None or header['started'] > since:
+            return None
+
+        roots: list[str] = header['roots']
+        sources = [os.path.abspath(source) for source in sources]
+        if not all(any(_is_under(source, root) for root in roots) for source in sources):
+            return None
+
+        changes: set[str] = set()
+        for record in records:
+            if record['t'] < since:
+                continue
+            if record.get('overflow'):
+                return None
+            changes.update(path for path in record['paths']
+                           if any(_is_under(path, source) or _is_under(source, path)
+                                  for source in sources))
+
+        return changes
+
+    def prune(self, before: float) -> None:
+        """Drop what was recorded more than SETTLE_TIME before BEFORE."""
+        if not self.path.exists():
+            return
+
+        before -= SETTLE_TIME
+        with self._locked():
+            contents = self._read()
+            if contents is None:
+                return
+            header, records = contents
+            self._rewrite([header] + [record for record in records if record['t'] >= before])
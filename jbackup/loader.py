@@ -6,7 +6,8 @@ from importlib.util import spec_from_file_location, module_from_spec
 from importlib.machinery import ModuleSpec
 from pathlib import Path
 from .utils import LoadError, Pathlike
-import ast, types
+from ._cache import read_entry, write_entry
+import ast, types, functools
 
 _Module = types.ModuleType
 
@@ -29,23 +30,40 @@ class ModuleProxy:
 
         Keyword arguments:
           * source (str) = a string containing the source
-                           code of MODULE. Must be set in order
-                           for self.ast_tree to work
+                           code of MODULE
+          * filename (str) = the file MODULE was loaded from; its
+                             source is read if SOURCE is not given.
+                             One of the two must be set in order
+                             for self.ast_tree to work
+          * metadata (dict) = cached metadata about MODULE
+                              (see set_cached_metadata())
         """
         self.__module = module
         self.__safe = safe
         self.__source: str = kw.get('source', '')
+        self.__filename: str = kw.get('filename', '')
+        self.__metadata: dict[str, Any] = kw.get('metadata', {})
 
-    @property
+    @functools.cached_property
     def ast_tree(self) -> ast.Module:
         """An AST code object representing the module."""
-        return ast.parse(self.__source)
+        source = self.__source
+        if not source and self.__filename:
+            with open(self.__filename, 'rt') as fd:
+                source = fd.read()
+
+        return ast.parse(source, self.__filename or '<unknown>')
 
     @property
     def name(self) -> str:
         """The name of the module."""
         return self.__module.__name__
 
+    @property
+    def metadata(self) -> dict[str, Any]:
+        """Metadata stored alongside the module's cached code."""
+        return self.__metadata
+
     @overload
     def safe(self) -> bool:
         ...
@@ -97,13 +115,44 @@ class ModuleProxy:
         """Returns the dir of the underlying module."""
         return dir(self.__module)
 
-def load_module_from_file(str_or_path: str | Pathlike, name: str) -> ModuleProxy:
+# Code cache
+#
+# Entries are marshalled tuples of (code, metadata), stored in
+# a user-writable directory since the data paths might not be.
+
+_CACHE_KIND = 'bytecode'
+
+def set_cached_metadata(str_or_path: str | Pathlike, key: str, value: Any) -> None:
+    """
+    Store KEY and VALUE in the metadata of a cached module.
+
+    VALUE must be serializable by marshal. Nothing happens if
+    the module has no valid cache entry.
+    """
+    path = Path(str_or_path).resolve()
+    try:
+        st = path.stat()
+    except OSError: # pragma: no cover
+        return
+
+    entry = read_entry(_CACHE_KIND, path, st)
+    if entry is not None:
+        code, metadata = entry
+        metadata[key] = value
+        write_entry(_CACHE_KIND, path, st, (code, metadata))
+
+def load_module_from_file(str_or_path: str | Pathlike, name: str, *,
+                          cache: bool=True) -> ModuleProxy:
     """
     Loads a Python script and returns a module with the name NAME.
 
     If the file does not exist, FileNotFoundError is raised.
 
     If the module cannot be read from file, ModuleLoadError is raised.
+
+    If CACHE is true, the compiled code of the module is read from
+    or written to the cache directory. Entries are keyed on the
+    path, modification time and size of the file.
     """
     if isinstance(str_or_path, str):
         str_or_path = Path(str_or_path)
@@ -113,8 +162,11 @@ def load_module_from_file(str_or_path: str | Pathlike, name: str) -> ModuleProxy
     if not str_or_path.exists():
         raise FileNotFoundError(str(str_or_path))
 
+    path = Path(str_or_path).resolve()
+    st = path.stat()
+
     # Load spec from file
-    spec = spec_from_file_location(name, str(str_or_path))
+    spec = spec_from_file_location(name, str(path))
     if spec is None:
         raise ModuleLoadError("unable to load spec from %s" % str_or_path) # pragma: no cover
     spec = cast(ModuleSpec, spec)
@@ -123,9 +175,22 @@ def load_module_from_file(str_or_path: str | Pathlike, name: str) -> ModuleProxy
     module = module_from_spec(spec)
     assert module is not None
 
-    spec.loader.exec_module(module) # type: ignore
+    # Get code, either from the cache or by compiling the source
+    source = ''
+    entry = read_entry(_CACHE_KIND, path, st) if cache else None
+    if entry is None:
+        source = path.read_text()
+        code = compile(source, str(path), 'exec', dont_inherit=True)
+        metadata: dict[str, Any] = {}
+        if cache:
+            write_entry(_CACHE_KIND, path, st, (code, metadata))
+    else:
+        code, metadata = entry
+
+    exec(code, module.__dict__)
 
-    return ModuleProxy(module, True)
+    return ModuleProxy(module, True, source=source, filename=str(path),
+                       metadata=metadata)
 
 __all__ = [
     # Classes
@@ -133,7 +198,8 @@ __all__ = [
     'ModuleProxy',
 
     # Functions
-    'load_module_from_file'
+    'load_module_from_file',
+    'set_cached_metadata'
 ]
 
 def main():
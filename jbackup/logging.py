@@ -1,29 +1,165 @@
-"""Logging module."""
+"""
+Logging module.
+
+The root logger is configured from _logging.yaml the first
+time a logger is requested, not when the package is imported.
+Loggers created with stream=True write straight to stderr
+and never trigger that configuration.
+"""
 
 from __future__ import annotations
 from pathlib import Path
+from enum import IntEnum
 from typing import TYPE_CHECKING
-import logging, yaml
+from ._path import get_cache_path
+import logging, os
 
 if TYPE_CHECKING:
     from typing import Any
 
+class Level(IntEnum):
+    """Logging level."""
+
+    DEBUG = logging.DEBUG
+    INFO = logging.INFO
+    WARN = logging.WARNING
+    ERROR = logging.ERROR
+    CRITICAL = logging.CRITICAL
+
 _Init = False
 
+_STREAM_FORMAT = "%(levelname)s %(name)s: %(message)s"
+
+class _StackHandler(logging.Handler):
+    """A handler that keeps the records it receives."""
+
+    def __init__(self, level: int=logging.NOTSET):
+        super().__init__(level)
+        self.records: list[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(record)
+
 def _setup_logging() -> None:
-    import logging.config
+    import logging.config, yaml
 
-    # logging.yaml in this directory
-    fp = Path(__file__).parent / 'logging.yaml'
+    # _logging.yaml in this directory
+    fp = Path(__file__).parent / '_logging.yaml'
     with open(fp, 'rt') as fd:
         LOGGING_CONFIG: dict[str, Any] = yaml.safe_load(fd)
-        logging.config.dictConfig(LOGGING_CONFIG)
 
-def get_logger(name=""):
+    # Put the log file in the cache directory; drop it if that fails
+    logfile = get_cache_path('logs', 'jbackup.log')
+    try:
+        logfile.parent.mkdir(parents=True, exist_ok=True)
+        LOGGING_CONFIG['handlers']['file']['filename'] = str(logfile)
+    except OSError: # pragma: no cover
+        del LOGGING_CONFIG['handlers']['file']
+        LOGGING_CONFIG['loggers']['root']['handlers'].remove('file')
+
+    logging.config.dictConfig(LOGGING_CONFIG)
+
+def _init_root_logger() -> None:
+    """Configure the root logger if it has not been already."""
     global _Init
 
     if not _Init:
         _setup_logging()
         _Init = True
 
-    return logging.getLogger(name)
+def _env_level() -> int:
+    try:
+        return int(os.getenv('JBACKUP_LEVEL', Level.INFO))
+    except ValueError: # pragma: no cover
+        return Level.INFO
+
+def add_handler(logger: logging.Logger, kind: str, *args, **kw) -> logging.Handler:
+    """
+    Add a handler of the given KIND to LOGGER.
+
+    KIND is one of the following:
+      * stack = keep records in memory (see get_record_tuple())
+      * stream = write to stderr
+      * file = write to a file; ARGS and KW are passed to
+               logging.FileHandler
+
+    The new handler is returned. ValueError is raised for an
+    invalid KIND.
+    """
+    handler: logging.Handler
+    if kind == 'stack':
+        handler = _StackHandler()
+    elif kind == 'stream':
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(_STREAM_FORMAT))
+        handler.setLevel(kw.get('level', _env_level()))
+    elif kind == 'file':
+        handler = logging.FileHandler(*args, **kw)
+    else:
+        raise ValueError(f"invalid handler kind '{kind}'")
+
+    logger.addHandler(handler)
+
+    return handler
+
+def _capture_records() -> _StackHandler:
+    """
+    Make the root logger keep its records instead of emitting them.
+
+    This replaces the handlers of the root logger, and the
+    logging config is not loaded afterwards. It is meant for
+    worker processes that send their records to a parent.
+    """
+    global _Init
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    handler = _StackHandler()
+    root.addHandler(handler)
+    root.setLevel(Level.DEBUG)
+    _Init = True
+
+    return handler
+
+def get_record_tuple(logger: logging.Logger) -> tuple[str, Level, str] | None:
+    """
+    Return the last record of LOGGER's stack handler.
+
+    The result is a tuple of the logger name, the level
+    and the message. None is returned if LOGGER has no
+    stack handler or it has no records.
+    """
+    for handler in logger.handlers:
+        if isinstance(handler, _StackHandler) and handler.records:
+            record = handler.records[-1]
+            return record.name, Level(record.levelno), record.getMessage()
+
+    return None
+
+def get_logger(name: str="", level: Level | int | None=None, stream: bool=False) -> logging.Logger:
+    """
+    Return the logger with the given NAME.
+
+    If LEVEL is not None, it is set as the level of the logger.
+
+    If STREAM is true, the logger gets its own stderr handler
+    and does not propagate to the root logger, so the logging
+    config is not loaded for it. Its threshold is taken from
+    JBACKUP_LEVEL.
+    """
+    logger = logging.getLogger(name)
+
+    if stream:
+        if not any(isinstance(h, logging.StreamHandler) for h in logger.handlers):
+            add_handler(logger, 'stream')
+            logger.setLevel(Level.DEBUG)
+        logger.propagate = False
+    else:
+        _init_root_logger()
+
+    if level is not None:
+        logger.setLevel(level)
+
+    return logger
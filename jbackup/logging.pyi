@@ -1,5 +1,22 @@
 from __future__ import annotations
+from enum import IntEnum
 import logging
 
-def get_logger(name: str="") -> logging.Logger:
+class Level(IntEnum):
+    DEBUG = ...
+    INFO = ...
+    WARN = ...
+    ERROR = ...
+    CRITICAL = ...
+
+def _init_root_logger() -> None:
+    ...
+
+def add_handler(logger: logging.Logger, kind: str, *args, **kw) -> logging.Handler:
+    ...
+
+def get_record_tuple(logger: logging.Logger) -> tuple[str, Level, str] | None:
+    ...
+
+def get_logger(name: str="", level: Level | int | None=None, stream: bool=False) -> logging.Logger:
     ...
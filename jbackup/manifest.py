@@ -0,0 +1,184 @@
+"""
+File manifests for incremental backups.
+
+A manifest records the path, size, modification time, inode
+and content hash of every file in a backup. The manifest of
+the last run of each rule is kept in the state directory, and
+the next run compares the files it finds against it: a file
+whose size, modification time and inode have not changed is
+taken to be unchanged without reading it.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from ._path import get_state_path
+import os, json, time, hashlib
+
+if TYPE_CHECKING:
+    from typing import Iterator, Optional
+
+__all__ = [
+    # Classes
+    'HashingReader',
+    'Manifest',
+    'ManifestDiff',
+    'ManifestEntry',
+
+    # Functions
+    'load_manifest',
+    'manifest_file',
+    'new_hash',
+    'save_manifest'
+]
+
+_MANIFEST_VERSION = 1
+
+def new_hash():
+    """Return a new hash object of the kind used by manifests."""
+    return hashlib.blake2b(digest_size=32)
+
+class ManifestEntry(NamedTuple):
+    """A file in a manifest."""
+
+    path: str
+    size: int
+    mtime_ns: int
+    inode: int
+    hash: str
+
+class ManifestDiff(NamedTuple):
+    """The differences between two manifests."""
+
+    added: list[str]
+    changed: list[str]
+    deleted: list[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.deleted)
+
+class Manifest:
+    """A set of files, keyed by their path."""
+
+    def __init__(self, entries: Optional[dict[str, ManifestEntry]]=None, *,
+                 created: Optional[float]=None):
+        """
+        Make a manifest of ENTRIES.
+
+        CREATED is the time the files were first looked at,
+        which defaults to now.
+        """
+        self.entries: dict[str, ManifestEntry] = entries or {}
+        self.created = time.time() if created is None else created
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.entries
+
+    def __iter__(self) -> Iterator[ManifestEntry]:
+        return iter(self.entries.values())
+
+    def get(self, path: str) -> Optional[ManifestEntry]:
+        """Return the entry for PATH, or None."""
+        return self.entries.get(path)
+
+    def add(self, path: str, st: os.stat_result, digest: str) -> ManifestEntry:
+        """Add the file at PATH, with the stat result ST and hash DIGEST."""
+        entry = ManifestEntry(path, st.st_size, st.st_mtime_ns, st.st_ino, digest)
+        self.entries[path] = entry
+        return entry
+
+    def is_unchanged(self, path: str, st: os.stat_result) -> bool:
+        """
+        Whether the file at PATH is the same as in this manifest.
+
+        Only the stat result ST is compared, so the file is
+        not read.
+        """
+        entry = self.entries.get(path)
+        return entry is not None and entry.size == st.st_size \
+            and entry.mtime_ns == st.st_mtime_ns and entry.inode == st.st_ino
+
+    def diff(self, other: Manifest) -> ManifestDiff:
+        """Return what changed from this manifest to OTHER."""
+        added: list[str] = []
+        changed: list[str] = []
+        for entry in other:
+            old = self.entries.get(entry.path)
+            if old is None:
+                added.append(entry.path)
+            elif old.hash != entry.hash or old.size != entry.size:
+                changed.append(entry.path)
+
+        deleted = [path for path in self.entries if path not in other.entries]
+
+        return ManifestDiff(added, changed, deleted)
+
+    @classmethod
+    def load(cls, filename: str | Path) -> Manifest:
+        """
+        Read a manifest from FILENAME.
+
+        OSError is raised if it cannot be read, and ValueError
+        if it is not a valid manifest.
+        """
+        with open(filename, 'rt') as fd:
+            header = json.loads(fd.readline() or 'null')
+            if not isinstance(header, dict) or header.get('version') != _MANIFEST_VERSION:
+                raise ValueError(f"{filename} is not a manifest")
+            entries = {}
+            for line in fd:
+                entry = ManifestEntry(*json.loads(line))
+                entries[entry.path] = entry
+
+        # Manifests from before the creation time was kept are older than anything
+        return cls(entries, created=header.get('created', 0.0))
+
+    def save(self, filename: str | Path) -> None:
+        """Write the manifest to FILENAME, replacing it atomically."""
+        filename = Path(filename)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        tmpfile = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmpfile, 'wt') as fd:
+                fd.write(json.dumps({'version': _MANIFEST_VERSION,
+                                     'created': self.created}) + '\n')
+                for entry in self.entries.values():
+                    fd.write(json.dumps(list(entry)) + '\n')
+            os.replace(tmpfile, filename)
+        except BaseException:
+            tmpfile.unlink(missing_ok=True)
+            raise
+
+class HashingReader:
+    """A readable file wrapper that hashes what is read through it."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._hash = new_hash()
+
+    def read(self, size: int=-1) -> bytes:
+        data = self._fileobj.read(size)
+        self._hash.update(data)
+        return data
+
+    def hexdigest(self) -> str:
+        """The hash of the data read so far."""
+        return self._hash.hexdigest()
+
+def manifest_file(rulename: str) -> Path:
+    """Return the file of the last manifest of RULENAME."""
+    return get_state_path('manifests', f"{rulename}.jsonl")
+
+def load_manifest(rulename: str) -> Optional[Manifest]:
+    """Return the last manifest of RULENAME, or None if there is none."""
+    try:
+        return Manifest.load(manifest_file(rulename))
+    except (OSError, ValueError):
+        return None
+
+def save_manifest(rulename: str, manifest: Manifest) -> None:
+    """Make MANIFEST the last manifest of RULENAME."""
+    manifest.save(manifest_file(rulename))
@@ -0,0 +1,153 @@
+"""
+Streaming pipelines for asynchronous actions.
+
+A pipeline moves items from a source, through transform stages,
+into a sink. Every stage runs as its own task, and the stages are
+connected by bounded queues: a fast stage waits for a slow one
+instead of piling items up in memory, while reading, transforming
+and writing overlap.
+
+Plain functions are run in an executor, since the work they do,
+such as file I/O, hashing and compression, would block the event
+loop; coroutine functions are awaited directly. A transform can
+work on several items at once and still pass them on in order.
+
+    async def run_async(self):
+        with open(src, 'rb') as fin, open(dest, 'wb') as fout:
+            await run_pipeline(iter(partial(fin.read, 1 << 20), b''),
+                               stage(zlib.compress, workers=4),
+                               sink=fout.write)
+"""
+
+from __future__ import annotations
+from typing import TYPE_CHECKING, NamedTuple
+import asyncio
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from typing import Any, AsyncIterable, Callable, Iterable, Optional
+
+__all__ = [
+    # Classes
+    'Stage',
+
+    # Functions
+    'run_pipeline',
+    'stage',
+
+    # Variables
+    'DEFAULT_QUEUE_SIZE'
+]
+
+DEFAULT_QUEUE_SIZE = 8
+
+# Marks the end of the items in a queue
+_END: Any = object()
+
+class Stage(NamedTuple):
+    """A transform in a pipeline."""
+
+    func: Callable[[Any], Any]
+    workers: int = 1
+
+def stage(func: Callable[[Any], Any], *, workers: int=1) -> Stage:
+    """
+    Make a stage that passes each item through FUNC.
+
+    Up to WORKERS items are transformed at once; the results
+    are still passed on in the order of the items.
+    """
+    if workers < 1:
+        raise ValueError(f"invalid number of workers: {workers}")
+    return Stage(func, workers)
+
+async def _call(func: Callable[[Any], Any], item: Any,
+                executor: Optional[Executor]) -> Any:
+    if asyncio.iscoroutinefunction(func):
+        return await func(item)
+    return await asyncio.get_running_loop().run_in_executor(executor, func, item)
+
+def _ready(value: Any) -> asyncio.Future:
+    future = asyncio.get_running_loop().create_future()
+    future.set_result(value)
+    return future
+
+async def _produce(source: Iterable[Any] | AsyncIterable[Any], out: asyncio.Queue,
+                   executor: Optional[Executor]) -> None:
+    if hasattr(source, '__aiter__'):
+        async for item in source: # pyright: ignore
+            await out.put(_ready(item))
+    else:
+        # Reading from the source may block too
+        it = iter(source) # pyright: ignore
+        loop = asyncio.get_running_loop()
+        while (item := await loop.run_in_executor(executor, next, it, _END)) is not _END:
+            await out.put(_ready(item))
+
+    await out.put(_END)
+
+async def _transform(st: Stage, inq: asyncio.Queue, out: asyncio.Queue,
+                     executor: Optional[Executor], pending: set[asyncio.Future]) -> None:
+    slots = asyncio.Semaphore(st.workers)
+
+    async def transform(item: Any) -> Any:
+        try:
+            return await _call(st.func, item, executor)
+        finally:
+            slots.release()
+
+    while (future := await inq.get()) is not _END:
+        item = await future
+        pending.discard(future)
+        await slots.acquire()
+        task = asyncio.ensure_future(transform(item))
+        pending.add(task)
+        await out.put(task)
+
+    await out.put(_END)
+
+async def _consume(sink: Callable[[Any], Any], inq: asyncio.Queue,
+                   executor: Optional[Executor], pending: set[asyncio.Future]) -> int:
+    count = 0
+    while (future := await inq.get()) is not _END:
+        item = await future
+        pending.discard(future)
+        await _call(sink, item, executor)
+        count += 1
+
+    return count
+
+async def run_pipeline(source: Iterable[Any] | AsyncIterable[Any], *stages: Stage,
+                       sink: Callable[[Any], Any],
+                       maxsize: int=DEFAULT_QUEUE_SIZE,
+                       executor: Optional[Executor]=None) -> int:
+    """
+    Pass the items of SOURCE through STAGES into SINK.
+
+    SOURCE is an iterable, which is iterated in EXECUTOR, or an
+    async iterable. Each result of the last stage is passed to
+    SINK in order. Plain functions among STAGES and SINK are run
+    in EXECUTOR, or the default executor of the loop if it is
+    None. At most MAXSIZE items wait between two stages.
+
+    If a stage fails, the others are cancelled and the exception
+    is raised. Returns the number of items passed to SINK.
+    """
+    queues: list[asyncio.Queue] = [asyncio.Queue(maxsize) for _ in range(len(stages) + 1)]
+    pending: set[asyncio.Future] = set()
+
+    tasks: list[asyncio.Future] = [asyncio.ensure_future(_produce(source, queues[0], executor))]
+    for st, inq, out in zip(stages, queues, queues[1:]):
+        tasks.append(asyncio.ensure_future(_transform(st, inq, out, executor, pending)))
+    consumer = asyncio.ensure_future(_consume(sink, queues[-1], executor, pending))
+    tasks.append(consumer)
+
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks + list(pending):
+            task.cancel()
+        await asyncio.gather(*tasks, *pending, return_exceptions=True)
+        raise
+
+    return consumer.result()
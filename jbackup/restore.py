@@ -0,0 +1,225 @@
+"""
+Restoring backups.
+
+Files are restored from seekable archives (see
+jbackup.archive.seekable) or from snapshots in a chunk store
+(see jbackup.store). Both keep an index of their files, so only
+the files that are asked for are read. Files are written by a
+pool of threads, and the frames or chunks of a large file are
+decompressed in parallel, so a restore uses every core and
+keeps the disk busy.
+
+What is restored is selected by path prefixes, which name a
+file or a directory in the backup, and by glob patterns (see
+match()).
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+import os, time
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional
+    from .archive.seekable import ArchiveSet
+    from .store import ChunkStore, Snapshot
+
+__all__ = [
+    # Classes
+    'RestoreStats',
+
+    # Functions
+    'match',
+    'restore_archives',
+    'restore_snapshot',
+
+    # Variables
+    'DEFAULT_RESTORE_THREADS'
+]
+
+DEFAULT_RESTORE_THREADS = min(os.cpu_count() or 1, 8)
+
+# Files at least this large have their chunks read in parallel
+_LARGE_FILE = 16 * 1024 * 1024
+
+class RestoreStats(NamedTuple):
+    """Statistics about a restore."""
+
+    files: int
+    bytes: int
+    seconds: float
+
+    @property
+    def throughput(self) -> float:
+        """The bytes restored per second."""
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+def match(path: str, patterns: Iterable[str]) -> bool:
+    """
+    Whether PATH matches one of the glob PATTERNS.
+
+    A pattern with a '/' is matched against the whole path,
+    and one without against the last component of the path.
+    Matching is case-sensitive, and '*' matches across '/'.
+    """
+    from fnmatch import fnmatchcase
+
+    name = path.rpartition('/')[2]
+    return any(fnmatchcase(path if '/' in pattern else name, pattern.strip('/'))
+               for pattern in patterns)
+
+def _check_path(path: str) -> None:
+    if path.startswith('/') or '..' in path.split('/'):
+        raise ValueError(f"unsafe path in backup: {path}")
+
+def restore_archives(archives: ArchiveSet, destination: str | Path, *,
+                     paths: Iterable[str]=(), patterns: Iterable[str]=(),
+                     threads: int=DEFAULT_RESTORE_THREADS) -> RestoreStats:
+    """
+    Restore the latest version of the members of ARCHIVES under DESTINATION.
+
+    Only the members under PATHS (all of them if PATHS is
+    empty) that match one of PATTERNS (if it is not empty)
+    are restored; directories are only restored as such if
+    there are no PATTERNS. Up to THREADS files are written at
+    once.
+
+    LookupError is raised if one of PATHS is not in the
+    archives, and ArchiveError if a member is damaged.
+    """
+    from .archive.seekable import extract_members
+
+    patterns = list(patterns)
+    members = {}
+    for path in list(paths) or ['']:
+        found = archives.list(path.strip('/'))
+        if not found:
+            raise LookupError(f"{path} is not in the backup")
+        for archive, entry in found:
+            if patterns and (entry.is_dir or not match(entry.path, patterns)):
+                continue
+            members[entry.path] = (archive, entry)
+
+    start = time.perf_counter()
+    selected = [members[name] for name in sorted(members)]
+    count = extract_members(selected, destination, threads=threads)
+    return RestoreStats(count, sum(entry.size for _, entry in selected),
+                        time.perf_counter() - start)
+
+def _under(names: list[str], path: str) -> list[str]:
+    # The names in the sorted list NAMES that are PATH or under it
+    from bisect import bisect_left
+
+    i = bisect_left(names, path)
+    found = [path] if i < len(names) and names[i] == path else []
+    prefix = path + '/'
+    for i in range(bisect_left(names, prefix), len(names)):
+        if not names[i].startswith(prefix):
+            break
+        found.append(names[i])
+    return found
+
+def restore_snapshot(store: ChunkStore, snapshot: Snapshot, destination: str | Path, *,
+                     paths: Iterable[str]=(), patterns: Iterable[str]=(),
+                     threads: int=DEFAULT_RESTORE_THREADS) -> RestoreStats:
+    """
+    Restore the files of SNAPSHOT from STORE under DESTINATION.
+
+    PATHS, PATTERNS and THREADS are as in restore_archives().
+    Each file is written under a name ending in '.part' until
+    it is complete, and gets its permission bits and
+    modification time back, as do directories once their
+    contents are written. Symbolic links are made again.
+
+    LookupError is raised if one of PATHS is not in the
+    snapshot, ValueError if a file of the snapshot would be
+    written outside DESTINATION, and StoreError if a chunk
+    is damaged.
+    """
+    from concurrent.futures import Executor, ThreadPoolExecutor
+
+    destination = Path(destination)
+    patterns = list(patterns)
+    everything = sorted([*snapshot.manifest.entries, *snapshot.members])
+    paths = [path.strip('/') for path in paths]
+    if paths:
+        names: set[str] = set()
+        for path in paths:
+            found = _under(everything, path)
+            if not found:
+                raise LookupError(f"{path} is not in the backup")
+            names.update(found)
+    else:
+        names = set(everything)
+    members = snapshot.members
+    if patterns:
+        names = {name for name in names
+                 if not (name in members and members[name].is_dir) and match(name, patterns)}
+    for name in names:
+        _check_path(name)
+
+    def restore(name: str, pool: Optional[Executor]=None) -> int:
+        target = destination / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        member = members.get(name)
+        if member is not None:
+            # A symbolic link; directories are made beforehand
+            if os.path.lexists(target):
+                target.unlink()
+            os.symlink(member.target, target)
+            os.utime(target, ns=(member.mtime_ns, member.mtime_ns), follow_symlinks=False)
+            return 0
+
+        entry = snapshot.manifest.entries[name]
+        partfile = target.with_name(target.name + '.part')
+        try:
+            with open(partfile, 'wb') as fd:
+                for data in store.read_file(snapshot, name, pool=pool):
+                    fd.write(data)
+            mode = snapshot.modes.get(name)
+            if mode is not None:
+                os.chmod(partfile, mode)
+            os.replace(partfile, target)
+        except BaseException:
+            partfile.unlink(missing_ok=True)
+            raise
+        os.utime(target, ns=(entry.mtime_ns, entry.mtime_ns))
+        return entry.size
+
+    start = time.perf_counter()
+    total = 0
+    selected = sorted(names)
+    dirs = [name for name in selected if name in members and members[name].is_dir]
+    for name in dirs:
+        (destination / name).mkdir(parents=True, exist_ok=True)
+    others = [name for name in selected if not (name in members and members[name].is_dir)]
+
+    def size(name: str) -> int:
+        entry = snapshot.manifest.entries.get(name)
+        return 0 if entry is None else entry.size
+
+    if threads <= 1:
+        for name in others:
+            total += restore(name)
+    else:
+        with ThreadPoolExecutor(threads, thread_name_prefix='jbackup-restore') as pool:
+            try:
+                futures = [pool.submit(restore, name) for name in others
+                           if size(name) < _LARGE_FILE]
+                # One large file at a time, its chunks spread over the pool
+                for name in others:
+                    if size(name) >= _LARGE_FILE:
+                        total += restore(name, pool)
+                total += sum(future.result() for future in futures)
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+
+    # Writing into a directory changes its time, and a read-only
+    # directory could not have been written into
+    for name in reversed(dirs):
+        member = members[name]
+        os.chmod(destination / name, member.mode)
+        os.utime(destination / name, ns=(member.mtime_ns, member.mtime_ns))
+
+    return RestoreStats(len(selected), total, time.perf_counter() - start)
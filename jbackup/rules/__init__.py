@@ -3,14 +3,14 @@
 from __future__ import annotations
 from pathlib import Path
 from ..utils import Nil
-from .config.toml_config_adapter import TOMLFile
-from .config import MissingOptionError, RuleParserError, MissingSectionError
+from .config import (MissingOptionError, RuleParserError, MissingSectionError,
+                     get_format, register_format)
 from .config.config_protocol import ConfigFile
 from typing import TYPE_CHECKING
 import re
 
 if TYPE_CHECKING:
-    from typing import Any, Literal
+    from typing import Any, Literal, Optional
 
 __all__ = [
     # Classes
@@ -21,20 +21,41 @@ __all__ = [
     'Rule',
 
     # Functions
-    'parse_string'
+    'get_format',
+    'parse_string',
+    'register_format'
 ]
 
 class Rule:
     """A representation of a rule."""
 
-    def __init__(self, filename: str, mode: Literal['r', 'w']='r'):
+    def __init__(self, filename: str, mode: Literal['r', 'w']='r', *,
+                 validate: bool=False, cache: Optional[bool]=None,
+                 base: Optional[str | Path]=None):
         """
         Open a rule file in the specified mode.
 
         The format of the rule file depends on the
-        extension. MODE is either 'r' or 'w' for
-        read and write operations, respectively.
+        extension (see get_format()). MODE is either
+        'r' or 'w' for read and write operations,
+        respectively.
+
+        Type tags in the rule (see parse_string()) are
+        converted as values are looked up. If VALIDATE is
+        true, they are all converted when the file is read.
+
+        If CACHE is true, the rule is loaded from the rule cache
+        (see jbackup.rules.cache), where it is kept with all of
+        its type tags converted. If CACHE is None, the cache is
+        used unless JBACKUP_NO_RULE_CACHE is set.
+
+        If BASE is given, the relative paths that get() returns
+        are made relative to BASE rather than to the current
+        directory. This also covers paths in lists and tables.
         """
+        self._filename = filename
+        self._base = Path(base) if base is not None else None
+
         kw: dict[str, Any] = {}
         if mode == 'w':
             kw['data'] = {
@@ -42,9 +63,23 @@ class Rule:
             }
         else:
             kw['func'] = parse_string
+            kw['eager'] = validate
+            if cache is None:
+                from .cache import cache_enabled
+                cache = cache_enabled()
+            kw['cache'] = cache
+
+        self._config = get_format(filename)(filename, mode, **kw) # pyright: ignore
 
-        if filename.endswith('.toml'):
-            self._config = TOMLFile(filename, mode, **kw)
+    @property
+    def filename(self) -> str:
+        """The path to the rule file."""
+        return self._filename
+
+    @property
+    def name(self) -> str:
+        """The name of the rule, which is the stem of its file."""
+        return Path(self._filename).stem
 
     @property
     def config(self) -> ConfigFile:
@@ -59,11 +94,39 @@ class Rule:
         DEFAULT; otherwise MissingOptionError is raised.
         """
         try:
-            return self.config.get(key, default)
+            value = self.config.get(key, default)
         except MissingOptionError:
             if not safe: raise
+            return default
 
-        return default
+        return value if self._base is None else self._resolve(value, False)
+
+    def resolve_paths(self, value: Any) -> Any:
+        """
+        Make the relative paths in VALUE relative to the base directory.
+
+        Unlike get(), which only rebases Path objects, strings
+        are taken as paths too; they are returned as strings.
+        VALUE is returned as is when the rule has no base.
+        """
+        return value if self._base is None else self._resolve(value, True)
+
+    def _resolve(self, value: Any, strings: bool) -> Any:
+        # Make the relative paths in VALUE relative to the base directory
+        assert self._base is not None
+        if isinstance(value, Path):
+            value = value.expanduser()
+            return value if value.is_absolute() else self._base / value
+        elif strings and isinstance(value, str) and value:
+            path = Path(value).expanduser()
+            return value if path.is_absolute() else str(self._base / path)
+        elif isinstance(value, list):
+            return [self._resolve(item, strings) for item in value]
+        elif isinstance(value, dict):
+            return {key: self._resolve(item, strings)
+                    for key, item in value.items()}
+
+        return value
 
     def __getitem__(self, key: str) -> Any:
         return self.get(key)
@@ -0,0 +1,112 @@
+"""
+A cache of parsed rules.
+
+A rule is cached after it is parsed and its type tags are
+converted, as a pickle, both in memory and under the cache
+directory. An entry is only used while the rule file keeps the
+path, modification time and size it had when it was cached, so
+editing a rule invalidates it.
+
+Both caches are bounded and drop their least recently used
+entries. Setting JBACKUP_NO_RULE_CACHE to a non-empty value
+bypasses them.
+"""
+
+from __future__ import annotations
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING
+from .._cache import read_entry, write_entry, cache_file
+from .._path import get_cache_path
+import os, pickle
+
+if TYPE_CHECKING:
+    from typing import Any, BinaryIO, Callable
+
+__all__ = [
+    # Functions
+    'cache_enabled',
+    'clear_memory_cache',
+    'load_rule_data',
+
+    # Variables
+    'MAX_DISK_ENTRIES',
+    'MAX_MEMORY_ENTRIES'
+]
+
+MAX_MEMORY_ENTRIES = 128
+MAX_DISK_ENTRIES = 1024
+
+_CACHE_KIND = 'rules'
+
+# Pickles of rule data, keyed by (path, mtime_ns, size), most recently used last
+_memory: OrderedDict[tuple[str, int, int], bytes] = OrderedDict()
+
+def cache_enabled() -> bool:
+    """Whether the rule cache is used, i.e. JBACKUP_NO_RULE_CACHE is not set."""
+    return not os.environ.get('JBACKUP_NO_RULE_CACHE')
+
+def clear_memory_cache() -> None:
+    """Empty the in-memory rule cache."""
+    _memory.clear()
+
+def _evict_disk_entries() -> None:
+    # Remove the least recently used entries beyond MAX_DISK_ENTRIES
+    directory = get_cache_path(_CACHE_KIND)
+    try:
+        with os.scandir(directory) as it:
+            entries = [(entry.stat().st_mtime_ns, entry.path) for entry in it
+                       if not entry.name.endswith('.tmp')]
+    except OSError:
+        return
+
+    if len(entries) <= MAX_DISK_ENTRIES:
+        return
+
+    entries.sort()
+    for _, path in entries[:len(entries) - MAX_DISK_ENTRIES]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def load_rule_data(filename: str, parse: Callable[[BinaryIO], dict[str, Any]],
+                   convert: Callable[[dict[str, Any]], None]) -> dict[str, Any]:
+    """
+    Return the contents of the rule FILENAME.
+
+    On a cache miss, the file is read with PARSE, and CONVERT is
+    called with the result to convert it in place; the result is
+    then cached. The returned dictionary is a fresh copy that
+    the caller may change.
+    """
+    path = Path(filename).resolve()
+    st = os.stat(path)
+    key = (str(path), st.st_mtime_ns, st.st_size)
+
+    payload = _memory.get(key)
+    if payload is not None:
+        _memory.move_to_end(key)
+        return pickle.loads(payload)
+
+    payload = read_entry(_CACHE_KIND, path, st, loads=bytes)
+    if payload is not None:
+        # Mark the entry as recently used
+        try:
+            os.utime(cache_file(_CACHE_KIND, path))
+        except OSError: # pragma: no cover
+            pass
+        data = pickle.loads(payload)
+    else:
+        with open(path, 'rb') as fd:
+            data = parse(fd)
+        convert(data)
+        payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        if write_entry(_CACHE_KIND, path, st, payload, dumps=bytes) is not None:
+            _evict_disk_entries()
+
+    _memory[key] = payload
+    if len(_memory) > MAX_MEMORY_ENTRIES:
+        _memory.popitem(last=False)
+
+    return data
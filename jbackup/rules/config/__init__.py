@@ -1,5 +1,12 @@
 """Rule configurations."""
 
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .config_protocol import ConfigFile
+
 class MissingSectionError(LookupError):
     """Missing section in a rule file."""
 
@@ -8,3 +15,40 @@ class RuleParserError(Exception):
 
 class MissingOptionError(LookupError):
     """An error raised when an option does not exist."""
+
+# Rule file suffixes mapped to the ConfigFile class that reads them,
+# or the module and name of the class so it is imported when needed
+_FORMATS: dict[str, type[ConfigFile] | tuple[str, str]] = {
+    '.toml': ('toml_config_adapter', 'TOMLFile'),
+    '.yaml': ('yaml_config_adapter', 'YAMLFile'),
+    '.yml': ('yaml_config_adapter', 'YAMLFile'),
+    '.json': ('json_config_adapter', 'JSONFile')
+}
+
+def register_format(suffix: str, cls: type[ConfigFile]) -> None:
+    """Make rule files ending in SUFFIX (e.g. '.ini') be read with CLS."""
+    _FORMATS[suffix.lower()] = cls
+
+def format_names() -> list[str]:
+    """Return the names of the rule formats, which are their suffixes without the dot."""
+    return sorted(suffix[1:] for suffix in _FORMATS if suffix != '.yml')
+
+def get_format(filename: str | Path) -> type[ConfigFile]:
+    """
+    Return the ConfigFile class that reads FILENAME.
+
+    The class is chosen by the suffix of FILENAME. RuleParserError
+    is raised if no format has that suffix.
+    """
+    suffix = Path(filename).suffix.lower()
+    try:
+        cls = _FORMATS[suffix]
+    except KeyError:
+        raise RuleParserError(f"{filename}: unsupported rule format '{suffix}'") from None
+
+    if isinstance(cls, tuple):
+        from importlib import import_module
+        module, name = cls
+        cls = _FORMATS[suffix] = getattr(import_module(f".{module}", __name__), name)
+
+    return cls
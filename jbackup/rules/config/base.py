@@ -0,0 +1,128 @@
+"""
+A base class for rule config files.
+
+XDictConfigFile implements the parts of ConfigFile that do not
+depend on the file format: reading and writing the file, the
+lazy conversion of strings, the rule cache, and the lookup of
+slash-separated keys through XDictContainer. A format only has
+to provide parse_file() and write_file().
+"""
+
+from __future__ import annotations
+from ...utils import XDictContainer, Nil
+from . import MissingSectionError, MissingOptionError
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Any, BinaryIO, Literal, Callable
+    _StringParse = Callable[[str], Any]
+
+class XDictConfigFile:
+    """A config file whose contents are held in an XDictContainer."""
+
+    def __init__(self, filename: str,
+                 mode: Literal['r', 'w']='r', *,
+                 data: dict[str, Any]={},
+                 func: _StringParse | None=None,
+                 eager: bool=False,
+                 cache: bool=False):
+        """
+        Open a config file for either input or output.
+
+        If MODE is 'r', FILENAME is opened for input.
+        If MODE is 'w', FILENAME is opened for output.
+
+        In input mode, the file is opened and parsed.
+        In output mode, DATA is converted to the format of
+        the file and written to it.
+
+        FUNC converts the strings in the file. A string is
+        converted when it is first looked up, unless EAGER is
+        true, in which case the whole file is converted here.
+
+        If CACHE is true, the file is read through the rule cache
+        (see jbackup.rules.cache), converted as a whole with FUNC.
+        FUNC must then be the same every time the file is read.
+        """
+        if mode not in ('r', 'w'):
+            raise ValueError(f"invalid mode '{mode}', must be 'r' or 'w'")
+
+        if mode == 'r' and cache:
+            from ..cache import load_rule_data
+
+            def convert(data: dict[str, Any]) -> None:
+                XDictContainer(data, func=func).parse_all()
+
+            self._data = XDictContainer(load_rule_data(filename, self.parse_file, convert))
+            self._data.build_index()
+        elif mode == 'r':
+            with open(filename, 'rb') as fd:
+                self._data = XDictContainer(self.parse_file(fd), func=func)
+
+            # Index the data by path
+            self._data.build_index()
+            if eager:
+                self._data.parse_all()
+        else:
+            with open(filename, 'wb') as fd:
+                self.write_file(fd, data)
+            self._data = XDictContainer(data)
+
+    @staticmethod
+    def write_file(fp: BinaryIO, obj: dict[str, Any]):
+        """Write an object to file."""
+        raise NotImplementedError
+
+    @staticmethod
+    def parse_file(fp: BinaryIO) -> dict[str, Any]:
+        """Parse a file and return a dictionary."""
+        raise NotImplementedError
+
+    def __contains__(self, key: str, /) -> bool: # pragma: no cover
+        nil = Nil()
+        if self.get(key, nil) is nil:
+            return False
+        return True
+
+    def get(self, key: str, default=None) -> Any:
+        """
+        Return the value associated with KEY.
+
+        The key must contain at least one forward
+        slash, or the results might be unexpected.
+
+        KEY is split into two segments, the section
+        and the option. The section is the substring
+        that occurs before the first forward slash.
+        If KEY starts with a slash, the section
+        refers to the global section. The option
+        refers to the rest of KEY, a forward slash-
+        separated list of tags denoting the path
+        to a specific value.
+
+        >>> config.get('/config_path') # 'config_path' in global section
+        >>> config.get('options/a') # 'a' in section 'options'
+        >>> config.get('options/suboptions/a') # 'suboptions/a' in section 'options'
+
+        If the section does not exist, MissingSectionError
+        is raised. If the option does not exist,
+        MissingOptionError is raised.
+        """
+        assert '/' in key
+
+        nil = Nil()
+        section, _, opt = key.partition('/')
+        if not section:
+            key = opt
+
+        # Retrieve option under section
+        val = self._data.get(key, nil)
+        if val is not nil:
+            return val
+
+        # Check if the section exists
+        if section and self._data.get(section, nil) is nil:
+            raise MissingSectionError(f"'{section}'")
+
+        section = f"section '{section}'" if section else 'global section'
+        raise MissingOptionError(f"'{opt}' in {section}")
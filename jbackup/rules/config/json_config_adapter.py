@@ -0,0 +1,41 @@
+"""
+Module for reading JSON files.
+
+The top level of a rule file must be an object. Nested objects
+become subdictionaries, like the tables of a TOML file.
+"""
+
+from __future__ import annotations
+from . import RuleParserError
+from .base import XDictConfigFile
+from typing import TYPE_CHECKING
+import json
+
+if TYPE_CHECKING:
+    from typing import Any, BinaryIO
+
+class JSONFile(XDictConfigFile):
+    """JSON config file."""
+
+    @staticmethod
+    def write_file(fp: BinaryIO, obj: dict[str, Any]):
+        """Write an object to file."""
+        fp.write(json.dumps(obj, indent=4).encode() + b'\n')
+
+    @staticmethod
+    def parse_file(fp: BinaryIO) -> dict[str, Any]:
+        """
+        Parse a file and return a dictionary.
+
+        RuleParserError is raised if the file is not valid JSON
+        or its top level is not an object.
+        """
+        try:
+            data = json.load(fp)
+        except ValueError as exc:
+            raise RuleParserError(str(exc)) from None
+
+        if not isinstance(data, dict):
+            raise RuleParserError("the top level of a rule must be an object")
+
+        return data
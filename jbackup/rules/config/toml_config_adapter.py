@@ -22,8 +22,8 @@ dictionary looks like.
 """
 
 from __future__ import annotations
-from ...utils import XDictContainer, Nil
-from . import RuleParserError, MissingSectionError, MissingOptionError
+from . import RuleParserError
+from .base import XDictConfigFile
 from typing import TYPE_CHECKING
 import tomli_w
 
@@ -35,44 +35,11 @@ except:
     from tomli import TOMLDecodeError
 
 if TYPE_CHECKING:
-    from typing import Any, BinaryIO, Literal, Callable
-    _StringParse = Callable[[str], Any]
+    from typing import Any, BinaryIO
 
-class TOMLFile:
+class TOMLFile(XDictConfigFile):
     """TOML config file."""
 
-    def __init__(self, filename: str,
-                 mode: Literal['r', 'w']='r', *,
-                 data: dict[str, Any]={},
-                 func: _StringParse | None=None):
-        """
-        Open a TOML file for either input or output.
-
-        If MODE is 'r', FILENAME is opened for input.
-        If MODE is 'w', FILENAME is opened for output.
-
-        In input mode, the file is opened and parsed as TOML.
-        In output mode, DATA is converted to a TOML string and
-        written to file.
-        """
-        if mode not in ('r', 'w'):
-            raise ValueError(f"invalid mode '{mode}', must be 'r' or 'w'")
-
-        if mode == 'r':
-            with open(filename, 'rb') as fd:
-                self._data = XDictContainer(self.parse_file(fd))
-
-            # Parse data
-            if func is not None:
-                for result in self._data:
-                    key, value, parent = result
-                    if isinstance(value, str):
-                        parent[key] = func(value)
-        else:
-            with open(filename, 'wb') as fd:
-                self.write_file(fd, data)
-            self._data = XDictContainer(data)
-
     @staticmethod
     def write_file(fp: BinaryIO, obj: dict[str, Any]):
         """
@@ -104,56 +71,3 @@ class TOMLFile:
             raise RuleParserError(err)
 
         return data
-
-    def __contains__(self, key: str, /) -> bool: # pragma: no cover
-        nil = Nil()
-        if self.get(key, nil) is nil:
-            return False
-        return True
-
-    def get(self, key: str, default=None) -> Any:
-        """
-        Return the value associated with KEY.
-
-        The key must contain at least one forward
-        slash, or the results might be unexpected.
-
-        KEY is split into two segments, the section
-        and the option. The section is the substring
-        that occurs before the first forward slash.
-        If KEY starts with a slash, the section
-        refers to the global section. The option
-        refers to the rest of KEY, a forward slash-
-        separated list of tags denoting the path
-        to a specific value.
-
-        >>> tomlf.get('/config_path') # 'config_path' in global section
-        >>> tomlf.get('options/a') # 'a' in section 'options'
-        >>> tomlf.get('options/suboptions/a') # 'suboptions/a' in section 'options'
-
-        If the section does not exist, MissingSectionError
-        is raised. If the option does not exist,
-        MissingOptionError is raised.
-        """
-        assert '/' in key
-
-        nil = Nil()
-        section, _, opt = key.partition('/')
-
-        # Check if the section exists
-        if section and self._data.get(section, nil) is nil:
-            raise MissingSectionError(f"'{section}'")
-
-        if section:
-            section = f"section '{section}'"
-        else:
-            section = 'global section'
-            key = opt
-
-        # Retrieve option under section
-
-        val = self._data.get(key, nil)
-        if val is nil:
-            raise MissingOptionError(f"'{opt}' in {section}")
-
-        return val
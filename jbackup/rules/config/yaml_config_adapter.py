@@ -0,0 +1,71 @@
+"""
+Module for reading YAML files.
+
+Files are parsed with the LibYAML-based CSafeLoader when PyYAML
+was built with it, which is much faster than the pure-Python
+loaders, and with SafeLoader otherwise. Only the safe subset of
+YAML is accepted: no tags that create arbitrary Python objects.
+
+The top level of a rule file must be a mapping. Nested mappings
+become subdictionaries, like the tables of a TOML file. Their keys
+must be strings: YAML reads unquoted keys such as 'on', 'yes' or
+'2' as booleans and numbers, so they have to be quoted.
+"""
+
+from __future__ import annotations
+from . import RuleParserError
+from .base import XDictConfigFile
+from typing import TYPE_CHECKING
+import yaml
+
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError: # pragma: no cover
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+
+if TYPE_CHECKING:
+    from typing import Any, BinaryIO
+
+def _check_keys(data: dict[Any, Any]) -> None:
+    # Raise RuleParserError if a key of a mapping in DATA is not a string
+    stack: list[tuple[str, Any]] = [("", data)]
+    while stack:
+        prefix, node = stack.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if not isinstance(key, str):
+                    raise RuleParserError(f"key {key!r} in '{prefix or '/'}' is not "
+                                          f"a string; quote it")
+                stack.append((prefix + '/' + key, value))
+        elif isinstance(node, list):
+            stack.extend((prefix, value) for value in node)
+
+class YAMLFile(XDictConfigFile):
+    """YAML config file."""
+
+    @staticmethod
+    def write_file(fp: BinaryIO, obj: dict[str, Any]):
+        """Write an object to file."""
+        yaml.dump(obj, fp, Dumper=_Dumper, encoding='utf-8',
+                  default_flow_style=False, sort_keys=False)
+
+    @staticmethod
+    def parse_file(fp: BinaryIO) -> dict[str, Any]:
+        """
+        Parse a file and return a dictionary.
+
+        RuleParserError is raised if the file is not valid YAML,
+        its top level is not a mapping or a key is not a string.
+        """
+        try:
+            data = yaml.load(fp, Loader=_Loader)
+        except yaml.YAMLError as exc:
+            raise RuleParserError(str(exc)) from None
+
+        if data is None:
+            return {}
+        if not isinstance(data, dict):
+            raise RuleParserError("the top level of a rule must be a mapping")
+        _check_keys(data)
+
+        return data
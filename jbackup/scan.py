@@ -0,0 +1,369 @@
+"""
+Filesystem scanning.
+
+Trees are walked with os.scandir, and the listing of each
+directory is read on a thread pool ahead of the walk, so that
+the system calls of many directories are made at once. The
+entries are still yielded in sorted, depth-first order, as soon
+as they are known; a caller can start on the first file before
+the rest of the tree has been listed.
+
+Exclude and include patterns use the syntax of gitignore files
+and are compiled into one regular expression per set, so each
+path is matched once no matter how many patterns there are.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+import os, re, stat
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from typing import Callable, Iterable, Iterator, Optional
+
+__all__ = [
+    # Classes
+    'PathMatcher',
+    'ScanEntry',
+    'Scanner',
+
+    # Functions
+    'scan',
+    'translate_pattern',
+
+    # Variables
+    'DEFAULT_SCAN_THREADS'
+]
+
+DEFAULT_SCAN_THREADS = 8
+
+class ScanEntry(NamedTuple):
+    """A file found by a scan."""
+
+    path: str
+    arcname: str
+    stat: os.stat_result
+
+    @property
+    def is_dir(self) -> bool:
+        """Whether the entry is a directory (symbolic links are not followed)."""
+        return stat.S_ISDIR(self.stat.st_mode)
+
+    @property
+    def is_file(self) -> bool:
+        """Whether the entry is a regular file (symbolic links are not followed)."""
+        return stat.S_ISREG(self.stat.st_mode)
+
+def translate_pattern(pattern: str) -> Optional[tuple[str, bool, bool]]:
+    """
+    Translate a gitignore PATTERN into a regular expression.
+
+    Return the expression, whether the pattern is negated
+    ('!pat') and whether it only matches directories ('pat/'),
+    or None if PATTERN is blank or a comment.
+
+    As in gitignore, a pattern without a slash, except at the end,
+    matches a name at any depth; otherwise it matches relative to
+    the base of the pattern. '*' and '?' do not match a slash,
+    while '**' matches any number of directories.
+    """
+    if pattern.startswith('#'):
+        return None
+    pattern = pattern.rstrip('\n')
+    # Trailing spaces are ignored unless escaped
+    while pattern.endswith(' ') and not pattern.endswith('\\ '):
+        pattern = pattern[:-1]
+    if not pattern:
+        return None
+
+    negate = False
+    if pattern.startswith('!'):
+        negate = True
+        pattern = pattern[1:]
+    elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+        pattern = pattern[1:]
+
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if not pattern:
+        return None
+
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+
+    out = [] if anchored else ['(?:.*/)?']
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/') \
+               and (i + 2 == n or pattern[i + 2] == '/'):
+                if i + 2 == n:
+                    # 'dir/**' matches everything inside dir
+                    out.append('.*')
+                else:
+                    # '**/' matches zero or more directories
+                    out.append('(?:.*/)?')
+                    i += 1
+                i += 2
+                continue
+            while i < n and pattern[i] == '*':
+                i += 1
+            out.append('[^/]*')
+            continue
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            j = pattern.find(']', i + 2 if pattern.startswith('[!', i) else i + 1)
+            if j < 0:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:j].replace('\\', '\\\\')
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append(f"(?!/)[{body}]")
+                i = j + 1
+                continue
+        elif c == '\\' and i + 1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+
+    return ''.join(out), negate, dir_only
+
+class PathMatcher:
+    """A compiled set of gitignore patterns."""
+
+    def __init__(self, patterns: Iterable[str]):
+        """
+        Compile PATTERNS, in the syntax of gitignore files.
+
+        Later patterns take precedence over earlier ones, so a
+        negated pattern can re-include a path that an earlier
+        pattern matched.
+        """
+        translated = [t for t in map(translate_pattern, patterns) if t is not None]
+        self._negated = [negate for _, negate, _ in translated]
+
+        # Alternatives are tried in order, so the last pattern comes
+        # first; the name of the group that matched tells which it was
+        def combine(dirs: bool) -> Optional[re.Pattern[str]]:
+            groups = [f"(?P<p{i}>{regex})" for i, (regex, _, dir_only)
+                      in reversed(list(enumerate(translated))) if dirs or not dir_only]
+            return re.compile('|'.join(groups), re.DOTALL) if groups else None
+
+        self._dir_regex = combine(True)
+        self._file_regex = combine(False)
+
+    def __bool__(self) -> bool:
+        return self._dir_regex is not None
+
+    @classmethod
+    def from_file(cls, filename: str | Path) -> PathMatcher:
+        """Compile the patterns in the gitignore file FILENAME."""
+        with open(filename, 'rt', errors='replace') as fd:
+            return cls(fd.readlines())
+
+    def match(self, path: str, is_dir: bool=False) -> Optional[bool]:
+        """
+        Match PATH, relative to the base of the patterns.
+
+        Return True if the last pattern that matches PATH is a
+        normal pattern, False if it is negated, and None if
+        no pattern matches.
+        """
+        regex = self._dir_regex if is_dir else self._file_regex
+        if regex is None:
+            return None
+
+        m = regex.fullmatch(path)
+        if m is None:
+            return None
+
+        return not self._negated[int(m.lastgroup[1:])] # pyright: ignore
+
+def _listdir(path: str) -> list[tuple[str, os.stat_result]]:
+    # The names and stat results of the entries in PATH, sorted;
+    # DirEntry.stat() makes the call here, on the worker thread
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                entries.append((entry.name, entry.stat(follow_symlinks=False)))
+            except FileNotFoundError:
+                # Deleted during the scan
+                continue
+    entries.sort()
+    return entries
+
+class Scanner:
+    """Walks trees, leaving out the paths that patterns exclude."""
+
+    def __init__(self, exclude: Iterable[str]=(), include: Iterable[str]=(), *,
+                 gitignore: bool=False, threads: int=DEFAULT_SCAN_THREADS):
+        """
+        Make a scanner.
+
+        Paths that match the gitignore patterns in EXCLUDE are
+        left out, along with everything under them. If INCLUDE is
+        not empty, only the files that match one of its patterns
+        are yielded; directories are still entered. Patterns are
+        matched against the paths under the name of each source,
+        e.g. 'src/main.c'.
+
+        If GITIGNORE is true, the .gitignore files found in the
+        trees apply to the directories they are in, below the
+        patterns in EXCLUDE.
+
+        THREADS directories are listed at a time; with 1, the
+        walk is done on the calling thread.
+        """
+        self.exclude = PathMatcher(exclude)
+        self.include = PathMatcher(include)
+        self.gitignore = gitignore
+        self.threads = threads
+
+    def _excluded(self, arcname: str, is_dir: bool,
+                  ignores: list[tuple[str, PathMatcher]]) -> bool:
+        result = self.exclude.match(arcname, is_dir)
+        if result is not None:
+            return result
+
+        # The nearest .gitignore file decides
+        for base, matcher in reversed(ignores):
+            result = matcher.match(arcname[len(base) + 1:], is_dir)
+            if result is not None:
+                return result
+
+        return False
+
+    def scan(self, source: str | Path, arcname: Optional[str]=None) -> Iterator[ScanEntry]:
+        """
+        Yield SOURCE and everything under it, depth first in sorted order.
+
+        The entries are named ARCNAME, or the name of SOURCE, followed
+        by their path under it. Symbolic links are not followed.
+        """
+        source = os.fspath(source)
+        if arcname is None:
+            arcname = Path(source).name
+
+        st = os.lstat(source)
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if self._excluded(arcname, is_dir, []):
+            return
+        yield ScanEntry(source, arcname, st)
+        if not is_dir:
+            return
+
+        if self.threads == 1:
+            yield from self._walk(source, arcname, lambda: _listdir(source), None, [])
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(self.threads, thread_name_prefix='jbackup-scan')
+        try:
+            future = pool.submit(_listdir, source)
+            yield from self._walk(source, arcname, future.result, pool, [])
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def scan_paths(self, source: str | Path, paths: Iterable[str],
+                   arcname: Optional[str]=None) -> Iterator[ScanEntry]:
+        """
+        Yield the entries of SOURCE that are among PATHS, and everything under them.
+
+        PATHS are absolute paths; those outside SOURCE are ignored, and
+        SOURCE is scanned whole if it is under one of them. Paths that
+        no longer exist, or that the patterns leave out, are skipped.
+        The entries are named as scan() names them, and yielded in
+        sorted order.
+
+        .gitignore files are not read here, so ValueError is raised
+        if the scanner uses them.
+        """
+        if self.gitignore:
+            raise ValueError("cannot scan single paths with .gitignore files")
+
+        source = os.path.abspath(source)
+        if arcname is None:
+            arcname = Path(source).name
+
+        names: set[str] = set()
+        for path in paths:
+            if source == path or source.startswith(path.rstrip('/') + '/'):
+                yield from self.scan(source, arcname)
+                return
+            if path.startswith(source + '/'):
+                names.add(arcname + path[len(source):])
+
+        scanned: set[str] = set()
+        for name in sorted(names):
+            parts = name.split('/')
+            ancestors = ['/'.join(parts[:i]) for i in range(1, len(parts))]
+            if any(a in scanned or self.exclude.match(a, True) for a in ancestors):
+                continue
+
+            path = os.path.join(source, *parts[1:])
+            try:
+                st = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                scanned.add(name)
+            elif self.include and not self.include.match(name):
+                continue
+
+            yield from self.scan(path, name)
+
+    def _walk(self, path: str, arcname: str, listing: Callable[[], list],
+              pool: Optional[ThreadPoolExecutor],
+              ignores: list[tuple[str, PathMatcher]]) -> Iterator[ScanEntry]:
+        entries = listing()
+
+        if self.gitignore and any(name == '.gitignore' for name, _ in entries):
+            try:
+                ignores = ignores + [(arcname, PathMatcher.from_file(os.path.join(path, '.gitignore')))]
+            except OSError:
+                pass
+
+        children = []
+        for name, st in entries:
+            childpath = os.path.join(path, name)
+            childarc = f"{arcname}/{name}"
+            is_dir = stat.S_ISDIR(st.st_mode)
+            if self._excluded(childarc, is_dir, ignores):
+                continue
+            if not is_dir and self.include and not self.include.match(childarc):
+                continue
+
+            # List subdirectories ahead of the walk
+            sublisting: Optional[Callable[[], list]] = None
+            if is_dir:
+                if pool is None:
+                    sublisting = lambda p=childpath: _listdir(p)
+                else:
+                    future: Future = pool.submit(_listdir, childpath)
+                    sublisting = future.result
+            children.append((childpath, childarc, st, sublisting))
+
+        for childpath, childarc, st, sublisting in children:
+            yield ScanEntry(childpath, childarc, st)
+            if sublisting is not None:
+                yield from self._walk(childpath, childarc, sublisting, pool, ignores)
+
+def scan(sources: Iterable[str | Path], exclude: Iterable[str]=(),
+         include: Iterable[str]=(), *, gitignore: bool=False,
+         threads: int=DEFAULT_SCAN_THREADS) -> Iterator[ScanEntry]:
+    """
+    Yield everything under SOURCES.
+
+    Each of SOURCES is scanned in turn under its own name. See
+    Scanner for the other arguments.
+    """
+    scanner = Scanner(exclude, include, gitignore=gitignore, threads=threads)
+    for source in sources:
+        yield from scanner.scan(source)
@@ -0,0 +1,147 @@
+"""
+Cron-style schedules.
+
+A schedule is written as in crontab(5): five fields for the
+minute, hour, day of the month, month and day of the week, each
+of which is '*', a number, a range 'a-b', a step '*/n' or 'a-b/n',
+or a comma-separated list of these. Months and days of the week
+can also be given by their English abbreviations. The aliases
+@hourly, @daily, @weekly, @monthly and @yearly are accepted too.
+
+As in cron, if both the day of the month and the day of the week
+are restricted, a time matches if either of them does.
+"""
+
+from __future__ import annotations
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+__all__ = [
+    # Classes
+    'Schedule',
+]
+
+_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *'
+}
+
+_MONTHS = ['jan', 'feb', 'mar', 'apr', 'may', 'jun',
+           'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+_DAYS = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+
+class _Field(NamedTuple):
+    low: int
+    high: int
+    names: list[str]
+    offset: int
+
+_FIELDS = [
+    _Field(0, 59, [], 0),       # minute
+    _Field(0, 23, [], 0),       # hour
+    _Field(1, 31, [], 0),       # day of the month
+    _Field(1, 12, _MONTHS, 1),  # month
+    _Field(0, 7, _DAYS, 0)      # day of the week, 0 and 7 are Sunday
+]
+
+def _parse_value(text: str, field: _Field) -> int:
+    lower = text.lower()
+    if lower in field.names:
+        return field.names.index(lower) + field.offset
+
+    value = int(text)
+    if not field.low <= value <= field.high:
+        raise ValueError(f"{value} is out of range {field.low}-{field.high}")
+    return value
+
+def _parse_field(text: str, field: _Field) -> frozenset[int]:
+    values: set[int] = set()
+    for part in text.split(','):
+        expr, _, step_text = part.partition('/')
+        step = int(step_text) if step_text else 1
+        if step < 1:
+            raise ValueError(f"invalid step in '{part}'")
+
+        if expr == '*':
+            low, high = field.low, field.high
+        elif '-' in expr:
+            first, _, last = expr.partition('-')
+            low, high = _parse_value(first, field), _parse_value(last, field)
+        else:
+            low = _parse_value(expr, field)
+            high = field.high if step_text else low
+
+        if low > high:
+            raise ValueError(f"invalid range '{expr}'")
+        values.update(range(low, high + 1, step))
+
+    return frozenset(values)
+
+class Schedule:
+    """A parsed cron expression."""
+
+    def __init__(self, expr: str):
+        """
+        Parse the cron expression EXPR.
+
+        ValueError is raised if it is invalid.
+        """
+        self.expr = expr
+        fields = _ALIASES.get(expr.strip().lower(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"invalid schedule '{expr}': expected 5 fields")
+
+        try:
+            parsed = [_parse_field(text, field) for text, field in zip(fields, _FIELDS)]
+        except ValueError as exc:
+            raise ValueError(f"invalid schedule '{expr}': {exc}") from None
+
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        # Sunday is 0 or 7; Python counts Monday as 0
+        self.weekdays = frozenset((day - 1) % 7 for day in weekdays)
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def __repr__(self) -> str:
+        return f"Schedule({self.expr!r})"
+
+    def _day_matches(self, when: datetime) -> bool:
+        day = when.day in self.days
+        weekday = when.weekday() in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def matches(self, when: datetime) -> bool:
+        """Whether the minute of WHEN is in the schedule."""
+        return when.minute in self.minutes and when.hour in self.hours \
+            and when.month in self.months and self._day_matches(when)
+
+    def next_after(self, when: datetime) -> datetime:
+        """
+        Return the first minute in the schedule after WHEN.
+
+        ValueError is raised if there is none in the next
+        five years, e.g. for February 30.
+        """
+        t = when.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                # Skip to the first day of the next month
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+
+        raise ValueError(f"schedule '{self.expr}' never matches")
@@ -0,0 +1,514 @@
+"""
+Deduplicating chunk stores.
+
+A chunk store keeps backups as snapshots of files that are
+split into chunks by content (see jbackup.store.chunker). Each
+chunk is addressed by its BLAKE2 hash and stored once, no matter
+how many files or snapshots contain it, so a new snapshot only
+writes the chunks that are not already in the store.
+
+A store is a directory with this layout:
+
+    config              the store's version and chunk sizes
+    packs/ID.pack       chunks, appended one after another
+    packs/ID.idx        the hash, offset and length of each chunk in ID.pack
+    snapshots/RULE/NAME.jsonl
+                        a manifest of a snapshot, with the chunks and permission
+                        bits of each file, and its directories and symbolic links
+
+A pack is written under a temporary name and renamed once it is
+complete, and its index is written after it. A pack without an
+index is ignored, so an interrupted backup leaves the store as it
+was.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from .chunker import chunk_stream, MIN_CHUNK_SIZE, AVG_CHUNK_SIZE, MAX_CHUNK_SIZE
+from ..manifest import Manifest, ManifestEntry, new_hash
+import os, json, stat, struct, zlib, threading, time
+
+if TYPE_CHECKING:
+    from typing import BinaryIO, Iterable, Iterator, Optional
+    from concurrent.futures import Executor, Future
+
+__all__ = [
+    # Classes
+    'ChunkStore',
+    'Snapshot',
+    'SnapshotMember',
+    'SnapshotStats',
+    'StoreError',
+
+    # Functions
+    'list_snapshots',
+    'read_snapshot',
+
+    # Variables
+    'DEFAULT_PACK_SIZE'
+]
+
+DEFAULT_PACK_SIZE = 32 * 1024 * 1024
+
+_STORE_VERSION = 1
+# Version 1 snapshots only have regular files, without their modes
+_SNAPSHOT_VERSION = 2
+
+# A pack index is a header followed by one entry per chunk:
+# the digest, its offset and length in the pack, and flags
+_IDX_MAGIC = b'JBIDX\x00\x00\x01'
+_IDX_ENTRY = struct.Struct('<32sQIB')
+
+_FLAG_ZLIB = 1
+
+# Chunks read ahead of the one being returned
+_READ_AHEAD = 16
+
+class StoreError(Exception):
+    """Raised when a chunk store is missing, invalid or damaged."""
+
+class _Location(NamedTuple):
+    pack: str
+    offset: int
+    length: int
+    flags: int
+
+class SnapshotStats(NamedTuple):
+    """Statistics about a new snapshot."""
+
+    files: int
+    bytes_in: int
+    unchanged: int
+    new_chunks: int
+    new_bytes: int
+
+class SnapshotMember(NamedTuple):
+    """A directory or symbolic link in a snapshot."""
+
+    path: str
+    kind: str
+    mode: int
+    mtime_ns: int
+    target: str = ''
+
+    @property
+    def is_dir(self) -> bool:
+        return self.kind == 'dir'
+
+    @property
+    def is_symlink(self) -> bool:
+        return self.kind == 'symlink'
+
+class Snapshot:
+    """The files of a backup and the chunks they are made of."""
+
+    def __init__(self, rule: str, name: str, manifest: Optional[Manifest]=None,
+                 chunks: Optional[dict[str, list[str]]]=None,
+                 modes: Optional[dict[str, int]]=None,
+                 members: Optional[dict[str, SnapshotMember]]=None):
+        """
+        Make the snapshot NAME of RULE.
+
+        MANIFEST lists its regular files, CHUNKS their chunks and
+        MODES their permission bits; MEMBERS are its directories
+        and symbolic links, which have no contents in the store.
+        """
+        self.rule = rule
+        self.name = name
+        self.manifest = manifest or Manifest()
+        self.chunks: dict[str, list[str]] = chunks or {}
+        self.modes: dict[str, int] = modes or {}
+        self.members: dict[str, SnapshotMember] = members or {}
+
+    def add(self, entry: ManifestEntry, chunks: list[str], mode: Optional[int]=None) -> None:
+        """Add the file ENTRY, made of CHUNKS, with the permission bits MODE."""
+        self.manifest.entries[entry.path] = entry
+        self.chunks[entry.path] = chunks
+        if mode is not None:
+            self.modes[entry.path] = mode
+
+    def add_member(self, member: SnapshotMember) -> None:
+        """Add the directory or symbolic link MEMBER."""
+        self.members[member.path] = member
+
+    @classmethod
+    def load(cls, filename: str | Path) -> Snapshot:
+        """
+        Read a snapshot from FILENAME.
+
+        OSError is raised if it cannot be read, and ValueError
+        if it is not a valid snapshot.
+        """
+        with open(filename, 'rt') as fd:
+            header = json.loads(fd.readline() or 'null')
+            if not isinstance(header, dict) or header.get('version') not in (1, _SNAPSHOT_VERSION):
+                raise ValueError(f"{filename} is not a snapshot")
+            snapshot = cls(header['rule'], header['name'])
+            for line in fd:
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    snapshot.add_member(SnapshotMember(**record))
+                    continue
+                if header['version'] == 1:
+                    record.append(None)
+                *fields, digests, mode = record
+                snapshot.add(ManifestEntry(*fields), digests, mode)
+
+        return snapshot
+
+    def save(self, filename: str | Path) -> None:
+        """Write the snapshot to FILENAME, replacing it atomically."""
+        filename = Path(filename)
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        tmpfile = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmpfile, 'wt') as fd:
+                header = {'version': _SNAPSHOT_VERSION, 'rule': self.rule, 'name': self.name}
+                fd.write(json.dumps(header) + '\n')
+                for entry in self.manifest:
+                    record = [*entry, self.chunks[entry.path], self.modes.get(entry.path)]
+                    fd.write(json.dumps(record) + '\n')
+                for member in self.members.values():
+                    fd.write(json.dumps(member._asdict()) + '\n')
+            os.replace(tmpfile, filename)
+        except BaseException:
+            tmpfile.unlink(missing_ok=True)
+            raise
+
+class ChunkStore:
+    """A directory of deduplicated chunks and the snapshots made of them."""
+
+    def __init__(self, root: str | Path, *, create: bool=False,
+                 pack_size: int=DEFAULT_PACK_SIZE, compress_level: int=6):
+        """
+        Open the chunk store at ROOT.
+
+        If CREATE is true, the store is created if it does not exist;
+        otherwise StoreError is raised. New chunks are compressed
+        with zlib at COMPRESS_LEVEL, or not at all if it is 0, and
+        packs are closed once they reach PACK_SIZE bytes.
+
+        The store is locked until it is closed, so only one
+        process writes to it at a time.
+        """
+        import fcntl
+
+        self.root = Path(root).expanduser()
+        self.pack_size = pack_size
+        self.compress_level = compress_level
+
+        config = self.root / 'config'
+        if not config.exists():
+            if not create:
+                raise StoreError(f"{self.root} is not a chunk store")
+            (self.root / 'packs').mkdir(parents=True, exist_ok=True)
+            (self.root / 'snapshots').mkdir(exist_ok=True)
+            config.write_text(json.dumps({
+                'version': _STORE_VERSION,
+                'chunker': [MIN_CHUNK_SIZE, AVG_CHUNK_SIZE, MAX_CHUNK_SIZE]
+            }))
+
+        try:
+            settings = json.loads(config.read_text())
+            if settings['version'] != _STORE_VERSION:
+                raise StoreError(f"{self.root}: unsupported version {settings['version']}")
+            self.chunk_sizes: tuple[int, int, int] = tuple(settings['chunker'])
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            raise StoreError(f"{self.root}: invalid config: {exc}") from exc
+
+        self._lockfd = os.open(self.root / 'lock', os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._lockfd, fcntl.LOCK_EX)
+
+        self._index: dict[bytes, _Location] = {}
+        self._pending: dict[bytes, _Location] = {}
+        self._pack: Optional[BinaryIO] = None
+        self._pack_id = ""
+        # Packs open for reading, shared by the threads that read chunks
+        self._packfds: dict[str, int] = {}
+        self._packlock = threading.Lock()
+        self._load_index()
+
+    def __enter__(self) -> ChunkStore:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._index) + len(self._pending)
+
+    def _load_index(self) -> None:
+        for idxfile in (self.root / 'packs').glob('*.idx'):
+            pack = idxfile.stem
+            data = idxfile.read_bytes()
+            if data[:len(_IDX_MAGIC)] != _IDX_MAGIC:
+                raise StoreError(f"{idxfile} is not a pack index")
+            body = memoryview(data)[len(_IDX_MAGIC):]
+            for digest, offset, length, flags in _IDX_ENTRY.iter_unpack(body):
+                self._index[digest] = _Location(pack, offset, length, flags)
+
+    def has(self, digest: bytes) -> bool:
+        """Whether the chunk with the hash DIGEST is in the store."""
+        return digest in self._index or digest in self._pending
+
+    def put(self, data: bytes) -> tuple[bytes, bool]:
+        """
+        Store the chunk DATA.
+
+        Return its hash, and whether the chunk was new to the
+        store. A chunk that is already stored is not written again.
+        """
+        h = new_hash()
+        h.update(data)
+        digest = h.digest()
+        if self.has(digest):
+            return digest, False
+
+        flags = 0
+        if self.compress_level:
+            packed = zlib.compress(data, self.compress_level)
+            if len(packed) < len(data):
+                data, flags = packed, _FLAG_ZLIB
+
+        if self._pack is None:
+            self._pack_id = os.urandom(8).hex()
+            self._pack = open(self.root / 'packs' / f"{self._pack_id}.pack.tmp", 'wb')
+
+        offset = self._pack.tell()
+        self._pack.write(data)
+        self._pending[digest] = _Location(self._pack_id, offset, len(data), flags)
+
+        if offset + len(data) >= self.pack_size:
+            self.flush()
+
+        return digest, True
+
+    def _packfd(self, pack: str) -> int:
+        with self._packlock:
+            fd = self._packfds.get(pack)
+            if fd is None:
+                fd = os.open(self.root / 'packs' / f"{pack}.pack", os.O_RDONLY | os.O_CLOEXEC)
+                self._packfds[pack] = fd
+            return fd
+
+    def get(self, digest: bytes) -> bytes:
+        """
+        Return the chunk with the hash DIGEST.
+
+        KeyError is raised if it is not in the store, and
+        StoreError if it is damaged. Chunks can be read by
+        several threads at once.
+        """
+        if digest in self._pending:
+            self.flush()
+
+        loc = self._index[digest]
+        data = os.pread(self._packfd(loc.pack), loc.length, loc.offset)
+        if len(data) != loc.length:
+            raise StoreError(f"pack {loc.pack} is truncated")
+        if loc.flags & _FLAG_ZLIB:
+            data = zlib.decompress(data)
+
+        h = new_hash()
+        h.update(data)
+        if h.digest() != digest:
+            raise StoreError(f"chunk {digest.hex()} in pack {loc.pack} is damaged")
+
+        return data
+
+    def flush(self) -> None:
+        """Finish the pack being written, so that its chunks are in the index."""
+        if self._pack is None:
+            return
+
+        pack, self._pack = self._pack, None
+        packdir = self.root / 'packs'
+        pack.flush()
+        os.fsync(pack.fileno())
+        pack.close()
+        os.replace(packdir / f"{self._pack_id}.pack.tmp", packdir / f"{self._pack_id}.pack")
+
+        idxfile = packdir / f"{self._pack_id}.idx"
+        tmpfile = idxfile.with_name(idxfile.name + '.tmp')
+        with open(tmpfile, 'wb') as fd:
+            fd.write(_IDX_MAGIC)
+            for digest, loc in self._pending.items():
+                fd.write(_IDX_ENTRY.pack(digest, loc.offset, loc.length, loc.flags))
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmpfile, idxfile)
+
+        self._index.update(self._pending)
+        self._pending.clear()
+
+    def close(self) -> None:
+        """Flush the store and release its lock."""
+        if self._lockfd < 0:
+            return
+
+        try:
+            self.flush()
+        finally:
+            for fd in self._packfds.values():
+                os.close(fd)
+            self._packfds.clear()
+            os.close(self._lockfd)
+            self._lockfd = -1
+
+    def write_file(self, fileobj: BinaryIO) -> tuple[list[str], str, int, int]:
+        """
+        Store the contents of FILEOBJ.
+
+        Return the hashes of its chunks, the hash of the whole
+        contents, and the number of new chunks and of new bytes.
+        """
+        chunks: list[str] = []
+        filehash = new_hash()
+        new_chunks = new_bytes = 0
+        for data in chunk_stream(fileobj, *self.chunk_sizes):
+            filehash.update(data)
+            digest, new = self.put(data)
+            chunks.append(digest.hex())
+            if new:
+                new_chunks += 1
+                new_bytes += len(data)
+
+        return chunks, filehash.hexdigest(), new_chunks, new_bytes
+
+    def read_file(self, snapshot: Snapshot, path: str, *,
+                  pool: Optional[Executor]=None) -> Iterator[bytes]:
+        """
+        Yield the chunks of the file PATH in SNAPSHOT, in order.
+
+        If POOL is given, the chunks ahead of the one being read
+        are read and decompressed on it.
+        """
+        if pool is None:
+            for digest in snapshot.chunks[path]:
+                yield self.get(bytes.fromhex(digest))
+            return
+
+        from collections import deque
+
+        pending: deque[Future[bytes]] = deque()
+        for digest in snapshot.chunks[path]:
+            pending.append(pool.submit(self.get, bytes.fromhex(digest)))
+            if len(pending) >= _READ_AHEAD:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def snapshot(self, rule: str, sources: Iterable[Path], *,
+                 exclude: Iterable[str]=(),
+                 include: Iterable[str]=(),
+                 gitignore: bool=False,
+                 previous: Optional[Snapshot]=None) -> tuple[Snapshot, SnapshotStats]:
+        """
+        Store the files under SOURCES as a new snapshot of RULE.
+
+        Each of SOURCES is added recursively under its own name.
+        Regular files are stored with their permission bits, and
+        directories and symbolic links are recorded as members.
+        EXCLUDE, INCLUDE and GITIGNORE select the files, as in
+        jbackup.scan.Scanner. Files that are unchanged since PREVIOUS, judging
+        by their stat results alone, are not read; their chunks are
+        taken from PREVIOUS. The time taken therefore depends on the
+        amount of changed data, not on the size of the sources.
+
+        The snapshot is saved under the current time and returned
+        with statistics about it.
+        """
+        from ..scan import Scanner
+
+        stamp = name = time.strftime('%Y%m%d-%H%M%S')
+        n = 1
+        while self._snapshot_file(rule, name).exists():
+            name = f"{stamp}.{n}"
+            n += 1
+
+        snapshot = Snapshot(rule, name)
+        scanner = Scanner(exclude, include, gitignore=gitignore)
+        files = bytes_in = unchanged = new_chunks = new_bytes = 0
+
+        for source in sources:
+            for entry in scanner.scan(source):
+                path, name, st = entry
+                mode = stat.S_IMODE(st.st_mode)
+                if entry.is_dir:
+                    snapshot.add_member(SnapshotMember(name, 'dir', mode, st.st_mtime_ns))
+                    continue
+                if stat.S_ISLNK(st.st_mode):
+                    snapshot.add_member(SnapshotMember(name, 'symlink', mode, st.st_mtime_ns,
+                                                       os.readlink(path)))
+                    continue
+                if not entry.is_file:
+                    continue
+
+                if previous is not None and previous.manifest.is_unchanged(name, st):
+                    snapshot.add(previous.manifest.entries[name], previous.chunks[name], mode)
+                    unchanged += 1
+                    continue
+
+                with open(path, 'rb') as fd:
+                    chunks, digest, nchunks, nbytes = self.write_file(fd) # pyright: ignore
+                snapshot.add(ManifestEntry(name, st.st_size, st.st_mtime_ns,
+                                           st.st_ino, digest), chunks, mode)
+                files += 1
+                bytes_in += st.st_size
+                new_chunks += nchunks
+                new_bytes += nbytes
+
+        # The chunks must be indexed before a snapshot refers to them
+        self.flush()
+        snapshot.save(self._snapshot_file(rule, snapshot.name))
+
+        return snapshot, SnapshotStats(files, bytes_in, unchanged, new_chunks, new_bytes)
+
+    def _snapshot_file(self, rule: str, name: str) -> Path:
+        return _snapshot_file(self.root, rule, name)
+
+    def snapshots(self, rule: str) -> list[str]:
+        """Return the names of the snapshots of RULE, oldest first."""
+        return list_snapshots(self.root, rule)
+
+    def load_snapshot(self, rule: str, name: Optional[str]=None) -> Optional[Snapshot]:
+        """
+        Return the snapshot NAME of RULE, or the latest if NAME is None.
+
+        None is returned if there is no such snapshot.
+        """
+        return read_snapshot(self.root, rule, name)
+
+def _snapshot_file(root: Path, rule: str, name: str) -> Path:
+    return root / 'snapshots' / rule / f"{name}.jsonl"
+
+def list_snapshots(root: str | Path, rule: str) -> list[str]:
+    """
+    Return the names of the snapshots of RULE in the store ROOT, oldest first.
+
+    Unlike ChunkStore.snapshots(), the store is not opened,
+    so this does not wait for a backup that is writing to it.
+    """
+    return sorted(f.stem for f in (Path(root).expanduser() / 'snapshots' / rule).glob('*.jsonl'))
+
+def read_snapshot(root: str | Path, rule: str, name: Optional[str]=None) -> Optional[Snapshot]:
+    """
+    Return the snapshot NAME of RULE in the store ROOT, or the latest if NAME is None.
+
+    The store is not opened (see list_snapshots()). None is
+    returned if there is no such snapshot, and StoreError is
+    raised if it cannot be read.
+    """
+    if name is None:
+        names = list_snapshots(root, rule)
+        if not names:
+            return None
+        name = names[-1]
+
+    try:
+        return Snapshot.load(_snapshot_file(Path(root).expanduser(), rule, name))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        raise StoreError(f"snapshot {rule}/{name}: {exc}") from exc
@@ -0,0 +1,154 @@
+"""
+Content-defined chunking.
+
+Files are split at positions chosen by their content rather
+than by their offset, using a gear hash: a rolling hash whose
+window is the last 64 bytes. A chunk ends where the top bits
+of the hash are all zero. Inserting or removing bytes in a
+file only changes the chunks around the edit; the boundaries
+after it are found again, so the chunks that follow are the
+same as before and need not be stored twice.
+
+With numpy installed, the hash of every position of a block
+is computed in a few vector operations, which is many times
+faster than hashing one byte at a time in Python, as is done
+without numpy. Both find the same boundaries.
+"""
+
+from __future__ import annotations
+from functools import cache
+from typing import TYPE_CHECKING
+import random
+
+if TYPE_CHECKING:
+    from typing import BinaryIO, Iterator
+
+__all__ = [
+    # Functions
+    'chunk_stream',
+    'find_boundary',
+
+    # Variables
+    'AVG_CHUNK_SIZE',
+    'MAX_CHUNK_SIZE',
+    'MIN_CHUNK_SIZE'
+]
+
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+
+_MASK64 = (1 << 64) - 1
+
+# The table must never change, or the chunks of existing stores
+# would no longer match those of new files
+_rng = random.Random(0x6a6261636b7570)
+_GEAR = tuple(_rng.getrandbits(64) for _ in range(256))
+del _rng
+
+# Positions hashed at a time when numpy is available
+_SEARCH_BLOCK = 64 * 1024
+
+# The window of the hash; older bytes are shifted out of it
+_WINDOW = 64
+
+def _boundary_mask(avg_size: int) -> int:
+    # The top log2(AVG_SIZE) bits of the hash
+    bits = max(avg_size.bit_length() - 1, 1)
+    return ((1 << bits) - 1) << (64 - bits)
+
+@cache
+def _numpy_gear():
+    # The gear table as a numpy array, or None without numpy
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy.array(_GEAR, dtype=numpy.uint64)
+
+def _search_python(data: bytes | bytearray | memoryview, start: int, end: int,
+                   mask: int) -> int:
+    gear = _GEAR
+    h = 0
+    for i in range(start, end):
+        h = ((h << 1) + gear[data[i]]) & _MASK64
+        if not h & mask:
+            return i + 1
+
+    return end
+
+def _search_numpy(data: bytes | bytearray | memoryview, start: int, end: int,
+                  mask: int) -> int:
+    import numpy
+
+    gear = _numpy_gear()
+    umask = numpy.uint64(mask)
+    pos = start
+    while pos < end:
+        # Start the block with the window before its first position,
+        # but none of the bytes before START, which the hash skips
+        first = max(start, pos - _WINDOW + 1)
+        stop = min(pos + _SEARCH_BLOCK, end)
+        h = gear[numpy.frombuffer(data, numpy.uint8, stop - first, first)]
+
+        # After the step with shift S, h[i] is the hash of the
+        # 2*S bytes up to i
+        shift = 1
+        while shift < _WINDOW:
+            h[shift:] += h[:-shift] << numpy.uint64(shift)
+            shift *= 2
+
+        found = numpy.flatnonzero((h[pos - first:] & umask) == 0)
+        if len(found):
+            return pos + int(found[0]) + 1
+        pos = stop
+
+    return end
+
+def find_boundary(data: bytes | bytearray | memoryview, min_size: int=MIN_CHUNK_SIZE,
+                  avg_size: int=AVG_CHUNK_SIZE, max_size: int=MAX_CHUNK_SIZE) -> int:
+    """
+    Return the length of the first chunk of DATA.
+
+    The chunk is at least MIN_SIZE and at most MAX_SIZE bytes long,
+    unless DATA is shorter. Past MIN_SIZE, a boundary is found
+    once in about AVG_SIZE bytes.
+    """
+    size = len(data)
+    if size <= min_size:
+        return size
+
+    mask = _boundary_mask(avg_size)
+    end = min(size, max_size)
+    if _numpy_gear() is not None:
+        return _search_numpy(data, min_size, end, mask)
+    return _search_python(data, min_size, end, mask)
+
+def chunk_stream(fileobj: BinaryIO, min_size: int=MIN_CHUNK_SIZE,
+                 avg_size: int=AVG_CHUNK_SIZE,
+                 max_size: int=MAX_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Split the contents of FILEOBJ into chunks.
+
+    The chunks are yielded in order; see find_boundary() for the
+    meaning of MIN_SIZE, AVG_SIZE and MAX_SIZE.
+    """
+    if not 0 < min_size <= avg_size <= max_size:
+        raise ValueError(f"invalid chunk sizes {min_size}, {avg_size}, {max_size}")
+
+    buf = bytearray()
+    eof = False
+    while True:
+        # Keep at least one maximum-sized chunk in the buffer
+        while not eof and len(buf) < max_size:
+            data = fileobj.read(max_size)
+            if not data:
+                eof = True
+            buf += data
+
+        if not buf:
+            return
+
+        cut = find_boundary(buf, min_size, avg_size, max_size)
+        yield bytes(buf[:cut])
+        del buf[:cut]
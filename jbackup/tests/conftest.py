@@ -0,0 +1,51 @@
+from __future__ import annotations
+from pathlib import Path
+import pytest, random
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Keep the caches of each test in its own directory."""
+    _dir = tmp_path / 'cache'
+    monkeypatch.setenv('JBACKUP_CACHE_DIR', str(_dir))
+    return _dir
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Keep the state of each test in its own directory."""
+    _dir = tmp_path / 'state'
+    monkeypatch.setenv('JBACKUP_STATE_DIR', str(_dir))
+    return _dir
+
+@pytest.fixture(autouse=True)
+def runtime_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Keep the daemon socket of each test in its own directory."""
+    _dir = tmp_path / 'run'
+    monkeypatch.setenv('JBACKUP_RUNTIME_DIR', str(_dir))
+    return _dir
+
+def random_bytes(size: int, seed: int=0) -> bytes:
+    """Return SIZE bytes that do not compress, the same for each SEED."""
+    return random.Random(seed).randbytes(size)
+
+@pytest.fixture
+def tree_files() -> dict[str, str | bytes]:
+    """
+    The files of the tree fixture, by their path in it.
+
+    Test modules override this fixture for a tree of their own.
+    """
+    return {'a.txt': "a" * 1000, 'sub/b.bin': random_bytes(100000, 2)}
+
+@pytest.fixture
+def tree(tmp_path: Path, tree_files: dict[str, str | bytes]) -> Path:
+    """A directory named 'tree' that holds TREE_FILES."""
+    root = tmp_path / 'tree'
+    root.mkdir()
+    for name, contents in tree_files.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(contents, str):
+            path.write_text(contents)
+        else:
+            path.write_bytes(contents)
+    return root
@@ -99,3 +99,199 @@ class TestProperties:
         assert prop.doc
         with pytest.raises(UndefinedProperty):
             prop.value = None
+
+def test_action_cache():
+    from ..actions import _action_classes
+    from ..loader import load_module_from_file
+
+    f = Path(__file__).parent / '_testaction.py'
+    _action_classes.clear()
+    cls = load_action(f, 'testaction')
+    assert load_action(f, 'testaction') is cls
+
+    # The class name is cached with the module's code
+    _action_classes.clear()
+    module = load_module_from_file(f, 'testaction')
+    assert module.metadata['action_class'] == 'Action_Test'
+    assert load_action(f, 'testaction').__name__ == 'Action_Test'
+
+class TestStaticInfo:
+    def test_read_action_info(self):
+        from ..actions import read_action_info
+        info = read_action_info(Path(__file__).parent / '_testaction.py')
+        assert info is not None
+        assert info.name == 'Action_Test'
+        assert [prop.name for prop in info.properties] == ['message', 'extra-message']
+        assert str(info.properties[1]).endswith("(optional)")
+
+    def test_no_exec(self, tmp_path: Path):
+        from ..actions import read_action_info, get_action_info
+        f = tmp_path / 'action.py'
+        f.write_text('''
+raise RuntimeError("must not run")
+
+class Action_Foo:
+    """Does foo.
+
+    More about foo."""
+
+    properties = [
+        ActionProperty('path', '', types=[PropertyType.STRING], doc="a path")
+    ]
+''')
+        info = read_action_info(f)
+        assert info is not None
+        assert info.summary == "Does foo."
+        assert info.properties[0].doc == "a path"
+        assert "STRING path" in get_action_info(info)
+
+    def test_not_static(self, tmp_path: Path):
+        from ..actions import read_action_info
+        f = tmp_path / 'action.py'
+        f.write_text('''
+class Action_Foo:
+    properties = [ActionProperty('path', Path('.'))]
+''')
+        assert read_action_info(f) is None
+
+    def test_standard_property(self, tmp_path: Path):
+        from ..actions import read_action_info
+        f = tmp_path / 'action.py'
+        f.write_text('''
+class Action_Foo:
+    properties = [ActionProperty.standard('incremental')]
+''')
+        info = read_action_info(f)
+        assert info is not None
+        assert info.properties[0].name == 'incremental'
+        assert info.properties[0].value is False
+
+class TestRunner:
+    @pytest.fixture
+    def rulefile(self) -> Path:
+        return Path(__file__).parent / '_testrule.toml'
+
+    def test_run_rules(self, rulefile: Path):
+        from ..actions.runner import run_rules
+        f = Path(__file__).parent / '_testaction.py'
+        rules = [('one', rulefile), ('two', rulefile), ('three', rulefile)]
+
+        for jobs in (1, 2):
+            results = run_rules(f, 'test', rules, jobs)
+            assert [r.rule for r in results] == ['one', 'two', 'three']
+            assert all(r.ok for r in results)
+
+    def test_failures(self, tmp_path: Path, rulefile: Path):
+        from ..actions.runner import run_rules
+        f = tmp_path / 'fail.py'
+        f.write_text('''
+class Action_Fail:
+    properties = []
+
+    def __init__(self, rule):
+        self.rule = rule
+
+    def run(self):
+        raise RuntimeError("failed")
+''')
+        rules = [('one', rulefile), ('missing', tmp_path / 'missing.toml')]
+
+        for jobs in (1, 2):
+            results = run_rules(f, 'fail', rules, jobs)
+            assert [r.code for r in results] == [1, 1]
+            assert results[0].error == "RuntimeError: failed"
+
+class TestBatch:
+    @pytest.fixture
+    def datapaths(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+        from .. import _index
+        from .._path import DATAPATHS
+
+        monkeypatch.setattr(_index, '_indexes', {})
+        for where in ('system', 'user', 'builtin'):
+            (tmp_path / where / 'rules').mkdir(parents=True)
+            monkeypatch.setitem(DATAPATHS, where, tmp_path / where)
+
+        rules = tmp_path / 'user' / 'rules'
+        (rules / 'repos-a.toml').write_text('tags = ["nightly"]\n[test]\nmessage = "a"\n')
+        (rules / 'repos-b.toml').write_text('[test]\nmessage = "b"\n')
+        (rules / 'other.toml').write_text('tags = ["nightly"]\n[copy]\nx = 1\n')
+        (tmp_path / 'system' / 'rules' / 'repos-b.toml').write_text('[test]\nmessage = "b"\n')
+        return tmp_path
+
+    def test_select(self, datapaths: Path):
+        from ..actions.runner import select_rules
+
+        rules, missing = select_rules(['repos-*'], 'test')
+        assert rules == [('repos-a', datapaths / 'user' / 'rules' / 'repos-a.toml'),
+                         ('repos-b', datapaths / 'system' / 'rules' / 'repos-b.toml')]
+        assert missing == []
+
+        rules, _ = select_rules(['@nightly'], 'test')
+        assert [name for name, _ in rules] == ['other', 'repos-a']
+
+        rules, missing = select_rules(['other', 'nope-*', 'nope'], 'test', all_rules=True)
+        assert [name for name, _ in rules] == ['other', 'repos-a', 'repos-b']
+        assert missing == ['nope-*', 'nope']
+
+    def test_batch_hook(self, tmp_path: Path):
+        from ..actions.runner import run_rules
+        rulefile = Path(__file__).parent / '_testrule.toml'
+        log = tmp_path / 'log'
+        f = tmp_path / 'batch.py'
+        f.write_text(f'''
+import contextlib
+
+class Action_Batch:
+    properties = []
+    shared = None
+
+    def __init__(self, rule):
+        self.rule = rule
+
+    @classmethod
+    @contextlib.contextmanager
+    def batch(cls, rules):
+        with open({str(log)!r}, 'a') as fd:
+            fd.write(f"setup {{len(rules)}}\\n")
+        cls.shared = "shared"
+        yield
+        with open({str(log)!r}, 'a') as fd:
+            fd.write("teardown\\n")
+
+    def run(self):
+        assert self.shared == "shared"
+''')
+        rules = [('one', rulefile), ('two', rulefile), ('three', rulefile)]
+        results = run_rules(f, 'batch', rules)
+        assert all(r.ok for r in results)
+        assert log.read_text() == "setup 3\nteardown\n"
+
+        log.unlink()
+        results = run_rules(f, 'batch', rules, 2)
+        assert all(r.ok for r in results), results
+        lines = log.read_text().splitlines()
+        assert lines.count("teardown") == lines.count("setup 3") >= 1
+
+def test_async_action(tmp_path: Path):
+    from ..actions.runner import run_rules
+
+    out = tmp_path / 'out'
+    f = tmp_path / 'copier.py'
+    f.write_text(f'''
+from jbackup.pipeline import run_pipeline, stage
+
+class Action_Copier:
+    properties = []
+
+    def __init__(self, rule):
+        self.rule = rule
+
+    async def run_async(self):
+        with open({str(out)!r}, 'w') as fd:
+            await run_pipeline(["a", "b", "c"], stage(str.upper), sink=fd.write)
+''')
+    rulefile = Path(__file__).parent / '_testrule.toml'
+    results = run_rules(f, 'copier', [('one', rulefile)])
+    assert results[0].ok, results[0].error
+    assert out.read_text() == "ABC"
@@ -0,0 +1,266 @@
+from __future__ import annotations
+from ..archive import write_archive, ChunkedWriter, CODECS
+from .._path import DATAPATHS
+from pathlib import Path
+import pytest, tarfile, io
+
+@pytest.fixture
+def tree_files() -> dict[str, str | bytes]:
+    return {'a.txt': "a" * 1000, 'sub/b.bin': bytes(range(256)) * 100, 'sub/skip.log': "log"}
+
+class _RecordingFile(io.BytesIO):
+    def __init__(self):
+        super().__init__()
+        self.sizes: list[int] = []
+
+    def write(self, data) -> int: # pyright: ignore
+        self.sizes.append(len(data))
+        return super().write(data)
+
+def test_chunked_writer():
+    fd = _RecordingFile()
+    writer = ChunkedWriter(fd, 4)
+    writer.write(b'abc')
+    writer.write(b'defghij')
+    assert fd.sizes == [4, 4]
+    writer.close()
+    assert fd.sizes == [4, 4, 2]
+    assert fd.getvalue() == b'abcdefghij'
+    assert not fd.closed
+
+@pytest.mark.parametrize('codec', list(CODECS))
+def test_write_archive(tree: Path, codec: str):
+    fd = _RecordingFile()
+    stats = write_archive(fd, [tree], codec=codec, chunk_size=512, exclude=['*.log'])
+    assert stats.files == 2
+    assert stats.bytes_in == 1000 + 25600
+    assert stats.bytes_out == len(fd.getvalue())
+    assert max(fd.sizes) <= 512
+
+    fd.seek(0)
+    with tarfile.open(fileobj=fd, mode='r:*') as tar:
+        names = tar.getnames()
+        member = tar.extractfile('tree/sub/b.bin')
+        assert member is not None and member.read() == bytes(range(256)) * 100
+
+    assert 'tree/a.txt' in names
+    assert 'tree/sub/skip.log' not in names
+
+def test_invalid_codec(tree: Path):
+    with pytest.raises(ValueError):
+        write_archive(io.BytesIO(), [tree], codec='zip')
+
+def test_archive_action(tree: Path, tmp_path: Path):
+    from ..actions import load_action
+    from ..rules import Rule
+
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    rulefile = tmp_path / 'myrule.toml'
+    rulefile.write_text(f"""[archive]
+sources = ["@type path {tree}"]
+destination = "@type path {dest}"
+codec = "xz"
+""")
+
+    cls = load_action(DATAPATHS['builtin'] / 'actions' / 'archive.py', 'archive')
+    cls(Rule(str(rulefile))).run()
+
+    archives = list(dest.iterdir())
+    assert len(archives) == 1
+    assert archives[0].name.startswith('myrule-')
+    assert archives[0].name.endswith('.tar.xz')
+    with tarfile.open(archives[0]) as tar:
+        assert 'tree/sub/skip.log' in tar.getnames()
+
+class TestParallel:
+    DATA = b"".join(b"line %d of some compressible data\n" % i for i in range(100000))
+
+    @pytest.mark.parametrize('codec', ['gz', 'bz2', 'xz'])
+    def test_roundtrip(self, codec: str):
+        import gzip, bz2, lzma
+        from ..archive import ParallelCompressor
+
+        fd = io.BytesIO()
+        comp = ParallelCompressor(fd, codec, 1, threads=3, block_size=65536)
+        for i in range(0, len(self.DATA), 10000):
+            comp.write(self.DATA[i:i + 10000])
+        comp.close()
+
+        decompress = {'gz': gzip.decompress, 'bz2': bz2.decompress,
+                      'xz': lzma.decompress}[codec]
+        assert decompress(fd.getvalue()) == self.DATA
+        assert not fd.closed
+
+    def test_empty(self):
+        import gzip
+        from ..archive import ParallelCompressor
+
+        fd = io.BytesIO()
+        ParallelCompressor(fd, 'gz', 6, threads=2).close()
+        assert gzip.decompress(fd.getvalue()) == b""
+
+    def test_archive(self, tree: Path):
+        fd = io.BytesIO()
+        write_archive(fd, [tree], codec='gz', threads=0)
+        fd.seek(0)
+        with tarfile.open(fileobj=fd, mode='r:gz') as tar:
+            assert 'tree/sub/b.bin' in tar.getnames()
+
+    def test_failure(self, tree: Path, monkeypatch: pytest.MonkeyPatch):
+        # A failed archive does not leave the compression threads behind
+        import threading
+        from .. import archive
+
+        # Enough data to start the threads before the failure
+        (tree / 'a-big.bin').write_bytes(bytes(3 * 1024 * 1024))
+
+        hashing_reader = archive.HashingReader
+
+        def reader(fd):
+            if not fd.name.endswith('big.bin'):
+                raise OSError("cannot read")
+            return hashing_reader(fd)
+
+        monkeypatch.setattr(archive, 'HashingReader', reader)
+        with pytest.raises(OSError):
+            write_archive(io.BytesIO(), [tree], codec='gz', threads=2)
+        assert not [thread for thread in threading.enumerate()
+                    if thread.name.startswith('jbackup-compress')]
+
+class TestIncremental:
+    def test_manifest(self, tree: Path, tmp_path: Path):
+        from ..manifest import Manifest
+
+        manifest = Manifest()
+        write_archive(io.BytesIO(), [tree], manifest=manifest)
+        assert sorted(e.path for e in manifest) == \
+            ['tree/a.txt', 'tree/sub/b.bin', 'tree/sub/skip.log']
+
+        manifest.save(tmp_path / 'manifest.jsonl')
+        loaded = Manifest.load(tmp_path / 'manifest.jsonl')
+        assert loaded.entries == manifest.entries
+        assert not loaded.diff(manifest)
+
+    def test_incremental(self, tree: Path):
+        from ..manifest import Manifest
+
+        previous = Manifest()
+        write_archive(io.BytesIO(), [tree], manifest=previous)
+
+        # Change one file, delete one and add one
+        (tree / 'a.txt').write_text("changed")
+        (tree / 'sub' / 'skip.log').unlink()
+        (tree / 'new.txt').write_text("new")
+
+        fd = io.BytesIO()
+        manifest = Manifest()
+        stats = write_archive(fd, [tree], manifest=manifest, previous=previous)
+        assert (stats.files, stats.unchanged, stats.deleted) == (2, 1, 1)
+
+        fd.seek(0)
+        with tarfile.open(fileobj=fd, mode='r:gz') as tar:
+            files = sorted(m.name for m in tar.getmembers() if m.isfile())
+            member = tar.extractfile('.jbackup-deleted')
+            assert member is not None
+            assert member.read() == b"tree/sub/skip.log\n"
+        assert files == ['.jbackup-deleted', 'tree/a.txt', 'tree/new.txt']
+
+        diff = previous.diff(manifest)
+        assert diff.added == ['tree/new.txt']
+        assert diff.changed == ['tree/a.txt']
+        assert diff.deleted == ['tree/sub/skip.log']
+        assert manifest.get('tree/sub/b.bin') == previous.get('tree/sub/b.bin')
+
+    def test_changes(self, tree: Path):
+        from ..manifest import Manifest
+
+        previous = Manifest()
+        write_archive(io.BytesIO(), [tree], manifest=previous)
+
+        (tree / 'a.txt').write_text("changed")
+        (tree / 'sub' / 'b.bin').write_text("not in the journal")
+        (tree / 'sub' / 'skip.log').unlink()
+        (tree / 'new').mkdir()
+        (tree / 'new' / 'c.txt').write_text("new")
+        changes = [str(tree / 'a.txt'), str(tree / 'sub' / 'skip.log'), str(tree / 'new')]
+
+        fd = io.BytesIO()
+        manifest = Manifest()
+        stats = write_archive(fd, [tree], manifest=manifest, previous=previous,
+                              changes=changes)
+        assert (stats.files, stats.unchanged, stats.deleted) == (2, 1, 1)
+
+        fd.seek(0)
+        with tarfile.open(fileobj=fd, mode='r:gz') as tar:
+            names = [m.name for m in tar.getmembers()]
+        assert names == ['tree/a.txt', 'tree/new', 'tree/new/c.txt', '.jbackup-deleted']
+        assert sorted(manifest.entries) == ['tree/a.txt', 'tree/new/c.txt', 'tree/sub/b.bin']
+        assert manifest.get('tree/sub/b.bin') == previous.get('tree/sub/b.bin')
+
+        with pytest.raises(ValueError):
+            write_archive(io.BytesIO(), [tree], changes=changes)
+
+    def test_action(self, tree: Path, tmp_path: Path):
+        from ..actions import load_action
+        from ..rules import Rule
+
+        dest = tmp_path / 'out'
+        dest.mkdir()
+        rulefile = tmp_path / 'incr.toml'
+        rulefile.write_text(f"""[archive]
+sources = ["@type path {tree}"]
+destination = "@type path {dest}"
+incremental = true
+""")
+
+        cls = load_action(DATAPATHS['builtin'] / 'actions' / 'archive.py', 'archive')
+        cls(Rule(str(rulefile))).run()
+        (tree / 'a.txt').write_text("changed")
+        (dest / 'first').mkdir()
+        for f in dest.glob('*.tar.gz'):
+            f.rename(dest / 'first' / f.name)
+        cls(Rule(str(rulefile))).run()
+
+        archives = list(dest.glob('*-incr.tar.gz'))
+        assert len(archives) == 1
+        with tarfile.open(archives[0]) as tar:
+            assert [m.name for m in tar.getmembers() if m.isfile()] == \
+                ['tree/a.txt', '.jbackup-deleted']
+
+    def test_action_journal(self, tree: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        from .. import journal
+        from ..actions import load_action
+        from ..rules import Rule
+
+        monkeypatch.setattr(journal, 'SETTLE_TIME', 0.0)
+        dest = tmp_path / 'out'
+        dest.mkdir()
+        rulefile = tmp_path / 'watched.toml'
+        rulefile.write_text(f"""[archive]
+sources = ["@type path {tree}"]
+destination = "@type path {dest / 'archive.tar.gz'}"
+incremental = true
+""")
+        changes = journal.ChangeJournal('watched')
+        changes.start([tree])
+        changes.ready()
+        try:
+            cls = load_action(DATAPATHS['builtin'] / 'actions' / 'archive.py', 'archive')
+            cls(Rule(str(rulefile))).run()
+
+            # Only what the journal lists is looked at
+            (tree / 'a.txt').write_text("changed")
+            (tree / 'sub' / 'b.bin').write_text("changed")
+            changes.record([str(tree / 'a.txt')])
+            cls(Rule(str(rulefile))).run()
+            with tarfile.open(dest / 'archive.tar.gz') as tar:
+                assert [m.name for m in tar.getmembers()] == ['tree/a.txt', '.jbackup-deleted']
+
+            # Lost events make the next run scan everything
+            changes.overflow()
+            cls(Rule(str(rulefile))).run()
+            with tarfile.open(dest / 'archive.tar.gz') as tar:
+                assert 'tree/sub/b.bin' in tar.getnames()
+        finally:
+            changes.stop()
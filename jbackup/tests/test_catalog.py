@@ -0,0 +1,138 @@
+from __future__ import annotations
+from argparse import Namespace
+from ..catalog import Catalog, catalog_file
+from ..manifest import Manifest, ManifestEntry
+from .._path import DATAPATHS
+from pathlib import Path
+import pytest
+
+def _manifest(files: dict[str, str]) -> Manifest:
+    manifest = Manifest()
+    for path, digest in files.items():
+        manifest.entries[path] = ManifestEntry(path, len(digest), 0, 0, digest * 32)
+    return manifest
+
+@pytest.fixture
+def db(tmp_path: Path):
+    with Catalog(tmp_path / 'catalog.db') as catalog:
+        catalog.record('docs', 'archive', 'first', '/b/first.tar.gz',
+                       _manifest({'a/x.txt': 'aa', 'a/y.txt': 'bb', 'b/x.txt': 'cc'}),
+                       created=1000.0)
+        catalog.record('docs', 'archive', 'second', '/b/second.tar.gz',
+                       _manifest({'a/x.txt': 'dd', 'a/y.txt': 'bb'}), created=2000.0)
+        catalog.record('code', 'snapshot', 'third', '/repo',
+                       _manifest({'a/x.txt': 'dd', 'c.py': 'ee'}), created=3000.0)
+        yield catalog
+
+def test_find(db: Catalog):
+    found = db.find('a/x.txt')
+    assert [(f.backup.name, f.hash[:2]) for f in found] == \
+        [('first', 'aa'), ('second', 'dd'), ('third', 'dd')]
+    assert found[0].backup.location == '/b/first.tar.gz'
+
+    assert [f.path for f in db.find('a/*')] == ['a/x.txt', 'a/y.txt', 'a/x.txt', 'a/y.txt',
+                                                'a/x.txt']
+    assert [f.backup.name for f in db.find('*.txt', rule='code')] == ['third']
+    assert db.find('a/none') == []
+
+    assert [f.backup.name for f in db.find_hash('dd' * 32)] == ['second', 'third']
+    assert db.find_hash('not hex') == []
+
+def test_history(db: Catalog):
+    # y.txt did not change in the second backup
+    assert [f.backup.name for f in db.history('a/y.txt')] == ['first']
+    assert [f.backup.name for f in db.history('/a/x.txt')] == ['first', 'second', 'third']
+    assert [f.backup.name for f in db.history('a/x.txt', rule='docs')] == ['first', 'second']
+
+def test_backups(db: Catalog):
+    backups = db.backups()
+    assert [b.name for b in backups] == ['third', 'second', 'first']
+    assert (backups[1].files, backups[1].bytes) == (2, 4)
+    assert [b.name for b in db.backups('docs', limit=1)] == ['second']
+    assert [b.name for b in db.backups(since=2000.0)] == ['third', 'second']
+
+def test_reopen(db: Catalog):
+    # The schema is only created once
+    with Catalog(db.filename) as catalog:
+        assert len(catalog.backups()) == 3
+        assert catalog._db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+
+def test_actions(tmp_path: Path):
+    from ..actions import load_action
+    from ..rules import Rule
+
+    tree = tmp_path / 'tree'
+    tree.mkdir()
+    (tree / 'a.txt').write_text("a")
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    rulefile = tmp_path / 'cat.toml'
+    rulefile.write_text(f"""[archive]
+sources = ["@type path {tree}"]
+destination = "@type path {dest}"
+
+[snapshot]
+sources = ["@type path {tree}"]
+repository = "@type path {tmp_path / 'repo'}"
+""")
+    for name in ('archive', 'snapshot'):
+        cls = load_action(DATAPATHS['builtin'] / 'actions' / f"{name}.py", name)
+        cls(Rule(str(rulefile))).run()
+
+    assert catalog_file().exists()
+    with Catalog() as catalog:
+        archive, snapshot = catalog.find('tree/a.txt')
+        assert (archive.backup.rule, archive.backup.action) == ('cat', 'archive')
+        assert Path(archive.backup.location).parent == dest
+        assert archive.backup.location.endswith(archive.backup.name)
+        assert snapshot.backup.action == 'snapshot' and snapshot.hash == archive.hash
+
+def test_chain(tmp_path: Path):
+    from ..actions import load_action
+    from ..actions.chain import ActionChain
+    from ..rules import Rule
+
+    tree = tmp_path / 'tree'
+    tree.mkdir()
+    (tree / 'a.txt').write_text("a")
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    rulefile = tmp_path / 'chained.toml'
+    rulefile.write_text(f"""[archive]
+sources = ["@type path {tree}"]
+
+[compress]
+codec = "gz"
+
+[copy]
+destination = "@type path {dest}"
+""")
+    chain = ActionChain([(name, load_action(DATAPATHS['builtin'] / 'actions' / f"{name}.py",
+                                            name))
+                         for name in ('archive', 'compress', 'copy')])
+    chain(Rule(str(rulefile))).run()
+
+    # The archive is recorded where the copy put it
+    written, = dest.iterdir()
+    with Catalog() as catalog:
+        found, = catalog.find('tree/a.txt')
+        assert found.backup.location == str(written)
+        assert found.backup.name == written.name and written.name.endswith('.gz')
+
+def test_command(db: Catalog, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture):
+    from .. import catalog as catalog_module
+    from ..__main__ import catalog
+
+    monkeypatch.setattr(catalog_module, 'catalog_file', lambda: db.filename)
+
+    assert catalog(Namespace(query='find', PATTERN='a/y.txt', hash=False, rule=None)) == 0
+    assert [line.split()[-1] for line in capsys.readouterr().out.splitlines()] == \
+        ['a/y.txt', 'a/y.txt']
+    assert catalog(Namespace(query='find', PATTERN='zz', hash=False, rule=None)) == 1
+
+    assert catalog(Namespace(query='history', PATH='a/x.txt', rule='docs')) == 0
+    assert len(capsys.readouterr().out.splitlines()) == 2
+
+    assert catalog(Namespace(query='stats', RULE=None, limit=2, days=None)) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[3] for line in lines] == ['archive', 'snapshot']
@@ -0,0 +1,106 @@
+from __future__ import annotations
+from ..actions.chain import ActionChain, ChainError
+from .._path import DATAPATHS
+from pathlib import Path
+import pytest, tarfile, gzip
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    root = tmp_path / 'tree'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'a.txt').write_text("a" * 1000)
+    (root / 'sub' / 'b.bin').write_bytes(bytes(range(256)) * 4000)
+    return root
+
+def _builtin(name: str):
+    from ..actions import load_action
+    return name, load_action(DATAPATHS['builtin'] / 'actions' / f"{name}.py", name)
+
+class _Failing:
+    # Writes some output, then fails
+    stream_input = False
+    stream_output = True
+
+    def __init__(self, rule):
+        pass
+
+    def run(self) -> None:
+        pass
+
+    def run_stream(self, input, output, input_name) -> None:
+        output.write(b'x' * 100000)
+        raise RuntimeError("upstream failed")
+
+def _rulefile(tmp_path: Path, tree: Path, dest: Path, codec: str='none') -> Path:
+    rulefile = tmp_path / 'chained.toml'
+    rulefile.write_text(f"""[archive]
+sources = ["@type path {tree}"]
+codec = "{codec}"
+
+[compress]
+codec = "gz"
+
+[copy]
+destination = "@type path {dest}"
+""")
+    return rulefile
+
+def test_archive_copy(tree: Path, tmp_path: Path):
+    from ..rules import Rule
+
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    chain = ActionChain([_builtin('archive'), _builtin('copy')])
+    chain(Rule(str(_rulefile(tmp_path, tree, dest, 'gz')))).run()
+
+    archives = list(dest.iterdir())
+    assert len(archives) == 1
+    assert archives[0].name.startswith('chained-') and archives[0].name.endswith('.tar.gz')
+    with tarfile.open(archives[0]) as tar:
+        assert tar.getnames() == ['tree', 'tree/a.txt', 'tree/sub', 'tree/sub/b.bin']
+
+def test_archive_compress_copy(tree: Path, tmp_path: Path):
+    from ..rules import Rule
+
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    chain = ActionChain([_builtin('archive'), _builtin('compress'), _builtin('copy')])
+    chain(Rule(str(_rulefile(tmp_path, tree, dest)))).run()
+
+    archives = list(dest.iterdir())
+    assert [f.suffixes for f in archives] == [['.tar', '.gz']]
+    with gzip.open(archives[0]) as fd, tarfile.open(fileobj=fd) as tar: # pyright: ignore
+        assert 'tree/sub/b.bin' in tar.getnames()
+
+def test_invalid_chains():
+    with pytest.raises(ChainError):
+        ActionChain([_builtin('copy')])
+    with pytest.raises(ChainError, match="only come first"):
+        ActionChain([_builtin('archive'), _builtin('archive')])
+    with pytest.raises(ChainError, match="only come last"):
+        ActionChain([_builtin('copy'), _builtin('compress')])
+    with pytest.raises(ChainError, match="cannot be chained"):
+        ActionChain([_builtin('snapshot'), _builtin('copy')])
+
+def test_failure(tree: Path, tmp_path: Path):
+    from ..rules import Rule
+
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    chain = ActionChain([('failing', _Failing), _builtin('compress'), _builtin('copy')]) # pyright: ignore
+    with pytest.raises(RuntimeError, match="upstream failed"):
+        chain(Rule(str(_rulefile(tmp_path, tree, dest)))).run()
+
+    # Nothing is left behind, not even a partial file
+    assert list(dest.iterdir()) == []
+
+def test_run_rules(tree: Path, tmp_path: Path):
+    from ..actions.runner import run_rules
+
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    rulefile = _rulefile(tmp_path, tree, dest)
+    files = [DATAPATHS['builtin'] / 'actions' / f"{name}.py" for name in ('archive', 'copy')]
+    results = run_rules(files, 'archive+copy', [('chained', rulefile)])
+    assert [result.ok for result in results] == [True]
+    assert len(list(dest.glob('*.tar'))) == 1
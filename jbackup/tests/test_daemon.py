@@ -0,0 +1,170 @@
+from __future__ import annotations
+from pathlib import Path
+from datetime import datetime
+import os, threading, time
+import pytest
+
+@pytest.fixture
+def datapaths(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    from .. import _index
+    from .._path import DATAPATHS
+
+    monkeypatch.setattr(_index, '_indexes', {})
+    for where in ('system', 'user', 'builtin'):
+        (tmp_path / where / 'rules').mkdir(parents=True)
+        (tmp_path / where / 'actions').mkdir()
+        monkeypatch.setitem(DATAPATHS, where, tmp_path / where)
+
+    log = tmp_path / 'log'
+    (tmp_path / 'user' / 'actions' / 'record.py').write_text(f'''
+import os
+
+class Action_Record:
+    properties = []
+
+    def __init__(self, rule):
+        self.rule = rule
+
+    def run(self):
+        with open({str(log)!r}, 'a') as fd:
+            fd.write(f"{{self.rule.get('/record/name')}} {{self.rule.get('/record/out')}}\\n")
+''')
+    rules = tmp_path / 'user' / 'rules'
+    (rules / 'one.toml').write_text('[schedule]\nrecord = "0 3 * * *"\n'
+                                    '[record]\nname = "one"\nout = "@type path out"\n')
+    (rules / 'two.toml').write_text('[schedule]\nrecord = "bad"\n'
+                                    '[record]\nname = "two"\nout = "@type path /abs"\n')
+    return tmp_path
+
+@pytest.fixture
+def daemon(datapaths: Path):
+    from ..daemon import Daemon, socket_path
+
+    d = Daemon(poll_interval=3600)
+    thread = threading.Thread(target=d.serve_forever)
+    thread.start()
+    for _ in range(100):
+        if socket_path().exists():
+            break
+        time.sleep(0.05)
+
+    yield d
+
+    d.shutdown()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert not socket_path().exists()
+
+def test_schedules(daemon):
+    assert [(job.rule, job.action) for job in daemon.schedules] == [('one', 'record')]
+    assert daemon.due_jobs(datetime(2024, 1, 1, 3, 0)) == {'record': ['one']}
+    assert daemon.due_jobs(datetime(2024, 1, 1, 3, 1)) == {}
+
+def test_catch_up(daemon, datapaths: Path):
+    from ..schedule import Schedule
+    from ..daemon import ScheduledJob
+
+    # Two days and eight hours later, each job runs once
+    daemon.schedules.append(ScheduledJob('two', 'record', Schedule('*/5 * * * *')))
+    start, end = datetime(2024, 1, 1, 2, 59), datetime(2024, 1, 3, 11, 0)
+    assert daemon.due_jobs(start, end) == {'record': ['one', 'two']}
+    assert daemon.run_scheduled(start, end) == 1
+    assert daemon.jobs_run == 1
+    assert (datapaths / 'log').read_text().splitlines() == ["one out", "two /abs"]
+
+    assert daemon.due_jobs(datetime(2024, 1, 1, 3, 1), datetime(2024, 1, 1, 3, 4)) == {}
+
+def test_reload(daemon, datapaths: Path):
+    from ..daemon import request
+
+    assert request({'cmd': 'reload'})['reloaded'] == []
+
+    rule = datapaths / 'user' / 'rules' / 'two.toml'
+    rule.write_text('[schedule]\nrecord = "@hourly"\n[record]\nname = "two"\n')
+    reply = request({'cmd': 'reload'})
+    assert reply['reloaded'] == ['rule two']
+
+    status = request({'cmd': 'status'})
+    assert sorted(job['rule'] for job in status['schedules']) == ['one', 'two']
+
+def test_submit(daemon, datapaths: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    from ..daemon import request, submit_job
+
+    assert request({'cmd': 'ping'})['ok']
+    assert request({'cmd': 'nope'})['ok'] is False
+
+    # Relative paths are resolved against the client's directory,
+    # without changing the daemon's
+    workdir = tmp_path / 'work'
+    workdir.mkdir()
+    cwd = os.getcwd()
+    monkeypatch.chdir(workdir)
+    assert submit_job('record', ['one', 'two']) == 0
+    assert submit_job('record', ['missing']) == 1
+    assert submit_job('nope', [], all_rules=True) == 1
+    assert (datapaths / 'log').read_text() == f"one {workdir / 'out'}\ntwo /abs\n"
+    assert daemon.jobs_run == 3
+
+    monkeypatch.chdir(cwd)
+    reply = request({'cmd': 'do', 'action': 'record', 'rules': ['one'], 'level': 'DEBUG'})
+    assert reply['ok'] is False and 'level' in reply['error']
+
+def test_submit_paths(daemon, datapaths: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Plain strings in path properties are relative to the client too
+    import shutil
+    from ..daemon import request
+
+    shutil.copy(Path(__file__).parents[1] / 'data' / 'actions' / 'copy.py',
+                datapaths / 'builtin' / 'actions')
+    (datapaths / 'user' / 'rules' / 'three.toml').write_text(
+        '[copy]\nsources = ["data"]\ndestination = "backup"\n')
+    workdir = tmp_path / 'work'
+    (workdir / 'data').mkdir(parents=True)
+    (workdir / 'data' / 'f').write_text("f")
+    monkeypatch.chdir(tmp_path)
+    reply = request({'cmd': 'do', 'action': 'copy', 'rules': ['three'], 'all': False,
+                     'jobs': 1, 'cwd': str(workdir), 'level': None})
+    assert reply['ok'], reply
+    assert (workdir / 'backup' / 'data' / 'f').read_text() == "f"
+    assert not (tmp_path / 'backup').exists()
+
+def test_submit_errors(daemon, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture):
+    from ..daemon import submit_job
+
+    monkeypatch.setenv('JBACKUP_LEVEL', 'DEBUG')
+    assert submit_job('record', ['one']) == 1
+    assert "JBACKUP_LEVEL" in caplog.text
+
+    monkeypatch.setenv('JBACKUP_LEVEL', '10')
+    monkeypatch.setattr(daemon, 'run_job', None)
+    assert submit_job('record', ['one']) == 1
+    assert "could not run the job" in caplog.text
+
+def test_wedged_daemon(datapaths: Path, monkeypatch: pytest.MonkeyPatch):
+    # A daemon that accepts connections but never answers
+    import socket
+    from .. import daemon
+    from ..daemon import submit_job, socket_path
+
+    monkeypatch.setattr(daemon, 'PING_TIMEOUT', 0.2)
+    path = socket_path()
+    path.parent.mkdir(parents=True)
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.bind(str(path))
+        sock.listen()
+        assert submit_job('record', ['one']) is None
+
+def test_no_daemon(datapaths: Path):
+    from ..daemon import submit_job, socket_path
+
+    assert submit_job('record', ['one']) is None
+
+    # A socket left behind by a daemon that died
+    import socket
+    path = socket_path()
+    path.parent.mkdir(parents=True)
+    sock = socket.socket(socket.AF_UNIX)
+    sock.bind(str(path))
+    sock.close()
+    assert submit_job('record', ['one']) is None
+    assert not (datapaths / 'log').exists()
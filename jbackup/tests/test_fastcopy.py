@@ -0,0 +1,81 @@
+from __future__ import annotations
+from .. import fastcopy
+from ..fastcopy import copy_file, copy_stream, copy_tree
+from pathlib import Path
+from .conftest import random_bytes
+import pytest, io, os, errno
+
+@pytest.fixture
+def tree_files() -> dict[str, str | bytes]:
+    return {'a.txt': "a" * 1000, 'sub/b.bin': random_bytes(3 * 1024 * 1024 + 7),
+            'sub/empty': b''}
+
+@pytest.fixture
+def tree(tree: Path) -> Path:
+    (tree / 'link').symlink_to('a.txt')
+    os.chmod(tree / 'a.txt', 0o640)
+    os.utime(tree / 'sub' / 'b.bin', (1000000, 1000000))
+    return tree
+
+def _unsupported(*args):
+    raise OSError(errno.EXDEV, "not supported")
+
+@pytest.mark.parametrize('disable', [(), ('_clone',), ('_clone', '_copy_file_range'),
+                                     ('_clone', '_copy_file_range', '_sendfile')])
+def test_copy_file(tree: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch,
+                   disable: tuple[str, ...]):
+    # Each method falls back to the next
+    for name in disable:
+        monkeypatch.setattr(fastcopy, name, _unsupported if name != '_clone' else lambda *a: False)
+
+    src = tree / 'sub' / 'b.bin'
+    dst = tmp_path / 'copy.bin'
+    method = copy_file(src, dst, buffer_size=4096)
+    if disable:
+        assert method == ('copy_file_range', 'sendfile', 'read')[len(disable) - 1]
+    assert dst.read_bytes() == src.read_bytes()
+
+    copy_file(tree / 'a.txt', dst)
+    assert dst.read_text() == "a" * 1000
+    assert dst.stat().st_mode & 0o777 == 0o640
+
+def test_copy_stream():
+    data = os.urandom(100000)
+    out = io.BytesIO()
+    assert copy_stream(io.BytesIO(data), out, buffer_size=4096) == len(data)
+    assert out.getvalue() == data
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_copy_tree(tree: Path, tmp_path: Path, threads: int):
+    dest = tmp_path / 'out'
+    stats = copy_tree([tree], dest, threads=threads)
+    assert stats.files == 3
+    assert stats.bytes == 1000 + 3 * 1024 * 1024 + 7
+    assert stats.throughput > 0
+
+    copied = dest / 'tree'
+    assert (copied / 'sub' / 'b.bin').read_bytes() == (tree / 'sub' / 'b.bin').read_bytes()
+    assert (copied / 'sub' / 'empty').stat().st_size == 0
+    assert os.readlink(copied / 'link') == 'a.txt'
+    assert (copied / 'sub' / 'b.bin').stat().st_mtime == 1000000
+
+    # Copying again replaces the files
+    (tree / 'a.txt').write_text("changed")
+    copy_tree([tree], dest, threads=threads)
+    assert (copied / 'a.txt').read_text() == "changed"
+
+def test_copy_action(tree: Path, tmp_path: Path):
+    from ..actions import load_action
+    from ..rules import Rule
+    from .._path import DATAPATHS
+
+    dest = tmp_path / 'out'
+    rulefile = tmp_path / 'copied.toml'
+    rulefile.write_text(f"""[copy]
+sources = ["@type path {tree}"]
+destination = "@type path {dest}"
+threads = 2
+""")
+    cls = load_action(DATAPATHS['builtin'] / 'actions' / 'copy.py', 'copy')
+    cls(Rule(str(rulefile))).run()
+    assert (dest / 'tree' / 'a.txt').read_text() == "a" * 1000
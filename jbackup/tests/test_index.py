@@ -0,0 +1,63 @@
+from __future__ import annotations
+from .._index import DataIndex
+from pathlib import Path
+import pytest, os
+
+@pytest.fixture
+def datadir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setenv('JBACKUP_CACHE_DIR', str(tmp_path / 'cache'))
+    _dir = tmp_path / 'rules'
+    _dir.mkdir()
+    for name in ('one.toml', 'two.toml', 'three.py'):
+        (_dir / name).write_text('')
+    return _dir
+
+def test_lookup(datadir: Path):
+    index = DataIndex(datadir)
+    assert index.lookup('one') == datadir / 'one.toml'
+    assert index.lookup('three') == datadir / 'three.py'
+    assert index.lookup('four') is None
+
+    assert sorted(index.names()) == ['one', 'three', 'two']
+    assert index.names('*.py') == ['three']
+
+    # The index persists across instances
+    assert index.index_file.exists()
+    assert DataIndex(datadir).lookup('two') == datadir / 'two.toml'
+
+def test_invalidate(datadir: Path):
+    index = DataIndex(datadir)
+    assert index.lookup('four') is None
+
+    # A new file changes the directory's mtime
+    newfile = datadir / 'four.toml'
+    newfile.write_text('')
+    st = os.stat(datadir)
+    os.utime(datadir, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert DataIndex(datadir).lookup('four') == newfile
+    assert index.lookup('four') == newfile
+
+def test_add(datadir: Path):
+    index = DataIndex(datadir)
+    index.names()
+
+    newfile = datadir / 'five.toml'
+    newfile.write_text('')
+    index.add(newfile)
+    assert index.lookup('five') == newfile
+    assert DataIndex(datadir).lookup('five') == newfile
+
+def test_missing_directory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv('JBACKUP_CACHE_DIR', str(tmp_path / 'cache'))
+    index = DataIndex(tmp_path / 'doesnotexist')
+    assert index.lookup('one') is None
+    assert index.names() == []
+
+def test_index_names(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Paths that used to map to the same name, and a long one
+    monkeypatch.setenv('JBACKUP_CACHE_DIR', str(tmp_path / 'cache'))
+    names = {DataIndex(tmp_path / path).index_file.name
+             for path in ('a%b', 'a/b', 'x' * 250 + '/' + 'y' * 250)}
+    assert len(names) == 3
+    assert all(len(name) < 64 for name in names)
+    assert DataIndex(Path('rel')).index_file == DataIndex(Path.cwd() / 'rel').index_file
@@ -67,3 +67,27 @@ def test_loader_errors() -> None:
             Path(__file__).parent / '_test.py',
             'test'
         )
+
+def test_code_cache(modfile: Path, cache_dir: Path) -> None:
+    from ..loader import set_cached_metadata
+
+    module = load_module_from_file(modfile, 'testmod')
+    assert module.metadata == {}
+    assert list((cache_dir / 'bytecode').iterdir())
+
+    set_cached_metadata(modfile, 'key', 'value')
+    module = load_module_from_file(modfile, 'testmod')
+    assert module.metadata == {'key': 'value'}
+    assert module.pubattr == 1
+
+    # Bypassing the cache ignores the metadata
+    module = load_module_from_file(modfile, 'testmod', cache=False)
+    assert module.metadata == {}
+
+def test_code_cache_invalidated(tmp_path: Path) -> None:
+    modfile = tmp_path / 'mod.py'
+    modfile.write_text("value = 1\n")
+    assert load_module_from_file(modfile, 'mod').value == 1
+
+    modfile.write_text("value = 22\n")
+    assert load_module_from_file(modfile, 'mod').value == 22
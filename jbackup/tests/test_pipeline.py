@@ -0,0 +1,59 @@
+from __future__ import annotations
+from ..pipeline import run_pipeline, stage
+import asyncio, threading, time
+import pytest
+
+def test_order():
+    def slow_square(n: int) -> int:
+        # Later items finish first
+        time.sleep(0.01 * (5 - n % 5))
+        return n * n
+
+    out: list[int] = []
+    count = asyncio.run(run_pipeline(range(20), stage(slow_square, workers=4),
+                                     stage(str), sink=out.append))
+    assert count == 20
+    assert out == [str(n * n) for n in range(20)]
+
+def test_backpressure():
+    lock = threading.Lock()
+    produced = 0
+    consumed = 0
+    ahead = 0
+
+    def source():
+        nonlocal produced, ahead
+        for i in range(50):
+            with lock:
+                produced += 1
+                ahead = max(ahead, produced - consumed)
+            yield i
+
+    async def sink(item: int) -> None:
+        nonlocal consumed
+        await asyncio.sleep(0.001)
+        with lock:
+            consumed += 1
+
+    asyncio.run(run_pipeline(source(), stage(lambda x: x, workers=2), sink=sink, maxsize=2))
+    assert consumed == 50
+    # Two queues of two, the items in the stage and the sink, and the next read
+    assert ahead <= 10, ahead
+
+def test_async_source_and_error():
+    async def source():
+        for i in range(100):
+            yield i
+
+    def fail(n: int) -> int:
+        if n == 3:
+            raise ValueError("bad item")
+        return n
+
+    out: list[int] = []
+    with pytest.raises(ValueError, match="bad item"):
+        asyncio.run(run_pipeline(source(), stage(fail, workers=2), sink=out.append))
+    assert out == [0, 1, 2]
+
+    with pytest.raises(ValueError):
+        stage(fail, workers=0)
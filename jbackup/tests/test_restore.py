@@ -0,0 +1,162 @@
+from __future__ import annotations
+from argparse import Namespace
+from .. import restore as restore_module
+from ..archive import seekable
+from ..archive.seekable import ArchiveSet, find_archives, write_seekable
+from ..restore import match, restore_archives, restore_snapshot
+from ..store import ChunkStore
+from pathlib import Path
+from .conftest import random_bytes
+import pytest, os
+
+@pytest.fixture
+def tree_files() -> dict[str, str | bytes]:
+    files: dict[str, str | bytes] = {'big.bin': random_bytes(300000, 1)}
+    for i in range(10):
+        files[f"src/m{i}.py"] = f"print({i})\n"
+        files[f"src/m{i}.txt"] = f"{i}\n"
+    files['src/deep/x.py'] = "x = 1\n"
+    return files
+
+def _files(directory: Path) -> list[str]:
+    return sorted(str(p.relative_to(directory)) for p in directory.rglob('*') if p.is_file())
+
+def test_match():
+    assert match('tree/src/a.py', ['*.py'])
+    assert not match('tree/src/a.pyc', ['*.py'])
+    assert match('tree/src/deep/a.py', ['tree/src/*.py'])
+    assert not match('tree/doc/a.py', ['tree/src/*'])
+    assert match('tree/a.txt', ['*.py', 'a.*'])
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_snapshot(tree: Path, tmp_path: Path, threads: int, monkeypatch: pytest.MonkeyPatch):
+    # Spread the chunks of big.bin over the pool
+    monkeypatch.setattr(restore_module, '_LARGE_FILE', 100000)
+    with ChunkStore(tmp_path / 'repo', create=True) as store:
+        snapshot, _ = store.snapshot('rule', [tree])
+        stats = restore_snapshot(store, snapshot, tmp_path / 'all', threads=threads)
+        assert stats.files == 25
+        assert stats.bytes == sum(entry.size for entry in snapshot.manifest)
+
+        stats = restore_snapshot(store, snapshot, tmp_path / 'some', threads=threads,
+                                 paths=['tree/src', 'tree/big.bin'], patterns=['*.py', 'big.*'])
+        assert stats.files == 12
+
+        with pytest.raises(LookupError):
+            restore_snapshot(store, snapshot, tmp_path / 'none', paths=['tree/none'])
+
+    assert _files(tmp_path / 'all') == ['tree/' + name for name in _files(tree)]
+    assert (tmp_path / 'all' / 'tree' / 'big.bin').read_bytes() == (tree / 'big.bin').read_bytes()
+    assert (tmp_path / 'all' / 'tree' / 'big.bin').stat().st_mtime_ns == \
+        (tree / 'big.bin').stat().st_mtime_ns
+    assert _files(tmp_path / 'some') == \
+        ['tree/big.bin', 'tree/src/deep/x.py'] + [f"tree/src/m{i}.py" for i in range(10)]
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_snapshot_tree(tmp_path: Path, threads: int):
+    # Permission bits, symbolic links and empty directories come back
+    tree = tmp_path / 'tree'
+    (tree / 'empty').mkdir(parents=True)
+    (tree / 'run.sh').write_text("#!/bin/sh\n")
+    (tree / 'run.sh').chmod(0o755)
+    (tree / 'data.txt').write_text("data")
+    (tree / 'data.txt').chmod(0o600)
+    (tree / 'link').symlink_to('run.sh')
+    (tree / 'empty').chmod(0o700)
+
+    with ChunkStore(tmp_path / 'repo', create=True) as store:
+        store.snapshot('rule', [tree])
+        snapshot = store.load_snapshot('rule')
+        assert snapshot is not None
+        stats = restore_snapshot(store, snapshot, tmp_path / 'to', threads=threads)
+        assert stats.files == 5
+
+    restored = tmp_path / 'to' / 'tree'
+    assert (restored / 'run.sh').stat().st_mode & 0o777 == 0o755
+    assert (restored / 'data.txt').stat().st_mode & 0o777 == 0o600
+    assert os.readlink(restored / 'link') == 'run.sh'
+    assert (restored / 'empty').is_dir() and not any((restored / 'empty').iterdir())
+    assert (restored / 'empty').stat().st_mode & 0o777 == 0o700
+    assert (restored / 'empty').stat().st_mtime_ns == (tree / 'empty').stat().st_mtime_ns
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_archives(tree: Path, tmp_path: Path, threads: int, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(seekable, '_LARGE_MEMBER', 100000)
+    filename = tmp_path / 'out.jbk'
+    with open(filename, 'wb') as fd:
+        write_seekable(fd, [tree], frame_size=16384)
+
+    with ArchiveSet([filename]) as archives:
+        stats = restore_archives(archives, tmp_path / 'all', threads=threads)
+        assert stats.files == 25
+        stats = restore_archives(archives, tmp_path / 'some', threads=threads,
+                                 paths=['tree/src/deep', 'tree/big.bin'], patterns=['*.py'])
+        assert stats.files == 1
+
+    assert _files(tmp_path / 'all') == ['tree/' + name for name in _files(tree)]
+    assert (tmp_path / 'all' / 'tree' / 'big.bin').read_bytes() == (tree / 'big.bin').read_bytes()
+    assert _files(tmp_path / 'some') == ['tree/src/deep/x.py']
+
+@pytest.mark.parametrize('journal', [False, True])
+def test_deleted_members(tmp_path: Path, journal: bool):
+    from ..manifest import Manifest
+
+    src = tmp_path / 'src'
+    (src / 'old').mkdir(parents=True)
+    (src / 'old' / 'f').write_text("f")
+    (src / 'keep').mkdir()
+    (src / 'link').symlink_to('keep')
+    (src / 'keeplink').symlink_to('keep')
+    full, incremental = tmp_path / 'full.jbk', tmp_path / 'incr.jbk'
+    manifest = Manifest()
+    with open(full, 'wb') as fd:
+        write_seekable(fd, [src], manifest=manifest)
+
+    (src / 'old' / 'f').unlink()
+    (src / 'old').rmdir()
+    (src / 'link').unlink()
+    changes = {str(src / 'old'), str(src / 'old' / 'f'), str(src / 'link')} if journal else None
+    with open(incremental, 'wb') as fd:
+        write_seekable(fd, [src], manifest=Manifest(), previous=manifest, changes=changes)
+
+    with ArchiveSet([incremental, full]) as archives:
+        assert [entry.path for _, entry in archives.list()] \
+            == ['src', 'src/keep', 'src/keeplink']
+        restore_archives(archives, tmp_path / 'out')
+    assert sorted(os.listdir(tmp_path / 'out' / 'src')) == ['keep', 'keeplink']
+
+def test_find_archives_stamp(tmp_path: Path):
+    for name in ('r-20260101-000000.jbk', 'r-20260102-000000-incr.jbk',
+                 'r-20260103-000000.jbk', 'r-20260104-000000-incr.jbk'):
+        (tmp_path / name).write_bytes(b'')
+
+    def names(stamp):
+        return [path.name for path in find_archives(tmp_path, 'r', stamp)]
+
+    assert names(None) == ['r-20260104-000000-incr.jbk', 'r-20260103-000000.jbk']
+    assert names('20260102-000000') == ['r-20260102-000000-incr.jbk', 'r-20260101-000000.jbk']
+    assert names('20260101-000000') == ['r-20260101-000000.jbk']
+    assert names('20260105-000000') == []
+
+def test_command(tree: Path, tmp_path: Path):
+    from ..__main__ import restore
+
+    repo = tmp_path / 'repo'
+    with ChunkStore(repo, create=True) as store:
+        first, _ = store.snapshot('rule', [tree])
+    (tree / 'src' / 'm0.py').write_text("changed")
+    with ChunkStore(repo) as store:
+        store.snapshot('rule', [tree], previous=first)
+
+    def args(**kwargs) -> Namespace:
+        options = {'TARGET': 'rule', 'SNAPSHOT': None, 'path': None, 'glob': ['m0.py'],
+                   'to': tmp_path / 'to', 'jobs': 2, 'repository': repo, 'archives': False}
+        options.update(kwargs)
+        return Namespace(**options)
+
+    assert restore(args()) == 0
+    assert (tmp_path / 'to' / 'tree' / 'src' / 'm0.py').read_text() == "changed"
+    assert restore(args(SNAPSHOT=first.name, to=tmp_path / 'first')) == 0
+    assert (tmp_path / 'first' / 'tree' / 'src' / 'm0.py').read_text() == "print(0)\n"
+    assert restore(args(SNAPSHOT='nope')) == 1
+    assert restore(args(path=['tree/none'])) == 1
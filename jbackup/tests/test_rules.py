@@ -102,3 +102,173 @@ class TestRules:
         value: list = rule['testparser/paths']
         for v in value:
             assert not isinstance(v, str), v
+
+class TestLazyParse:
+    RULE = """[copy]
+dest = "@type path /tmp/dest"
+list = ["@type path /a", "plain"]
+
+[copy.sub]
+file = "@type path /b"
+"""
+
+    @pytest.fixture
+    def rulefile(self, tmp_path: Path) -> Path:
+        f = tmp_path / 'lazy.toml'
+        f.write_text(self.RULE)
+        return f
+
+    def test_lazy(self, rulefile: Path):
+        calls: list[str] = []
+        def func(string: str):
+            calls.append(string)
+            return parse_string(string)
+
+        tomlf = TOMLFile(str(rulefile), func=func)
+        assert calls == []
+
+        assert tomlf.get('copy/dest') == Path('/tmp/dest')
+        assert tomlf.get('copy/dest') == Path('/tmp/dest')
+        assert calls == ['@type path /tmp/dest']
+
+        assert tomlf.get('copy/list') == [Path('/a'), 'plain']
+        assert tomlf.get('copy/sub') == {'file': Path('/b')}
+        assert tomlf.get('/copy')['sub']['file'] == Path('/b')
+
+    def test_eager(self, rulefile: Path):
+        rule = Rule(str(rulefile), validate=True)
+        data = rule.config._data.data # pyright: ignore
+        assert data['copy']['sub']['file'] == Path('/b')
+        assert rule['copy/list'] == [Path('/a'), 'plain']
+
+class TestRuleCache:
+    @pytest.fixture
+    def rulefile(self, tmp_path: Path) -> Path:
+        f = tmp_path / 'cached.toml'
+        f.write_text('[copy]\ndest = "@type path /tmp/dest"\n')
+        return f
+
+    def test_cache(self, rulefile: Path, monkeypatch: pytest.MonkeyPatch):
+        from ..rules import cache
+
+        calls: list[str] = []
+        parse_file = TOMLFile.parse_file
+        def parse(fd):
+            calls.append(fd.name)
+            return parse_file(fd)
+        monkeypatch.setattr(TOMLFile, 'parse_file', staticmethod(parse))
+
+        assert Rule(str(rulefile), cache=True)['copy/dest'] == Path('/tmp/dest')
+        assert Rule(str(rulefile), cache=True)['copy/dest'] == Path('/tmp/dest')
+        assert len(calls) == 1
+
+        # From the disk cache
+        cache.clear_memory_cache()
+        rule = Rule(str(rulefile), cache=True)
+        assert len(calls) == 1
+
+        # Callers get their own copy
+        rule.config.get('/copy')['dest'] = 'changed'
+        assert Rule(str(rulefile), cache=True)['copy/dest'] == Path('/tmp/dest')
+
+        # Editing the rule invalidates it
+        rulefile.write_text('[copy]\ndest = "@type path /tmp/other/dest"\n')
+        assert Rule(str(rulefile), cache=True)['copy/dest'] == Path('/tmp/other/dest')
+        assert len(calls) == 2
+
+        # Bypassed
+        monkeypatch.setenv('JBACKUP_NO_RULE_CACHE', '1')
+        Rule(str(rulefile))
+        assert len(calls) == 3
+
+    def test_eviction(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        from ..rules import cache
+        from .._path import get_cache_path
+
+        monkeypatch.setattr(cache, 'MAX_MEMORY_ENTRIES', 2)
+        monkeypatch.setattr(cache, 'MAX_DISK_ENTRIES', 3)
+        cache.clear_memory_cache()
+        for i in range(5):
+            f = tmp_path / f"rule{i}.toml"
+            f.write_text(f'[a]\nb = {i}\n')
+            assert Rule(str(f), cache=True)['a/b'] == i
+
+        assert len(cache._memory) == 2
+        assert len(list(get_cache_path('rules').iterdir())) == 3
+
+def test_base(tmp_path: Path):
+    f = tmp_path / 'rule.toml'
+    f.write_text('[copy]\nsources = ["@type path a", "@type path /b", "@type path ~/c"]\n'
+                 'dest = "@type path d"\nname = "e"\n')
+    rule = Rule(str(f), cache=False, base=tmp_path / 'base')
+    assert rule['copy/sources'] == [tmp_path / 'base' / 'a', Path('/b'),
+                                    Path('~/c').expanduser()]
+    assert rule['copy/dest'] == tmp_path / 'base' / 'd'
+    assert rule['copy/name'] == 'e'
+    assert Rule(str(f), cache=False)['copy/dest'] == Path('d')
+
+    # Strings are only rebased on request
+    assert rule.resolve_paths(['a', '/b', '', tmp_path / 'c']) \
+        == [str(tmp_path / 'base' / 'a'), '/b', '', tmp_path / 'c']
+    assert rule.resolve_paths({'x': 'a'}) == {'x': str(tmp_path / 'base' / 'a')}
+    assert Rule(str(f), cache=False).resolve_paths('a') == 'a'
+
+class TestFormats:
+    RULES = {
+        'toml': '[copy]\ndest = "@type path /tmp/dest"\n[copy.sub]\nn = 1\n',
+        'yaml': 'copy:\n  dest: "@type path /tmp/dest"\n  sub:\n    n: 1\n',
+        'json': '{"copy": {"dest": "@type path /tmp/dest", "sub": {"n": 1}}}'
+    }
+
+    @pytest.mark.parametrize('fmt', list(RULES))
+    def test_read(self, fmt: str, tmp_path: Path):
+        f = tmp_path / f"rule.{fmt}"
+        f.write_text(self.RULES[fmt])
+        for cache in (False, True):
+            rule = Rule(str(f), cache=cache)
+            assert rule['copy/dest'] == Path('/tmp/dest')
+            assert rule['copy/sub/n'] == 1
+            assert rule.get('copy/missing', 'x', safe=True) == 'x'
+            with pytest.raises(MissingSectionError):
+                rule['nosection/option']
+
+    @pytest.mark.parametrize('fmt', ['yaml', 'json'])
+    def test_errors(self, fmt: str, tmp_path: Path):
+        f = tmp_path / f"rule.{fmt}"
+        f.write_text("- a list\n" if fmt == 'yaml' else "{invalid")
+        with pytest.raises(RuleParserError):
+            Rule(str(f), cache=False)
+
+    @pytest.mark.parametrize('text', ['on:\n  x: 1\n', 'copy:\n  2: x\n',
+                                      'copy:\n  - yes: 1\n'])
+    def test_yaml_keys(self, text: str, tmp_path: Path):
+        # YAML reads these keys as booleans and numbers
+        f = tmp_path / 'rule.yaml'
+        f.write_text(text)
+        with pytest.raises(RuleParserError, match="quote it"):
+            Rule(str(f), cache=False)
+
+        f.write_text("'on':\n  '2': x\n")
+        assert Rule(str(f), cache=False)['on/2'] == 'x'
+
+    @pytest.mark.parametrize('fmt', ['yaml', 'json'])
+    def test_write(self, fmt: str, tmp_path: Path):
+        f = tmp_path / f"new.{fmt}"
+        Rule(str(f), 'w')
+        assert Rule(str(f))['action/option'] == 'value'
+
+    def test_registry(self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+        from ..rules import get_format, register_format
+        from ..rules.config import _FORMATS, format_names
+        from ..rules.config.json_config_adapter import JSONFile
+
+        assert get_format('x.YML').__name__ == 'YAMLFile'
+        assert format_names() == ['json', 'toml', 'yaml']
+        with pytest.raises(RuleParserError):
+            get_format('rule.ini')
+
+        monkeypatch.setitem(_FORMATS, '.jsn', ())
+        register_format('.jsn', JSONFile) # pyright: ignore
+        f = tmp_path / 'rule.jsn'
+        f.write_text('{"a": {"b": 2}}')
+        assert Rule(str(f))['a/b'] == 2
@@ -0,0 +1,89 @@
+from __future__ import annotations
+from ..scan import PathMatcher, Scanner, scan
+from pathlib import Path
+import pytest, os
+
+@pytest.mark.parametrize('patterns,path,is_dir,expected', [
+    (['*.log'], 'a/b/c.log', False, True),
+    (['*.log'], 'a/b/c.txt', False, None),
+    (['/build'], 'build', True, True),
+    (['/build'], 'src/build', True, None),
+    (['a/*.c'], 'a/x.c', False, True),
+    (['a/*.c'], 'a/b/x.c', False, None),
+    (['**/cache'], 'x/y/cache', True, True),
+    (['a/**/z'], 'a/z', False, True),
+    (['a/**/z'], 'a/b/c/z', False, True),
+    (['docs/**'], 'docs/x/y', False, True),
+    (['node_modules/'], 'node_modules', False, None),
+    (['node_modules/'], 'p/node_modules', True, True),
+    (['*.log', '!keep.log'], 'keep.log', False, False),
+    (['!keep.log', '*.log'], 'keep.log', False, True),
+    (['[ab].txt'], 'b.txt', False, True),
+    (['[!ab].txt'], 'b.txt', False, None),
+    (['# comment', ''], 'anything', False, None),
+    (['\\#name'], '#name', False, True)
+])
+def test_matcher(patterns: list[str], path: str, is_dir: bool, expected):
+    assert PathMatcher(patterns).match(path, is_dir) == expected
+
+@pytest.fixture
+def tree(tmp_path: Path) -> Path:
+    root = tmp_path / 'tree'
+    for name in ('a.txt', 'b.log', 'sub/c.txt', 'sub/deep/d.txt', 'sub/deep/e.log',
+                 'node_modules/pkg/index.js', 'z/f.txt'):
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+    return root
+
+def _names(it) -> list[str]:
+    return [entry.arcname for entry in it]
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_scan_order(tree: Path, threads: int):
+    names = _names(Scanner(threads=threads).scan(tree))
+    expected = ['tree']
+    for dirpath, dirnames, filenames in os.walk(tree):
+        rel = os.path.relpath(dirpath, tree.parent)
+        expected += [f"{rel}/{name}" for name in dirnames + filenames]
+    assert sorted(names) == sorted(expected)
+
+    # Depth first, in sorted order
+    assert names[:4] == ['tree', 'tree/a.txt', 'tree/b.log', 'tree/node_modules']
+
+def test_exclude_include(tree: Path):
+    names = _names(scan([tree], exclude=['node_modules/', '/tree/z'], include=['*.txt']))
+    assert names == ['tree', 'tree/a.txt', 'tree/sub', 'tree/sub/c.txt',
+                     'tree/sub/deep', 'tree/sub/deep/d.txt']
+
+def test_gitignore(tree: Path):
+    (tree / 'sub' / '.gitignore').write_text("*.log\ndeep/\n")
+    (tree / '.gitignore').write_text("/z\n")
+    names = _names(scan([tree], exclude=['!z'], gitignore=True))
+    assert 'tree/sub/deep' not in names
+    assert 'tree/b.log' in names
+    assert 'tree/z/f.txt' in names
+
+    names = _names(scan([tree], gitignore=True))
+    assert 'tree/z' not in names
+
+def test_stat(tree: Path):
+    entry = next(e for e in scan([tree]) if e.arcname == 'tree/a.txt')
+    assert entry.is_file and not entry.is_dir
+    assert entry.stat.st_size == len('a.txt')
+
+def test_scan_paths(tree: Path):
+    scanner = Scanner(exclude=['node_modules/'], include=['*.txt'])
+    paths = [str(tree / 'a.txt'), str(tree / 'b.log'), str(tree / 'sub'),
+             str(tree / 'sub' / 'c.txt'), str(tree / 'node_modules' / 'pkg'),
+             str(tree / 'gone.txt'), str(tree.parent / 'elsewhere')]
+    names = _names(scanner.scan_paths(tree, paths))
+    assert names == ['tree/a.txt', 'tree/sub', 'tree/sub/c.txt',
+                     'tree/sub/deep', 'tree/sub/deep/d.txt']
+
+    # A change above the source rescans all of it
+    assert _names(scanner.scan_paths(tree, [str(tree.parent)])) == \
+        _names(scanner.scan(tree))
+
+    with pytest.raises(ValueError):
+        list(Scanner(gitignore=True).scan_paths(tree, []))
@@ -0,0 +1,41 @@
+from ..schedule import Schedule
+from datetime import datetime
+import pytest
+
+def test_parse():
+    s = Schedule('*/15 2-4 * jan,Jul mon-fri')
+    assert s.minutes == {0, 15, 30, 45}
+    assert s.hours == {2, 3, 4}
+    assert s.months == {1, 7}
+    assert s.weekdays == {0, 1, 2, 3, 4}
+
+    assert Schedule('0 0 * * 0').weekdays == Schedule('0 0 * * 7').weekdays == {6}
+    assert Schedule('@daily').minutes == {0}
+    assert Schedule('5/20 * * * *').minutes == {5, 25, 45}
+
+@pytest.mark.parametrize('expr', ['', '* * * *', '60 * * * *', '* * * foo *',
+                                  '5-1 * * * *', '*/0 * * * *'])
+def test_invalid(expr: str):
+    with pytest.raises(ValueError):
+        Schedule(expr)
+
+def test_matches():
+    s = Schedule('30 3 * * *')
+    assert s.matches(datetime(2024, 5, 1, 3, 30, 59))
+    assert not s.matches(datetime(2024, 5, 1, 3, 31))
+
+    # Either day field matches when both are restricted
+    s = Schedule('0 0 13 * fri')
+    assert s.matches(datetime(2024, 5, 13))     # a Monday
+    assert s.matches(datetime(2024, 5, 17))     # a Friday
+    assert not s.matches(datetime(2024, 5, 14))
+
+def test_next_after():
+    s = Schedule('0 3 * * *')
+    assert s.next_after(datetime(2024, 5, 1, 2, 59)) == datetime(2024, 5, 1, 3, 0)
+    assert s.next_after(datetime(2024, 5, 1, 3, 0)) == datetime(2024, 5, 2, 3, 0)
+    assert Schedule('@yearly').next_after(datetime(2024, 12, 31, 23, 59)) == datetime(2025, 1, 1)
+    assert Schedule('0 0 29 2 *').next_after(datetime(2024, 3, 1)) == datetime(2028, 2, 29)
+
+    with pytest.raises(ValueError):
+        Schedule('0 0 30 2 *').next_after(datetime(2024, 1, 1))
@@ -0,0 +1,164 @@
+from __future__ import annotations
+from argparse import Namespace
+from ..archive import DELETED_MEMBER
+from ..archive.seekable import (ArchiveError, ArchiveSet, SeekableArchive, extract_members,
+                                find_archives, is_seekable, write_seekable)
+from ..manifest import Manifest
+from .._path import DATAPATHS
+from pathlib import Path
+from .conftest import random_bytes
+import pytest, os
+
+@pytest.fixture
+def tree_files() -> dict[str, str | bytes]:
+    return {'a.txt': "a" * 1000, 'sub/b.bin': random_bytes(50000), 'sub/c.txt': "c"}
+
+@pytest.fixture
+def tree(tree: Path) -> Path:
+    (tree / 'link').symlink_to('a.txt')
+    return tree
+
+def _write(tree: Path, filename: Path, **kwargs) -> Path:
+    with open(filename, 'wb') as fd:
+        write_seekable(fd, [tree], **kwargs)
+    return filename
+
+@pytest.mark.parametrize('codec', ['none', 'gz', 'bz2', 'xz'])
+@pytest.mark.parametrize('threads', [1, 3])
+def test_roundtrip(tree: Path, tmp_path: Path, codec: str, threads: int):
+    filename = _write(tree, tmp_path / 'out.jbk', codec=codec, frame_size=4096, threads=threads)
+    assert is_seekable(filename)
+    assert not is_seekable(tree / 'a.txt')
+
+    with SeekableArchive(filename) as archive:
+        assert [entry.path for entry in archive] == \
+            ['tree', 'tree/a.txt', 'tree/link', 'tree/sub', 'tree/sub/b.bin', 'tree/sub/c.txt']
+        entry = archive.get('tree/sub/b.bin')
+        assert entry is not None and entry.is_file and entry.size == 50000
+        assert archive.read_bytes(entry) == (tree / 'sub' / 'b.bin').read_bytes()
+
+        link = archive.get('tree/link')
+        assert link is not None and link.is_symlink
+        assert archive.read_bytes(link) == b'a.txt'
+        assert archive.get('tree/missing') is None
+
+def test_list(tree: Path, tmp_path: Path):
+    (tree / 'subdir').mkdir()
+    (tree / 'subdir' / 'd.txt').write_text("d")
+    with SeekableArchive(_write(tree, tmp_path / 'out.jbk')) as archive:
+        # A prefix of a name is not a parent
+        assert [entry.path for entry in archive.list('tree/sub')] == \
+            ['tree/sub', 'tree/sub/b.bin', 'tree/sub/c.txt']
+        assert [entry.path for entry in archive.list('tree/a.txt')] == ['tree/a.txt']
+        assert list(archive.list('tree/none')) == []
+
+def test_corrupt(tree: Path, tmp_path: Path):
+    filename = _write(tree, tmp_path / 'out.jbk', codec='none')
+    with SeekableArchive(filename) as archive:
+        entry = archive.get('tree/a.txt')
+        assert entry is not None
+        offset = entry.offset
+
+    with open(filename, 'r+b') as fd:
+        fd.seek(offset + 20)
+        fd.write(b'b')
+    with SeekableArchive(filename) as archive:
+        entry = archive.get('tree/a.txt')
+        assert entry is not None
+        with pytest.raises(ArchiveError):
+            archive.read_bytes(entry)
+
+    filename.write_bytes(b'not an archive')
+    with pytest.raises(ArchiveError):
+        SeekableArchive(filename)
+
+def _rule(tmp_path: Path, tree: Path, dest: Path) -> Path:
+    rulefile = tmp_path / 'seek.toml'
+    rulefile.write_text(f"""[archive]
+sources = ["@type path {tree}"]
+destination = "@type path {dest}"
+format = "seekable"
+incremental = true
+checksums = true
+""")
+    return rulefile
+
+def test_incremental(tree: Path, tmp_path: Path):
+    from ..actions import load_action
+    from ..rules import Rule
+
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    rulefile = _rule(tmp_path, tree, dest)
+    cls = load_action(DATAPATHS['builtin'] / 'actions' / 'archive.py', 'archive')
+    cls(Rule(str(rulefile))).run()
+    (tree / 'a.txt').write_text("changed")
+    (tree / 'sub' / 'c.txt').unlink()
+    cls(Rule(str(rulefile))).run()
+
+    archives = find_archives(dest, 'seek')
+    assert len(archives) == 2 and archives[0].name.endswith('-incr.jbk')
+    with SeekableArchive(archives[0]) as archive:
+        assert archive.deleted() == ['tree/sub/c.txt']
+        assert archive.get(DELETED_MEMBER) is not None
+
+    with ArchiveSet(archives) as archives:
+        members = archives.list()
+        assert [entry.path for _, entry in members] == \
+            ['tree', 'tree/a.txt', 'tree/link', 'tree/sub', 'tree/sub/b.bin']
+        assert extract_members(members, tmp_path / 'restored') == 5
+
+    restored = tmp_path / 'restored' / 'tree'
+    assert (restored / 'a.txt').read_text() == "changed"
+    assert (restored / 'sub' / 'b.bin').read_bytes() == (tree / 'sub' / 'b.bin').read_bytes()
+    assert os.readlink(restored / 'link') == 'a.txt'
+    assert not (restored / 'sub' / 'c.txt').exists()
+    assert (restored / 'sub').stat().st_mtime_ns == (tree / 'sub').stat().st_mtime_ns
+
+def test_verify(tree: Path, tmp_path: Path):
+    from ..actions import load_action
+    from ..rules import Rule
+    from ..verify import checksum_file, verify
+
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    cls = load_action(DATAPATHS['builtin'] / 'actions' / 'archive.py', 'archive')
+    cls(Rule(str(_rule(tmp_path, tree, dest)))).run()
+
+    archive, = find_archives(dest, 'seek')
+    manifest = Manifest.load(checksum_file(archive))
+    assert verify(archive, threads=2).ok
+
+    manifest.entries['tree/a.txt'] = manifest.entries['tree/a.txt']._replace(hash='0' * 64)
+    assert verify(archive, manifest=manifest).corrupt == ['tree/a.txt']
+
+def test_unsafe_path(tree: Path, tmp_path: Path):
+    with SeekableArchive(_write(tree, tmp_path / 'out.jbk')) as archive:
+        entry = archive.get('tree/a.txt')
+        assert entry is not None
+        with pytest.raises(ArchiveError):
+            extract_members([(archive, entry._replace(path='../a.txt'))], tmp_path / 'to')
+
+def test_commands(tree: Path, tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    from ..__main__ import ls, restore
+
+    filename = _write(tree, tmp_path / 'out.jbk')
+    assert ls(Namespace(TARGET=str(filename), PATH='tree/sub', long=False)) == 0
+    assert capsys.readouterr().out.split() == ['tree/sub', 'tree/sub/b.bin', 'tree/sub/c.txt']
+
+    assert ls(Namespace(TARGET=str(filename), PATH='tree/a.txt', long=True)) == 0
+    assert capsys.readouterr().out.startswith('-rw')
+    assert ls(Namespace(TARGET=str(filename), PATH='tree/none', long=False)) == 1
+
+    def args(**kwargs) -> Namespace:
+        options = {'TARGET': str(filename), 'SNAPSHOT': None, 'path': None, 'glob': None,
+                   'to': tmp_path / 'to', 'jobs': 2, 'repository': None, 'archives': False}
+        options.update(kwargs)
+        return Namespace(**options)
+
+    to = tmp_path / 'to'
+    assert restore(args(path=['tree/sub/c.txt', '/tree/a.txt'])) == 0
+    assert sorted(str(p.relative_to(to)) for p in to.rglob('*')) == \
+        ['tree', 'tree/a.txt', 'tree/sub', 'tree/sub/c.txt']
+    assert restore(args(path=['tree/none'])) == 1
+    assert restore(args(TARGET='no-such-rule')) == 1
@@ -0,0 +1,30 @@
+from __future__ import annotations
+from pathlib import Path
+import pytest, subprocess, sys, os
+
+BENCHMARK = Path(__file__).parents[2] / 'benchmarks' / 'startup.py'
+
+def test_import_is_lazy():
+    code = "import sys, jbackup; print(' '.join(sys.modules))"
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                          check=True)
+    modules = set(proc.stdout.split())
+    assert 'yaml' not in modules
+    assert 'logging.config' not in modules
+    assert 'jbackup.rules' not in modules
+
+def test_parser_does_not_scan(tmp_path: Path):
+    # Building the parser must not touch the data path indexes
+    env = dict(os.environ, JBACKUP_CACHE_DIR=str(tmp_path))
+    subprocess.run([sys.executable, '-m', 'jbackup', '--path'], env=env,
+                   capture_output=True, check=True)
+    assert not (tmp_path / 'index').exists()
+
+# Wall-clock budgets depend on the machine and its load
+@pytest.mark.skipif(not os.getenv('JBACKUP_BENCHMARKS'), reason="JBACKUP_BENCHMARKS is not set")
+@pytest.mark.skipif(not BENCHMARK.exists(), reason="benchmarks are not installed")
+def test_startup_budget():
+    # Budgets are scaled up to tolerate slow test machines
+    proc = subprocess.run([sys.executable, str(BENCHMARK), '--check', '--repeat', '1',
+                           '--scale', '4'], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
@@ -0,0 +1,148 @@
+from __future__ import annotations
+from argparse import Namespace
+from ..store import ChunkStore, StoreError
+from ..store.chunker import chunk_stream, find_boundary
+from .._path import DATAPATHS
+from pathlib import Path
+from .conftest import random_bytes
+import pytest, io
+
+class TestChunker:
+    def test_sizes(self):
+        data = random_bytes(200000)
+        chunks = list(chunk_stream(io.BytesIO(data), 1024, 4096, 16384))
+        assert b"".join(chunks) == data
+        assert all(1024 <= len(c) <= 16384 for c in chunks[:-1])
+
+    def test_short(self):
+        assert find_boundary(b"abc", 1024, 4096, 16384) == 3
+        assert list(chunk_stream(io.BytesIO(b""), 1024, 4096, 16384)) == []
+
+    def test_shift(self):
+        # Inserting bytes at the start only changes the first chunks
+        data = random_bytes(200000)
+        before = list(chunk_stream(io.BytesIO(data), 1024, 4096, 16384))
+        after = list(chunk_stream(io.BytesIO(b"inserted" + data), 1024, 4096, 16384))
+        assert len(set(before) & set(after)) >= len(before) - 2
+
+    @pytest.mark.parametrize('sizes', [(1024, 4096, 16384), (16, 32, 64)])
+    def test_numpy(self, sizes: tuple[int, int, int], monkeypatch: pytest.MonkeyPatch):
+        # The vectorised search finds the same boundaries, across blocks too
+        from ..store import chunker
+
+        pytest.importorskip('numpy')
+        monkeypatch.setattr(chunker, '_SEARCH_BLOCK', 1000)
+        data = memoryview(random_bytes(200000))
+        min_size, avg_size, max_size = sizes
+        mask = chunker._boundary_mask(avg_size)
+        offset = 0
+        while len(data) - offset > min_size:
+            end = min(len(data) - offset, max_size)
+            cut = chunker._search_python(data[offset:], min_size, end, mask)
+            assert chunker._search_numpy(data[offset:], min_size, end, mask) == cut
+            offset += cut
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            list(chunk_stream(io.BytesIO(b"x"), 4096, 1024, 16384))
+
+@pytest.fixture
+def tree_files() -> dict[str, str | bytes]:
+    return {'a.bin': random_bytes(300000, 1), 'sub/b.bin': random_bytes(100000, 2)}
+
+class TestStore:
+    def _store(self, path: Path) -> ChunkStore:
+        store = ChunkStore(path, create=True)
+        store.chunk_sizes = (1024, 4096, 16384)
+        return store
+
+    def test_missing(self, tmp_path: Path):
+        with pytest.raises(StoreError):
+            ChunkStore(tmp_path / 'none')
+
+    def test_put_get(self, tmp_path: Path):
+        with ChunkStore(tmp_path / 'store', create=True) as store:
+            digest, new = store.put(b"hello")
+            assert new and store.put(b"hello") == (digest, False)
+            assert store.get(digest) == b"hello"
+
+        with ChunkStore(tmp_path / 'store') as store:
+            assert len(store) == 1
+            assert store.get(digest) == b"hello"
+
+    def test_snapshot(self, tree: Path, tmp_path: Path):
+        with self._store(tmp_path / 'store') as store:
+            snap, stats = store.snapshot('rule', [tree])
+            assert (stats.files, stats.unchanged) == (2, 0)
+            assert stats.new_bytes == 400000
+            assert b"".join(store.read_file(snap, 'tree/a.bin')) == (tree / 'a.bin').read_bytes()
+
+            # Nothing changed: nothing is read or stored
+            _, stats = store.snapshot('rule', [tree], previous=snap)
+            assert (stats.files, stats.unchanged, stats.new_chunks) == (0, 2, 0)
+
+            # A small edit only stores the chunks around it
+            data = bytearray((tree / 'a.bin').read_bytes())
+            data[150000:150010] = b"x" * 10
+            (tree / 'a.bin').write_bytes(data)
+            snap2, stats = store.snapshot('rule', [tree], previous=store.load_snapshot('rule'))
+            assert stats.files == 1 and stats.new_bytes < 50000
+            assert b"".join(store.read_file(snap2, 'tree/a.bin')) == bytes(data)
+
+            assert len(store.snapshots('rule')) == 3
+
+    def test_old_snapshot(self, tmp_path: Path):
+        # Version 1 snapshots have no modes, directories or links
+        from ..store import Snapshot
+
+        snapfile = tmp_path / 'old.jsonl'
+        snapfile.write_text('{"version": 1, "rule": "r", "name": "n"}\n'
+                            '["a.txt", 1, 0, 0, "' + 'ab' * 32 + '", ["' + 'cd' * 32 + '"]]\n')
+        snap = Snapshot.load(snapfile)
+        assert list(snap.manifest.entries) == ['a.txt']
+        assert snap.modes == {} and snap.members == {}
+
+    def test_action(self, tree: Path, tmp_path: Path):
+        from ..actions import load_action
+        from ..rules import Rule
+
+        rulefile = tmp_path / 'snap.toml'
+        rulefile.write_text(f"""[snapshot]
+sources = ["@type path {tree}"]
+repository = "@type path {tmp_path / 'store'}"
+""")
+
+        cls = load_action(DATAPATHS['builtin'] / 'actions' / 'snapshot.py', 'snapshot')
+        cls(Rule(str(rulefile))).run()
+
+        with ChunkStore(tmp_path / 'store') as store:
+            snap = store.load_snapshot('snap')
+            assert snap is not None
+            assert sorted(snap.chunks) == ['tree/a.bin', 'tree/sub/b.bin']
+
+def test_diff_command(tmp_path: Path, capsys: pytest.CaptureFixture):
+    from ..__main__ import diff
+
+    src = tmp_path / 'src'
+    (src / 'sub').mkdir(parents=True)
+    (src / 'a.txt').write_text("a")
+    (src / 'sub' / 'b.txt').write_text("b")
+    repo = tmp_path / 'repo'
+    with ChunkStore(repo, create=True) as store:
+        first, _ = store.snapshot('rule', [src])
+        (src / 'a.txt').write_text("changed")
+        (src / 'sub' / 'b.txt').unlink()
+        (src / 'c.txt').write_text("c")
+        second, _ = store.snapshot('rule', [src], previous=first)
+
+    args = Namespace(RULE='rule', SNAPSHOT=[], repository=repo)
+    assert diff(args) == 0
+    assert capsys.readouterr().out.splitlines() == \
+        ['M src/a.txt', 'A src/c.txt', 'D src/sub/b.txt']
+
+    args = Namespace(RULE='rule', SNAPSHOT=[second.name, second.name], repository=repo)
+    assert diff(args) == 0
+    assert capsys.readouterr().out == ""
+
+    args = Namespace(RULE='rule', SNAPSHOT=['nope'], repository=repo)
+    assert diff(args) == 1
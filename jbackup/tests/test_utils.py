@@ -139,6 +139,27 @@ def test_xdict_container() -> None:
     with pytest.raises(KeyError):
         ctn['employees/Joe']
 
+def test_xdict_index() -> None:
+    ctn = XDictContainer({
+        'a': {'b': {'c': 1}, 'list': [{'x': 2}]},
+        'top': 3
+    })
+
+    index = ctn.build_index()
+    assert index['a/b/c'] == 1
+    assert 'a/list' in index and 'a/list/x' not in index
+    assert ctn.get('a/b') == {'c': 1}
+    assert ctn['a/b/c'] == 1
+    assert ctn.get('a/list/x', 'none') == 'none'
+
+    with pytest.raises(KeyError):
+        ctn['a/b/d']
+
+    # The same results as without the index
+    paths = [r.path for r in ctn if r.path is not None] + ['a/x', 'x/y', 'a//b']
+    plain = XDictContainer(ctn.data)
+    assert all(ctn.get(p) == plain.get(p) for p in paths)
+
 def test_chdir() -> None:
     from ..utils import chdir, DirectoryNotFoundError
 
@@ -0,0 +1,145 @@
+from __future__ import annotations
+from .. import verify as verify_module
+from ..manifest import Manifest
+from ..verify import checksum_file, hash_file, hash_files, make_checksums, verify
+from .._path import DATAPATHS
+from pathlib import Path
+from .conftest import random_bytes
+import pytest, hashlib
+
+@pytest.fixture
+def tree_files() -> dict[str, str | bytes]:
+    files: dict[str, str | bytes] = {f"f{i}.txt": f"file {i}\n" * (i + 1) for i in range(20)}
+    files['sub/big.bin'] = random_bytes(300000)
+    return files
+
+def _blake(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+def test_hash_file(tree: Path, monkeypatch: pytest.MonkeyPatch):
+    big = tree / 'sub' / 'big.bin'
+    expected = (300000, _blake(big.read_bytes()))
+    assert hash_file(big) == expected
+
+    # Mapped into memory
+    monkeypatch.setattr(verify_module, 'MMAP_THRESHOLD', 1000)
+    assert hash_file(big) == expected
+
+    paths = sorted(tree.glob('*.txt'))
+    assert [path for path, _, _ in hash_files(paths, threads=4)] == list(map(str, paths))
+
+def test_directory(tree: Path):
+    make_checksums(tree).save(checksum_file(tree))
+    assert verify(tree).ok
+
+    (tree / 'f3.txt').write_text("tampered")
+    (tree / 'f4.txt').unlink()
+    result = verify(tree, threads=3)
+    assert result.corrupt == ['f3.txt']
+    assert result.missing == ['f4.txt']
+    assert result.checked == 20
+
+    # A sample is a given share of the files
+    result = verify(tree, sample=25, seed=1)
+    assert result.checked + len(result.missing) == 6
+
+def test_archive(tree: Path, tmp_path: Path):
+    from ..actions import load_action
+    from ..rules import Rule
+
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    rulefile = tmp_path / 'checked.toml'
+    rulefile.write_text(f"""[archive]
+sources = ["@type path {tree}"]
+destination = "@type path {dest / 'backup.tar.gz'}"
+checksums = true
+""")
+    cls = load_action(DATAPATHS['builtin'] / 'actions' / 'archive.py', 'archive')
+    cls(Rule(str(rulefile))).run()
+
+    archive = dest / 'backup.tar.gz'
+    manifest = Manifest.load(checksum_file(archive))
+    assert len(manifest) == 21
+    result = verify(archive, threads=2)
+    assert result.ok and result.checked == 21
+
+    # A manifest that disagrees with the archive
+    entry = manifest.entries['tree/f1.txt']
+    manifest.entries['tree/f1.txt'] = entry._replace(hash=_blake(b'other'))
+    manifest.entries['tree/gone'] = entry._replace(path='tree/gone')
+    result = verify(archive, manifest=manifest)
+    assert result.corrupt == ['tree/f1.txt']
+    assert result.missing == ['tree/gone']
+
+def test_truncated_archive(tree: Path, tmp_path: Path, caplog: pytest.LogCaptureFixture):
+    from argparse import Namespace
+    from ..__main__ import verify as verify_command
+    from ..archive import write_archive
+    from ..archive.seekable import write_seekable
+
+    tar, seekable = tmp_path / 'backup.tar.gz', tmp_path / 'backup.jbk'
+    for archive, write in ((tar, write_archive), (seekable, write_seekable)):
+        checksums = Manifest()
+        with open(archive, 'wb') as fd:
+            write(fd, [tree], checksums=checksums) # pyright: ignore
+        checksums.save(checksum_file(archive))
+        data = archive.read_bytes()
+        archive.write_bytes(data[:len(data) // 2])
+
+    # The big file, which comes last, is cut short
+    result = verify(tar)
+    assert result.corrupt == ['tree/sub/big.bin']
+    assert result.checked == 20 and not result.missing
+
+    # The files after the damage are missing
+    tar.write_bytes(tar.read_bytes()[:30])
+    result = verify(tar)
+    assert result.checked == 0 and len(result.missing) == 21
+
+    result = verify(seekable)
+    assert result.missing == sorted(Manifest.load(checksum_file(seekable)).entries)
+
+    args = Namespace(TARGET=tar, sample=100.0, manifest=None, path=None, jobs=None)
+    assert verify_command(args) == 1
+    assert "failed verification" in caplog.text
+
+def test_chain(tree: Path, tmp_path: Path):
+    from ..actions import load_action
+    from ..actions.chain import ActionChain
+    from ..rules import Rule
+
+    dest = tmp_path / 'out'
+    dest.mkdir()
+    rulefile = tmp_path / 'chained.toml'
+    rulefile.write_text(f"""[archive]
+sources = ["@type path {tree}"]
+
+[copy]
+destination = "@type path {dest / 'backup.tar.gz'}"
+checksums = true
+""")
+    classes = [(name, load_action(DATAPATHS['builtin'] / 'actions' / f"{name}.py", name))
+               for name in ('archive', 'copy')]
+    ActionChain(classes)(Rule(str(rulefile))).run() # pyright: ignore
+
+    # The checksum covers the whole file
+    archive = dest / 'backup.tar.gz'
+    assert list(Manifest.load(checksum_file(archive)).entries) == ['backup.tar.gz']
+    assert verify(archive).ok
+
+    with open(archive, 'r+b') as fd:
+        fd.seek(100)
+        fd.write(b'\xff\xff')
+    assert verify(archive).corrupt == ['backup.tar.gz']
+
+def test_verify_paths(tmp_path: Path):
+    for name in ('a/one', 'a/two', 'b/three'):
+        (tmp_path / 'd' / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / 'd' / name).write_text(name)
+    manifest = make_checksums(tmp_path / 'd')
+    (tmp_path / 'd' / 'b' / 'three').write_text("corrupt")
+
+    assert verify(tmp_path / 'd', manifest=manifest, paths=['a/']).checked == 2
+    assert verify(tmp_path / 'd', manifest=manifest, paths=['a']).ok
+    assert not verify(tmp_path / 'd', manifest=manifest, paths=['b']).ok
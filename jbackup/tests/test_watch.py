@@ -0,0 +1,96 @@
+from __future__ import annotations
+from ..journal import ChangeJournal, JournalError
+from ..watch import Watcher, inotify_available
+from pathlib import Path
+import time
+import pytest
+
+@pytest.fixture
+def settled(monkeypatch: pytest.MonkeyPatch) -> None:
+    from .. import journal
+    monkeypatch.setattr(journal, 'SETTLE_TIME', 0.0)
+
+class TestJournal:
+    def test_changes_since(self, tmp_path: Path, settled):
+        src = tmp_path / 'src'
+        journal = ChangeJournal('rule')
+        assert journal.changes_since(time.time(), [src]) is None
+
+        journal.start([tmp_path])
+        with pytest.raises(JournalError):
+            ChangeJournal('rule').start([tmp_path])
+
+        # Not trusted before the watch is ready
+        assert journal.changes_since(time.time(), [src]) is None
+        journal.ready()
+        since = time.time()
+        assert journal.changes_since(since, [src]) == set()
+        assert journal.changes_since(since, ['/elsewhere']) is None
+
+        journal.record([str(src / 'a'), str(tmp_path / 'other')], since - 1)
+        journal.record([str(src / 'b'), str(src / 'b')], since + 1)
+        assert ChangeJournal('rule').changes_since(since, [src]) == {str(src / 'b')}
+
+        journal.overflow(since + 2)
+        assert journal.changes_since(since, [src]) is None
+        assert journal.changes_since(since + 3, [src]) == set()
+
+        journal.prune(since)
+        assert len(journal.path.read_text().splitlines()) == 3
+
+        journal.stop()
+        assert not ChangeJournal('rule').is_live()
+        assert journal.changes_since(since + 3, [src]) is None
+
+@pytest.mark.skipif(not inotify_available(), reason="needs inotify")
+class TestWatcher:
+    def _poll(self, watcher: Watcher) -> None:
+        while watcher.poll(0.2):
+            pass
+        watcher.flush()
+
+    def test_watch(self, tmp_path: Path, settled):
+        root = tmp_path / 'root'
+        (root / 'sub').mkdir(parents=True)
+        (root / 'sub' / 'old.txt').write_text("old")
+        (tmp_path / 'single.txt').write_text("single")
+        (tmp_path / 'sibling.txt').write_text("sibling")
+
+        watcher = Watcher({'rule': [root, tmp_path / 'single.txt']})
+        watcher.start()
+        try:
+            since = time.time()
+            journal = ChangeJournal('rule')
+            assert journal.changes_since(since, [root]) == set()
+
+            (root / 'sub' / 'old.txt').write_text("changed")
+            (root / 'new').mkdir()
+            (root / 'new' / 'deep').mkdir()
+            (root / 'new' / 'deep' / 'f.txt').write_text("f")
+            (tmp_path / 'single.txt').write_text("changed")
+            (tmp_path / 'sibling.txt').write_text("changed")
+            self._poll(watcher)
+
+            changes = journal.changes_since(since, [root, tmp_path / 'single.txt'])
+            assert changes is not None
+            assert {str(root / 'sub' / 'old.txt'), str(root / 'new'),
+                    str(tmp_path / 'single.txt')} <= changes
+            assert str(tmp_path / 'sibling.txt') not in changes
+
+            # The new directory is watched too
+            since = time.time()
+            (root / 'new' / 'deep' / 'g.txt').write_text("g")
+            self._poll(watcher)
+            assert journal.changes_since(since, [root]) == {str(root / 'new' / 'deep' / 'g.txt')}
+
+            # Removing a root ends its journal
+            (root / 'sub' / 'old.txt').unlink()
+            (root / 'sub').rmdir()
+            for path in sorted((root / 'new').rglob('*'), reverse=True):
+                path.rmdir() if path.is_dir() else path.unlink()
+            (root / 'new').rmdir()
+            root.rmdir()
+            self._poll(watcher)
+            assert journal.changes_since(since, [root]) is None
+        finally:
+            watcher.stop()
@@ -4,13 +4,13 @@ from __future__ import annotations
 from typing import TYPE_CHECKING, Protocol, cast, Generic, TypeVar, Type, Any
 from collections import namedtuple
 from pathlib import Path
-from ._path import DATAPATHS
+from ._index import get_index
 import os, itertools
 
 T = TypeVar('T')
 
 if TYPE_CHECKING:
-    from typing import Optional, Iterable, Literal, AnyStr
+    from typing import Callable, Optional, Iterable, Literal, AnyStr
 
 __all__ = [
     # Classes
@@ -180,11 +180,13 @@ class Nil: # pragma: no cover
 
 XDictMapping = dict[str, Any]
 
+_NIL = Nil()
+
 class XDictContainer:
     """An extended dictionary."""
 
     class XDictIterator:
-        XDictIteratorResult = namedtuple('XDictIteratorResult', ['key', 'value', 'parent'])
+        XDictIteratorResult = namedtuple('XDictIteratorResult', ['key', 'value', 'parent', 'path'])
 
         def __init__(self, xdict: XDictContainer):
             self.__obj = xdict
@@ -196,37 +198,146 @@ class XDictContainer:
         def _construct(self) -> None:
             node = self.__obj.data
             parent = node
-            stack: list[tuple[str | int, Any, XDictMapping | list[Any]]] \
-                = [(k, v, parent) for k, v in reversed(node.items())]
+            stack: list[tuple[str | int, Any, XDictMapping | list[Any], Optional[str]]] \
+                = [(k, v, parent, k) for k, v in reversed(node.items())]
 
             self.__stack = stack
 
         def __next__(self):
-            # Return key and value
+            # Return key, value and the slash-separated path of the
+            # value, which is None for values inside lists
             stack = self.__stack
 
             if stack:
-                key, node, parent = stack.pop()
+                key, node, parent, path = stack.pop()
 
                 if isinstance(node, dict):
                     node = cast(dict[str, Any], node)
-                    stack.extend([(k, v, node) for k, v in reversed(node.items())])
+                    stack.extend([(k, v, node, None if path is None else f"{path}/{k}")
+                                  for k, v in reversed(node.items())])
                 elif isinstance(node, list):
                     node = cast(list[Any], node)
                     i = len(node) - 1
                     for v in reversed(node):
-                        stack.append((i, v, node))
+                        stack.append((i, v, node, None))
                         i -= 1
 
-                return self.XDictIteratorResult(key, node, parent)
+                return self.XDictIteratorResult(key, node, parent, path)
 
             raise StopIteration
 
     def __iter__(self):
         return self.XDictIterator(self)
 
-    def __init__(self, adict: dict[str, Any], /):
+    def __init__(self, adict: dict[str, Any], /, *,
+                 index: Optional[dict[str, Any]]=None,
+                 func: Optional[Callable[[str], Any]]=None):
+        """
+        Wrap the dictionary ADICT.
+
+        INDEX is an optional flat index of ADICT, mapping the
+        slash-separated path of every value to the value (see
+        build_index()).
+
+        FUNC, if given, converts the strings in ADICT. It is
+        called lazily: a value is converted the first time it
+        is looked up, and the result replaces it in ADICT. Strings
+        inside a list or table are converted along with it.
+        """
         self._data = adict
+        self._index = index
+        self._func = func
+        self._parsed: set[str] = set()
+
+    def build_index(self) -> dict[str, Any]:
+        """
+        Build the flat index of the container and return it.
+
+        Once built, looking up a path-string is a single
+        dictionary lookup instead of a walk through the
+        nested dictionaries. The index is not updated when
+        the underlying dictionary changes; call this again
+        or set_index() after changing it.
+        """
+        index: dict[str, Any] = {}
+
+        # Only tables are walked; values inside lists have no path
+        stack: list[tuple[str, dict[str, Any]]] = [("", self._data)]
+        while stack:
+            prefix, node = stack.pop()
+            for key, value in node.items():
+                path = prefix + key
+                index[path] = value
+                if isinstance(value, dict):
+                    stack.append((path + '/', value))
+
+        self._index = index
+        return index
+
+    def set_index(self, index: Optional[dict[str, Any]]) -> None:
+        """Set the flat index of the container, or remove it if INDEX is None."""
+        self._index = index
+
+    def parse_all(self) -> None:
+        """
+        Convert every string in the container now.
+
+        This is the eager counterpart of the lazy conversion
+        done by get(), for when a whole file should be checked
+        at once.
+        """
+        func = self._func
+        if func is None:
+            return
+
+        for key, value, parent, _ in self:
+            if isinstance(value, str):
+                parent[key] = func(value)
+
+        self._func = None
+        self._parsed.clear()
+        if self._index is not None:
+            self.build_index()
+
+    def _convert(self, value: Any) -> Any:
+        # Convert VALUE with FUNC; lists and tables are converted in place
+        func = self._func
+        assert func is not None
+        if isinstance(value, str):
+            return func(value)
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                value[i] = self._convert(item)
+        elif isinstance(value, dict):
+            for k, item in value.items():
+                value[k] = self._convert(item)
+        return value
+
+    def _parse(self, key: str, value: Any) -> Any:
+        # Convert the value at KEY once, and store the result
+        if key in self._parsed:
+            return value
+
+        value = self._convert(value)
+        parentkey, _, name = key.rpartition('/')
+        parent = self._data if not parentkey else self._lookup(parentkey, None)
+        if isinstance(parent, dict):
+            parent[name] = value
+        if self._index is not None:
+            self._index[key] = value
+        self._parsed.add(key)
+
+        return value
+
+    def _lookup(self, key: str, default: Any) -> Any:
+        # Look up KEY without converting it
+        if '/' not in key:
+            return self._data.get(key, default)
+
+        if self._index is not None:
+            return self._index.get(key, default)
+
+        return self._get_subkey(self._data, key, default)
 
     def get(self, key: str, default: Any=None, /) -> Any:
         """
@@ -241,15 +352,21 @@ class XDictContainer:
         value in the underlying dictionary.
         Its syntax is ``key/subkey1[/subkey2...]``.
         This method searches recursively inside the dictionary
-        for KEY until it finds a match.
+        for KEY until it finds a match, unless the container
+        has a flat index.
 
         If there is no value associated with KEY, DEFAULT
         is returned.
         """
-        if '/' not in key:
-            return self._data.get(key, default)
+        nil = _NIL
+        value = self._lookup(key, nil)
+        if value is nil:
+            return default
 
-        return self._get_subkey(self._data, key, default)
+        if self._func is not None:
+            value = self._parse(key, value)
+
+        return value
 
     @staticmethod
     def _get_subkey(dct: dict[str, Any], key: str, default: Any, /) -> Any:
@@ -282,7 +399,7 @@ class XDictContainer:
 
         # Get section for toplevel section, or SECTION
         nil = Nil()
-        value = self._get_subkey(self._data, key, nil)
+        value = self.get(key, nil)
         if value is nil:
             raise KeyError(f"'{key}' {value}")
 
@@ -389,25 +506,26 @@ def iter_nonempty(iterable: Iterable[AnyStr]) -> itertools.filterfalse[AnyStr]:
     return itertools.filterfalse(lambda x: len(x) == 0 or x.isspace(), iterable)
 
 def _list_available(what: Literal['actions', 'rules'],
-                    where: Literal['system', 'user'],
+                    where: Literal['system', 'user', 'builtin'],
                     _glob: str) -> list[str]:
-    _dir = DATAPATHS[where] / what
-    return [str(_file.stem) for _file in _dir.glob(_glob)]
+    return get_index(where, what).names(_glob)
 
-def list_available_actions(where: Literal['system', 'user']) -> list[str]:
+def list_available_actions(where: Literal['system', 'user', 'builtin']) -> list[str]:
     """
     Return a list of available actions under the given path.
 
-    WHERE specifies the kind of location to look in, either
-    the system directory or the user directory.
+    WHERE specifies the kind of location to look in: the
+    system directory, the user directory, or the directory
+    of the actions and rules that ship with jbackup.
     """
     return _list_available('actions', where, '*.py')
 
-def list_available_rules(where: Literal['system', 'user']) -> list[str]:
+def list_available_rules(where: Literal['system', 'user', 'builtin']) -> list[str]:
     """
     Return a list of available rules under the given path.
 
-    WHERE specifies the kind of location to look in, either
-    the system directory or the user directory.
+    WHERE specifies the kind of location to look in: the
+    system directory, the user directory, or the directory
+    of the actions and rules that ship with jbackup.
     """
     return _list_available('rules', where, '*.*')
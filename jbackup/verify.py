@@ -0,0 +1,333 @@
+"""
+Checksum manifests and verification of backups.
+
+A checksum manifest lists the files of a backup with their size
+and content hash, in the format of jbackup.manifest. It is kept
+next to what it describes: in a file named CHECKSUM_FILE inside
+a directory, or in a file with the suffix CHECKSUM_SUFFIX next
+to an archive. verify() checks a backup against its manifest.
+
+Files are hashed on a thread pool; hashlib releases the GIL while
+it hashes a large buffer, so the threads run in parallel. Large
+files are mapped into memory and hashed in one call, without
+copying their data through Python.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING, NamedTuple
+from .manifest import Manifest, new_hash
+import os, time
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from typing import Iterable, Iterator, Optional
+
+__all__ = [
+    # Classes
+    'VerifyResult',
+
+    # Functions
+    'checksum_file',
+    'hash_file',
+    'hash_files',
+    'make_checksums',
+    'verify',
+
+    # Variables
+    'CHECKSUM_FILE',
+    'CHECKSUM_SUFFIX',
+    'DEFAULT_HASH_THREADS',
+    'MMAP_THRESHOLD'
+]
+
+CHECKSUM_FILE = '.jbackup-manifest'
+CHECKSUM_SUFFIX = '.manifest'
+
+DEFAULT_HASH_THREADS = min(os.cpu_count() or 1, 8)
+
+# Files at least this large are mapped instead of read
+MMAP_THRESHOLD = 4 * 1024 * 1024
+
+_BUFFER_SIZE = 1024 * 1024
+
+# Archive members up to this size are hashed on the pool
+_INLINE_LIMIT = 8 * 1024 * 1024
+
+class VerifyResult(NamedTuple):
+    """The outcome of a verification."""
+
+    checked: int
+    bytes: int
+    seconds: float
+    missing: list[str]
+    corrupt: list[str]
+
+    @property
+    def ok(self) -> bool:
+        """Whether every file that was checked is intact."""
+        return not (self.missing or self.corrupt)
+
+    @property
+    def throughput(self) -> float:
+        """The bytes checked per second."""
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+def checksum_file(target: str | Path) -> Path:
+    """Return the checksum manifest of TARGET, a directory or a file."""
+    target = Path(target)
+    if target.is_dir():
+        return target / CHECKSUM_FILE
+    return target.with_name(target.name + CHECKSUM_SUFFIX)
+
+def hash_file(path: str | Path) -> tuple[int, str]:
+    """Return the size and hash of the file PATH."""
+    h = new_hash()
+    with open(path, 'rb', buffering=0) as fd:
+        size = os.fstat(fd.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            import mmap
+
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if hasattr(m, 'madvise'):
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+                h.update(m)
+                return len(m), h.hexdigest()
+
+        buffer = bytearray(min(max(size, 1), _BUFFER_SIZE))
+        view = memoryview(buffer)
+        size = 0
+        while n := fd.readinto(buffer):
+            h.update(view[:n])
+            size += n
+
+    return size, h.hexdigest()
+
+def hash_files(paths: Iterable[str | Path], *,
+               threads: int=DEFAULT_HASH_THREADS) -> Iterator[tuple[str, int, str]]:
+    """
+    Yield the path, size and hash of each of PATHS, in order.
+
+    Up to THREADS files are hashed at once. OSError is raised
+    if a file cannot be read.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def work(path: str | Path) -> tuple[str, int, str]:
+        return (os.fspath(path), *hash_file(path))
+
+    with ThreadPoolExecutor(max(threads, 1), thread_name_prefix='jbackup-hash') as pool:
+        yield from pool.map(work, paths)
+
+def make_checksums(directory: str | Path, *,
+                   threads: int=DEFAULT_HASH_THREADS) -> Manifest:
+    """
+    Return a checksum manifest of the files under DIRECTORY.
+
+    The files are named by their path relative to DIRECTORY;
+    its own checksum manifest is left out.
+    """
+    from .scan import scan
+
+    directory = os.path.abspath(directory)
+    entries = [entry for entry in scan([directory])
+               if entry.is_file and entry.path != os.path.join(directory, CHECKSUM_FILE)]
+
+    manifest = Manifest()
+    results = hash_files((entry.path for entry in entries), threads=threads)
+    for entry, (_, _, digest) in zip(entries, results):
+        manifest.add(entry.path[len(directory) + 1:], entry.stat, digest)
+
+    return manifest
+
+def _sample(names: list[str], percent: float, seed: Optional[int]) -> set[str]:
+    if percent >= 100:
+        return set(names)
+
+    import math, random
+
+    count = min(len(names), math.ceil(len(names) * max(percent, 0.0) / 100))
+    return set(random.Random(seed).sample(names, count))
+
+def _verify_directory(directory: Path, manifest: Manifest, selected: set[str],
+                      threads: int) -> tuple[int, int, list[str], list[str]]:
+    missing: list[str] = []
+    corrupt: list[str] = []
+    checked = 0
+    total = 0
+
+    names = sorted(selected)
+    present = []
+    for name in names:
+        if os.path.isfile(directory / name):
+            present.append(name)
+        else:
+            missing.append(name)
+
+    results = hash_files((directory / name for name in present), threads=threads)
+    for name, (_, size, digest) in zip(present, results):
+        entry = manifest.entries[name]
+        checked += 1
+        total += size
+        if size != entry.size or digest != entry.hash:
+            corrupt.append(name)
+
+    return checked, total, missing, corrupt
+
+def _digest(data: bytes) -> str:
+    h = new_hash()
+    h.update(data)
+    return h.hexdigest()
+
+def _verify_archive(archive: Path, manifest: Manifest, selected: set[str],
+                    threads: int) -> tuple[int, int, list[str], list[str]]:
+    # Decompressing is the bottleneck, so members are read here
+    # while the pool hashes those read before
+    from concurrent.futures import ThreadPoolExecutor
+    import lzma, tarfile, zlib
+
+    corrupt: list[str] = []
+    seen: set[str] = set()
+    checked = 0
+    total = 0
+    pending: list[tuple[str, int, Future[str]]] = []
+    reading: Optional[str] = None
+
+    def collect(name: str, size: int, digest: str) -> None:
+        nonlocal checked, total
+        entry = manifest.entries[name]
+        checked += 1
+        total += size
+        if size != entry.size or digest != entry.hash:
+            corrupt.append(name)
+
+    with ThreadPoolExecutor(max(threads, 1), thread_name_prefix='jbackup-hash') as pool:
+        try:
+            with tarfile.open(archive, 'r|*') as tar:
+                for member in tar:
+                    if not member.isreg() or member.name not in selected:
+                        continue
+                    seen.add(member.name)
+                    reading = member.name
+                    fd = tar.extractfile(member)
+                    assert fd is not None
+
+                    if member.size <= _INLINE_LIMIT:
+                        data = fd.read()
+                        reading = None
+                        pending.append((member.name, len(data), pool.submit(_digest, data)))
+                        # Bound the memory held by queued members
+                        while len(pending) > threads * 2:
+                            name, size, future = pending.pop(0)
+                            collect(name, size, future.result())
+                    else:
+                        h = new_hash()
+                        size = 0
+                        while chunk := fd.read(_BUFFER_SIZE):
+                            h.update(chunk)
+                            size += len(chunk)
+                        reading = None
+                        collect(member.name, size, h.hexdigest())
+        except (tarfile.TarError, EOFError, zlib.error, lzma.LZMAError, OSError):
+            # A damaged or truncated archive: the members after
+            # the damage are missing
+            if reading is not None:
+                corrupt.append(reading)
+
+        for name, size, future in pending:
+            collect(name, size, future.result())
+
+    missing = sorted(selected - seen)
+    return checked, total, missing, sorted(corrupt)
+
+def _verify_seekable(archive: Path, manifest: Manifest, selected: set[str],
+                     threads: int) -> tuple[int, int, list[str], list[str]]:
+    # Members are independent, so they are decompressed and hashed in parallel
+    from concurrent.futures import ThreadPoolExecutor
+    from .archive.seekable import ArchiveError, SeekableArchive
+
+    missing: list[str] = []
+    corrupt: list[str] = []
+    checked = 0
+    total = 0
+
+    try:
+        reader = SeekableArchive(archive)
+    except ArchiveError:
+        # Without its index, nothing can be read from the archive
+        return checked, total, sorted(selected), corrupt
+
+    with reader:
+        def check(name: str) -> Optional[tuple[int, str]]:
+            entry = reader.get(name)
+            if entry is None:
+                return None
+            h = new_hash()
+            size = 0
+            try:
+                for data in reader.read(entry):
+                    h.update(data)
+                    size += len(data)
+            except Exception:
+                # Frames that do not decompress, or a hash that does not match
+                return size, ''
+            return size, h.hexdigest()
+
+        names = sorted(selected)
+        with ThreadPoolExecutor(max(threads, 1), thread_name_prefix='jbackup-hash') as pool:
+            for name, result in zip(names, pool.map(check, names)):
+                if result is None:
+                    missing.append(name)
+                    continue
+                size, digest = result
+                entry = manifest.entries[name]
+                checked += 1
+                total += size
+                if size != entry.size or digest != entry.hash:
+                    corrupt.append(name)
+
+    return checked, total, missing, corrupt
+
+def verify(target: str | Path, *, manifest: Optional[Manifest]=None,
+           paths: Iterable[str]=(), sample: float=100.0,
+           threads: int=DEFAULT_HASH_THREADS, seed: Optional[int]=None) -> VerifyResult:
+    """
+    Check TARGET against MANIFEST, or its checksum manifest.
+
+    TARGET is a directory, a tar or seekable archive, or any file whose
+    manifest has a single entry under its own name, such as
+    one written at the end of a chain of actions. If PATHS is
+    not empty, only the files under those paths of the manifest
+    are checked.
+    Only SAMPLE percent of these files, picked at random (with
+    the random SEED), are checked. Up to THREADS files are
+    hashed at once. The files that cannot be read from a
+    damaged archive are reported as corrupt or missing.
+
+    OSError is raised if the manifest cannot be read, and
+    ValueError if it is not a manifest.
+    """
+    target = Path(target)
+    if manifest is None:
+        manifest = Manifest.load(checksum_file(target))
+
+    start = time.perf_counter()
+    paths = [path.strip('/') for path in paths]
+    names = sorted(manifest.entries)
+    if paths:
+        prefixes = tuple(path + '/' for path in paths)
+        names = [name for name in names if name in paths or name.startswith(prefixes)]
+    selected = _sample(names, sample, seed)
+    if target.is_dir():
+        checked, total, missing, corrupt = _verify_directory(target, manifest, selected, threads)
+    elif list(manifest.entries) == [target.name]:
+        # A checksum of the whole file
+        checked, total, missing, corrupt = _verify_directory(target.parent, manifest,
+                                                             selected, threads)
+    else:
+        from .archive.seekable import is_seekable
+
+        check = _verify_seekable if is_seekable(target) else _verify_archive
+        checked, total, missing, corrupt = check(target, manifest, selected, threads)
+
+    return VerifyResult(checked, total, time.perf_counter() - start, missing, corrupt)
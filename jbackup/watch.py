@@ -0,0 +1,343 @@
+"""
+Watching trees for changes with inotify.
+
+The watcher records the paths that change under the roots of
+rules in their change journals (see jbackup.journal), so that
+incremental backups need not scan the whole tree. It uses the
+inotify API of Linux directly, through ctypes.
+
+inotify watches single directories, so every directory under a
+root is watched, and new directories are watched as they appear.
+If the kernel drops events, or a directory cannot be watched, the
+journals concerned are marked as having lost changes; backups
+then scan everything once more.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import TYPE_CHECKING
+from .journal import ChangeJournal, JournalError
+from .logging import get_logger
+import os, errno, struct, time
+
+if TYPE_CHECKING:
+    from threading import Event
+    from typing import Iterable, Optional
+
+__all__ = [
+    # Classes
+    'Inotify',
+    'Watcher',
+
+    # Functions
+    'inotify_available',
+    'watch_roots'
+]
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+               | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+               | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+_EVENT = struct.Struct('iIII')
+
+_libc = None
+
+def _get_libc():
+    global _libc
+
+    if _libc is None:
+        import ctypes, ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+
+    return _libc
+
+def inotify_available() -> bool:
+    """Whether inotify can be used on this system."""
+    try:
+        return hasattr(_get_libc(), 'inotify_init1')
+    except OSError:
+        return False
+
+def _check(result: int, what: str) -> int:
+    if result < 0:
+        import ctypes
+        err = ctypes.get_errno()
+        raise OSError(err, f"{what}: {os.strerror(err)}")
+    return result
+
+class Inotify:
+    """An inotify instance."""
+
+    def __init__(self):
+        self._libc = _get_libc()
+        self.fd = _check(self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC), "inotify_init1")
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch PATH for the events in MASK and return the watch descriptor."""
+        return _check(self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask),
+                      f"cannot watch {path}")
+
+    def rm_watch(self, wd: int) -> None:
+        """Stop the watch WD."""
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout: Optional[float]=None) -> list[tuple[int, int, int, str]]:
+        """
+        Return the pending events, waiting up to TIMEOUT seconds for one.
+
+        Each event is a tuple of the watch descriptor, the event
+        mask, the cookie and the name of the file in the watched
+        directory ('' for the directory itself).
+        """
+        import select
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name))
+
+        return events
+
+    def __enter__(self) -> Inotify:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+def watch_roots(rule) -> list[Path]:
+    """Return the paths that RULE asks to be watched in its 'watch' option."""
+    value = rule.get('/watch', None, True)
+    if not value:
+        return []
+    if isinstance(value, (str, Path)):
+        value = [value]
+    return [Path(str(path)).expanduser() for path in value]
+
+class Watcher:
+    """Records the changes under the roots of rules in their journals."""
+
+    def __init__(self, rules: dict[str, list[Path]], *, flush_interval: float=1.0):
+        """
+        Make a watcher for RULES, which maps rule names to their roots.
+
+        Changes are written to the journals at most every
+        FLUSH_INTERVAL seconds.
+        """
+        self.rules = {name: [os.path.abspath(root) for root in roots]
+                      for name, roots in rules.items()}
+        self.flush_interval = flush_interval
+        self.logger = get_logger('watch')
+
+        self._inotify: Optional[Inotify] = None
+        self._journals: dict[str, ChangeJournal] = {}
+        self._dirs: dict[int, str] = {}
+        self._wds: dict[str, int] = {}
+        self._pending: dict[str, set[str]] = {}
+
+    def _rules_for(self, path: str) -> list[str]:
+        return [name for name, roots in self.rules.items()
+                if name in self._journals
+                and any(path == root or path.startswith(root + '/') for root in roots)]
+
+    def _lost(self, names: Iterable[str], reason: str) -> None:
+        now = time.time()
+        for name in names:
+            self.logger.warning("rule %s: changes were lost: %s", name, reason)
+            self._flush_rule(name)
+            self._journals[name].overflow(now)
+
+    def _drop(self, names: Iterable[str], reason: str) -> None:
+        # Stop the journals of rules whose roots are not all watched;
+        # they are useless until the watcher is started again
+        for name in names:
+            self.logger.error("rule %s: no longer watched: %s", name, reason)
+            self._pending.pop(name, None)
+            journal = self._journals.pop(name)
+            journal.overflow()
+            journal.stop()
+
+    def _watch_tree(self, top: str, recursive: bool=True) -> list[str]:
+        # Watch TOP and the directories under it; return the paths
+        # that were found in new directories
+        assert self._inotify is not None
+        found: list[str] = []
+        stack = [top]
+        while stack:
+            path = stack.pop()
+            try:
+                wd = self._inotify.add_watch(path, _WATCH_MASK)
+            except OSError as exc:
+                if exc.errno in (errno.ENOENT, errno.ENOTDIR):
+                    # Gone already; its parent recorded that
+                    continue
+                self._drop(self._rules_for(path), str(exc))
+                continue
+
+            self._dirs[wd] = path
+            self._wds[path] = wd
+            if not recursive:
+                continue
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        found.append(entry.path)
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+            except OSError:
+                continue
+
+        return found
+
+    def _add(self, paths: Iterable[str]) -> None:
+        for path in paths:
+            for name in self._rules_for(path):
+                self._pending.setdefault(name, set()).add(path)
+
+    def _flush_rule(self, name: str) -> None:
+        paths = self._pending.pop(name, None)
+        if paths:
+            self._journals[name].record(paths)
+
+    def flush(self) -> None:
+        """Write the pending changes to the journals."""
+        for name in list(self._pending):
+            self._flush_rule(name)
+
+    def _handle(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            self._lost(list(self._journals), "the event queue overflowed")
+            return
+
+        directory = self._dirs.get(wd)
+        if directory is None:
+            return
+
+        if mask & IN_IGNORED:
+            del self._dirs[wd]
+            if self._wds.get(directory) == wd:
+                del self._wds[directory]
+            return
+
+        path = os.path.join(directory, name) if name else directory
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # A root that goes away can no longer be watched
+            rules = [rule for rule in self._rules_for(path) if path in self.rules[rule]]
+            if rules:
+                self._drop(rules, f"{path} was removed")
+            self._add([path])
+            return
+
+        self._add([path])
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            # Files can appear in a new directory before it is watched
+            self._add(self._watch_tree(path))
+
+    def start(self) -> None:
+        """Start journals for the rules and watch their roots."""
+        self._inotify = Inotify()
+        for name, roots in self.rules.items():
+            journal = ChangeJournal(name)
+            try:
+                journal.start(roots)
+            except JournalError as exc:
+                self.logger.error("%s", exc)
+                continue
+            self._journals[name] = journal
+
+        for name, roots in self.rules.items():
+            for root in roots:
+                if root in self._wds:
+                    continue
+                if os.path.isdir(root):
+                    self._watch_tree(root)
+                elif os.path.lexists(root):
+                    # A file is watched through its directory
+                    parent = os.path.dirname(root)
+                    if parent not in self._wds:
+                        self._watch_tree(parent, recursive=False)
+                elif name in self._journals:
+                    self._drop([name], f"{root} does not exist")
+
+        for journal in self._journals.values():
+            journal.ready()
+
+        self.logger.info("watching %d directories for %d rules",
+                         len(self._dirs), len(self._journals))
+
+    def stop(self) -> None:
+        """Write the pending changes and stop watching."""
+        self.flush()
+        for journal in self._journals.values():
+            journal.stop()
+        self._journals.clear()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._dirs.clear()
+        self._wds.clear()
+
+    def poll(self, timeout: Optional[float]=None) -> int:
+        """Handle the events that arrive within TIMEOUT seconds; return their number."""
+        assert self._inotify is not None
+        events = self._inotify.read(timeout)
+        for wd, mask, _, name in events:
+            self._handle(wd, mask, name)
+        return len(events)
+
+    def run(self, stop: Event) -> None:
+        """Watch until STOP is set."""
+        self.start()
+        try:
+            last_flush = time.monotonic()
+            while not stop.is_set():
+                self.poll(self.flush_interval)
+                if time.monotonic() - last_flush >= self.flush_interval:
+                    self.flush()
+                    last_flush = time.monotonic()
+        finally:
+            self.stop()